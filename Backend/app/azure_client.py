@@ -1,29 +1,155 @@
 # app/azure_client.py
+import asyncio
+import base64
+import binascii
+import json
 import os
+import threading
+from typing import Iterator
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
-AZURE_ML_ENDPOINT_LEVEL = "https://nivell-classifier-endpoint.spaincentral.inference.ml.azure.com/score"
-AZURE_ML_ENDPOINT_TAP = "https://tap-classifier-endpoint.spaincentral.inference.ml.azure.com/score"
+from .batching import MicroBatcher
+from .config import INFERENCE_BACKEND, ONNX_BATCH_MAX_SIZE, ONNX_BATCH_MAX_WAIT_MS
+from .local_inference import close_local_backend, get_local_backend
+from .metrics import metrics
+from .preprocessing import payload_bytes
+from .resilience import ResilientCaller, RetryBudget
+from .result_cache import result_cache
 
-def predict_level_from_bytes_azure(image_bytes: bytes):
-    AZURE_ML_KEY = os.getenv("AZURE_ML_KEY_LEVEL")  
+AZURE_ML_ENDPOINT_LEVEL = os.getenv(
+    "AZURE_ML_ENDPOINT_LEVEL",
+    "https://nivell-classifier-endpoint.spaincentral.inference.ml.azure.com/score",
+)
+AZURE_ML_ENDPOINT_TAP = os.getenv(
+    "AZURE_ML_ENDPOINT_TAP",
+    "https://tap-classifier-endpoint.spaincentral.inference.ml.azure.com/score",
+)
 
-    if not AZURE_ML_KEY:
-        raise RuntimeError("No s'ha definit la variable d'entorn AZURE_ML_KEY")
+# Formato del cuerpo enviado al endpoint:
+#   hex    -> {"image": "<hex>"}                       (formato original, x2 bytes)
+#   base64 -> {"image": "<b64>", "encoding": "base64"} (x1.33 bytes)
+#   binary -> bytes crudos, Content-Type application/octet-stream (x1)
+# El score.py desplegado debe aceptar el formato elegido.
+PAYLOAD_FORMATS = ("hex", "base64", "binary")
+AZURE_ML_PAYLOAD_FORMAT = os.getenv("AZURE_ML_PAYLOAD_FORMAT", "hex")
 
-    payload = {
-        "image": image_bytes.hex()
-    }
+AZURE_ML_CONNECT_TIMEOUT_S = float(os.getenv("AZURE_ML_CONNECT_TIMEOUT_S", "5"))
+AZURE_ML_READ_TIMEOUT_S = float(os.getenv("AZURE_ML_READ_TIMEOUT_S", "20"))
+AZURE_ML_POOL_SIZE = int(os.getenv("AZURE_ML_POOL_SIZE", "8"))
+# Peticiones simultáneas por endpoint en el cliente async
+AZURE_ML_MAX_CONCURRENCY = int(os.getenv("AZURE_ML_MAX_CONCURRENCY", "16"))
+
+# Micro-batching: 1 = desactivado (una petición por imagen)
+AZURE_ML_BATCH_MAX_SIZE = int(os.getenv("AZURE_ML_BATCH_MAX_SIZE", "1"))
+AZURE_ML_BATCH_MAX_WAIT_MS = float(os.getenv("AZURE_ML_BATCH_MAX_WAIT_MS", "5"))
+
+# Resiliencia por endpoint (app.resilience): petición duplicada (hedge) al
+# pasar el p95, reintentos de errores transitorios con un presupuesto
+# global (fracción de las peticiones) y circuit breaker
+AZURE_ML_HEDGE_ENABLED = os.getenv("AZURE_ML_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+AZURE_ML_HEDGE_QUANTILE = float(os.getenv("AZURE_ML_HEDGE_QUANTILE", "0.95"))
+AZURE_ML_HEDGE_MIN_DELAY_MS = float(os.getenv("AZURE_ML_HEDGE_MIN_DELAY_MS", "50"))
+AZURE_ML_RETRIES = max(0, int(os.getenv("AZURE_ML_RETRIES", "2")))
+AZURE_ML_RETRY_BACKOFF_MS = float(os.getenv("AZURE_ML_RETRY_BACKOFF_MS", "50"))
+AZURE_ML_RETRY_BUDGET_RATIO = float(os.getenv("AZURE_ML_RETRY_BUDGET_RATIO", "0.1"))
+AZURE_ML_RETRY_BUDGET_MIN_PER_S = float(os.getenv("AZURE_ML_RETRY_BUDGET_MIN_PER_S", "1"))
+# Límite por intento (un intento colgado es un error transitorio); 0 = sin límite
+AZURE_ML_ATTEMPT_TIMEOUT_S = float(os.getenv("AZURE_ML_ATTEMPT_TIMEOUT_S", "8"))
+AZURE_ML_BREAKER_FAILURES = max(1, int(os.getenv("AZURE_ML_BREAKER_FAILURES", "5")))
+AZURE_ML_BREAKER_OPEN_S = float(os.getenv("AZURE_ML_BREAKER_OPEN_S", "10"))
+
+
+# Backends de inferencia detrás de predict_*: los endpoints de Azure ML o
+# un runtime ONNX en CPU local (app.local_inference)
+INFERENCE_BACKENDS = ("azure", "onnx")
+
+
+def _use_local_backend() -> bool:
+    if INFERENCE_BACKEND not in INFERENCE_BACKENDS:
+        raise ValueError(f"INFERENCE_BACKEND desconegut: {INFERENCE_BACKEND}")
+    return INFERENCE_BACKEND == "onnx"
+
+
+# Tamaño de los trozos del cuerpo en streaming (múltiplo de 3 para base64)
+PAYLOAD_CHUNK_SIZE = 3 * 32 * 1024
+
+
+def iter_payload(
+    image_bytes, payload_format: str, chunk_size: int = PAYLOAD_CHUNK_SIZE
+) -> tuple[int, str, Iterator[bytes]]:
+    """
+    Codifica el cuerpo por trozos, sin materializar nunca el payload entero.
+
+    Devuelve (content_length, content_type, iterador de trozos). El resultado
+    concatenado es idéntico byte a byte a json.dumps() del payload, así que
+    el endpoint no nota la diferencia. Acepta bytes, bytearray o memoryview.
+    """
+    view = memoryview(image_bytes).cast("B")
+    size = view.nbytes
+
+    if payload_format == "binary":
+        def chunks():
+            for start in range(0, size, chunk_size):
+                yield bytes(view[start:start + chunk_size])
+
+        return size, "application/octet-stream", chunks()
+
+    if payload_format == "base64":
+        prefix, suffix = b'{"image": "', b'", "encoding": "base64"}'
+        encoded_size = 4 * ((size + 2) // 3)
+        encode = base64.b64encode
+    elif payload_format == "hex":
+        prefix, suffix = b'{"image": "', b'"}'
+        encoded_size = 2 * size
+        encode = binascii.hexlify
+    else:
+        raise ValueError(f"Formato de payload desconocido: {payload_format}")
+
+    def chunks():
+        yield prefix
+        for start in range(0, size, chunk_size):
+            yield encode(view[start:start + chunk_size])
+        yield suffix
+
+    return len(prefix) + encoded_size + len(suffix), "application/json", chunks()
+
+
+def encode_payload(image_bytes, payload_format: str) -> tuple[bytes, str]:
+    """Devuelve (cuerpo, content_type) para el formato pedido."""
+    _, content_type, chunks = iter_payload(image_bytes, payload_format)
+    return b"".join(chunks), content_type
+
+
+def encode_batch_payload(images: list[bytes], payload_format: str) -> tuple[bytes, str]:
+    """
+    Cuerpo de una petición batch: {"images": [...], "encoding": ...}.
+    Siempre es JSON; con el formato "binary" las imágenes viajan en base64.
+    """
+    if payload_format == "hex":
+        encoded = [image.hex() for image in images]
+        encoding = "hex"
+    elif payload_format in ("base64", "binary"):
+        encoded = [base64.b64encode(image).decode("ascii") for image in images]
+        encoding = "base64"
+    else:
+        raise ValueError(f"Formato de payload desconocido: {payload_format}")
+    payload = {"images": encoded, "encoding": encoding}
+    return json.dumps(payload).encode("utf-8"), "application/json"
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {AZURE_ML_KEY}",
-    }
 
-    response = requests.post(AZURE_ML_ENDPOINT_LEVEL, headers=headers, json=payload)
-    response.raise_for_status()
-    result = response.json()
+def parse_batch_prediction(result: dict) -> list[tuple[str, float]]:
+    results = result.get("results")
 
+    if not isinstance(results, list):
+        raise ValueError(f"Resposta batch d'Azure ML inesperada: {result}")
+
+    return [parse_prediction(item) for item in results]
+
+
+def parse_prediction(result: dict) -> tuple[str, float]:
     label = result.get("class")
     confidence = result.get("confidence")
 
@@ -33,29 +159,364 @@ def predict_level_from_bytes_azure(image_bytes: bytes):
     return label, confidence
 
 
-def predict_tap_from_bytes_azure(image_bytes: bytes):
-    AZURE_ML_KEY = os.getenv("AZURE_ML_KEY_TAP")
+async def _aiter(chunks: Iterator[bytes]):
+    for chunk in chunks:
+        yield chunk
 
-    if not AZURE_ML_KEY:
-        raise RuntimeError("No s'ha definit la variable d'entorn AZURE_ML_KEY")
 
-    payload = {
-        "image": image_bytes.hex()
+def _auth_headers(key_env: str, content_type: str) -> dict:
+    key = os.getenv(key_env)
+
+    if not key:
+        raise RuntimeError(f"No s'ha definit la variable d'entorn {key_env}")
+
+    return {
+        "Content-Type": content_type,
+        "Authorization": f"Bearer {key}",
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {AZURE_ML_KEY}",
+
+class ScoringClient:
+    """
+    Cliente de un endpoint de scoring de Azure ML.
+
+    Mantiene una requests.Session propia con un pool de conexiones keep-alive,
+    así cada predicción reutiliza la conexión TCP+TLS en lugar de abrir una
+    nueva. Los timeouts (conexión, lectura) se aplican a cada llamada.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        key_env: str,
+        *,
+        payload_format: str = AZURE_ML_PAYLOAD_FORMAT,
+        connect_timeout: float = AZURE_ML_CONNECT_TIMEOUT_S,
+        read_timeout: float = AZURE_ML_READ_TIMEOUT_S,
+        pool_size: int = AZURE_ML_POOL_SIZE,
+    ):
+        if payload_format not in PAYLOAD_FORMATS:
+            raise ValueError(f"Formato de payload desconocido: {payload_format}")
+        self.endpoint = endpoint
+        self.key_env = key_env
+        self.payload_format = payload_format
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def predict(self, image_bytes: bytes, *, timeout=None) -> tuple[str, float]:
+        body, content_type = encode_payload(image_bytes, self.payload_format)
+
+        response = self.session.post(
+            self.endpoint,
+            headers=_auth_headers(self.key_env, content_type),
+            data=body,
+            timeout=timeout or self.timeout,
+        )
+        response.raise_for_status()
+        return parse_prediction(response.json())
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncScoringClient:
+    """
+    Versión asyncio de ScoringClient (httpx.AsyncClient).
+
+    No ocupa ningún hilo mientras espera a Azure: la concurrencia la limita un
+    semáforo (AZURE_ML_MAX_CONCURRENCY) y no el tamaño de un ThreadPool. Si la
+    corrutina se cancela (p. ej. por asyncio.wait_for), httpx aborta la
+    petición HTTP en curso y libera la conexión.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        key_env: str,
+        *,
+        payload_format: str = AZURE_ML_PAYLOAD_FORMAT,
+        connect_timeout: float = AZURE_ML_CONNECT_TIMEOUT_S,
+        read_timeout: float = AZURE_ML_READ_TIMEOUT_S,
+        max_concurrency: int = AZURE_ML_MAX_CONCURRENCY,
+    ):
+        if payload_format not in PAYLOAD_FORMATS:
+            raise ValueError(f"Formato de payload desconocido: {payload_format}")
+        self.endpoint = endpoint
+        self.key_env = key_env
+        self.payload_format = payload_format
+        self.max_concurrency = max(1, max_concurrency)
+        self.in_flight = 0
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+        )
+
+    async def _post(self, body, content_type: str, timeout, content_length: int | None = None) -> dict:
+        headers = _auth_headers(self.key_env, content_type)
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                response = await self._client.post(
+                    self.endpoint,
+                    headers=headers,
+                    content=body,
+                    timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+                )
+            finally:
+                self.in_flight -= 1
+
+        response.raise_for_status()
+        return response.json()
+
+    async def predict(self, image_bytes: bytes, *, timeout=None) -> tuple[str, float]:
+        # El cuerpo se envía en streaming: nunca existe una copia hex/base64
+        # completa de la imagen en memoria
+        content_length, content_type, chunks = iter_payload(image_bytes, self.payload_format)
+        return parse_prediction(
+            await self._post(_aiter(chunks), content_type, timeout, content_length)
+        )
+
+    async def predict_batch(self, images: list[bytes], *, timeout=None) -> list[tuple[str, float]]:
+        """Una sola petición para varias imágenes (el endpoint debe soportarlo)."""
+        body, content_type = encode_batch_payload(images, self.payload_format)
+        return parse_batch_prediction(await self._post(body, content_type, timeout))
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+_clients: dict[str, ScoringClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_scoring_client(model: str) -> ScoringClient:
+    """Cliente compartido (un pool por endpoint) para 'tap' o 'level'."""
+    client = _clients.get(model)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(model)
+        if client is not None:
+            return client
+        if model == "tap":
+            client = ScoringClient(AZURE_ML_ENDPOINT_TAP, "AZURE_ML_KEY_TAP")
+        elif model == "level":
+            client = ScoringClient(AZURE_ML_ENDPOINT_LEVEL, "AZURE_ML_KEY_LEVEL")
+        else:
+            raise ValueError(f"Model desconegut: {model}")
+        _clients[model] = client
+        return client
+
+
+def _predict_sync(model: str, image, timeout=None):
+    if _use_local_backend():
+        return get_local_backend().get_classifier(model).predict(image)
+    return get_scoring_client(model).predict(payload_bytes(image), timeout=timeout)
+
+
+def predict_level_from_bytes_azure(image_bytes: bytes, *, timeout=None):
+    return _predict_sync("level", image_bytes, timeout)
+
+
+def predict_tap_from_bytes_azure(image_bytes: bytes, *, timeout=None):
+    return _predict_sync("tap", image_bytes, timeout)
+
+
+_async_clients: dict[str, AsyncScoringClient] = {}
+
+
+def get_async_scoring_client(model: str) -> AsyncScoringClient:
+    """Cliente async compartido para 'tap' o 'level' (solo desde el event loop)."""
+    client = _async_clients.get(model)
+    if client is None:
+        if model == "tap":
+            client = AsyncScoringClient(AZURE_ML_ENDPOINT_TAP, "AZURE_ML_KEY_TAP")
+        elif model == "level":
+            client = AsyncScoringClient(AZURE_ML_ENDPOINT_LEVEL, "AZURE_ML_KEY_LEVEL")
+        else:
+            raise ValueError(f"Model desconegut: {model}")
+        _async_clients[model] = client
+    return client
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """Errores que merece la pena reintentar (y que cuentan para el breaker)."""
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status in (408, 429) or status >= 500
+    return False
+
+
+retry_budget = RetryBudget(AZURE_ML_RETRY_BUDGET_RATIO, AZURE_ML_RETRY_BUDGET_MIN_PER_S)
+_resilient_callers: dict[str, ResilientCaller] = {}
+
+
+def get_resilient_caller(model: str) -> ResilientCaller:
+    """Política de hedging/reintentos/breaker del endpoint de 'tap' o 'level'."""
+    caller = _resilient_callers.get(model)
+    if caller is None:
+        caller = ResilientCaller(
+            model,
+            retry_budget,
+            is_transient=is_transient_error,
+            hedge=AZURE_ML_HEDGE_ENABLED,
+            hedge_quantile=AZURE_ML_HEDGE_QUANTILE,
+            hedge_min_delay_s=AZURE_ML_HEDGE_MIN_DELAY_MS / 1000,
+            retries=AZURE_ML_RETRIES,
+            retry_backoff_s=AZURE_ML_RETRY_BACKOFF_MS / 1000,
+            attempt_timeout_s=AZURE_ML_ATTEMPT_TIMEOUT_S or None,
+            breaker_failures=AZURE_ML_BREAKER_FAILURES,
+            breaker_open_s=AZURE_ML_BREAKER_OPEN_S,
+        )
+        _resilient_callers[model] = caller
+    return caller
+
+
+def resilience_stats() -> dict:
+    return {
+        "retry_budget": {
+            "tokens": round(retry_budget.tokens, 2),
+            "spent": retry_budget.spent,
+            "exhausted": retry_budget.exhausted,
+        },
+        "endpoints": {model: caller.stats() for model, caller in sorted(_resilient_callers.items())},
     }
 
-    response = requests.post(AZURE_ML_ENDPOINT_TAP, headers=headers, json=payload)
-    response.raise_for_status()
-    result = response.json()
 
-    label = result.get("class")
-    confidence = result.get("confidence")
+metrics.gauge(
+    "scoring_retries_total",
+    "Reintents de crides de scoring",
+    lambda: sum(c.retried for c in _resilient_callers.values()),
+    kind="counter",
+)
+metrics.gauge(
+    "scoring_hedges_total",
+    "Peticions duplicades (hedge) de scoring",
+    lambda: sum(c.hedges for c in _resilient_callers.values()),
+    kind="counter",
+)
+metrics.gauge(
+    "scoring_circuits_open",
+    "Endpoints de scoring amb el circuit obert",
+    lambda: sum(c.breaker.state != "closed" for c in _resilient_callers.values()),
+)
+metrics.gauge(
+    "retry_budget_tokens",
+    "Fitxes disponibles al pressupost de reintents",
+    lambda: retry_budget.tokens,
+)
 
-    if label is None:
-        raise ValueError(f"Resposta d'Azure ML inesperada: {result}")
 
-    return label, confidence
\ No newline at end of file
+_batchers: dict[str, MicroBatcher] = {}
+
+
+def get_batcher(model: str) -> MicroBatcher | None:
+    """MicroBatcher del modelo, o None si el batching está desactivado."""
+    local = _use_local_backend()
+    max_batch_size = ONNX_BATCH_MAX_SIZE if local else AZURE_ML_BATCH_MAX_SIZE
+    if max_batch_size <= 1:
+        return None
+    batcher = _batchers.get(model)
+    if batcher is None:
+        if local:
+            backend = get_local_backend()
+
+            async def predict_batch(images: list[bytes]):
+                return await backend.predict_batch(model, images)
+
+            max_wait_ms = ONNX_BATCH_MAX_WAIT_MS
+        else:
+            client = get_async_scoring_client(model)
+            caller = get_resilient_caller(model)
+
+            async def predict_batch(images: list[bytes]):
+                return await caller.call(lambda: client.predict_batch(images))
+
+            max_wait_ms = AZURE_ML_BATCH_MAX_WAIT_MS
+        batcher = MicroBatcher(
+            predict_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name=model,
+        )
+        _batchers[model] = batcher
+    return batcher
+
+
+async def _predict_async(model: str, image, timeout=None):
+    """`image`: bytes o PreprocessedImage (app.preprocessing)."""
+    local = _use_local_backend()
+    if local:
+        model_id = get_local_backend().get_classifier(model).identity
+    else:
+        client = get_async_scoring_client(model)
+        model_id = client.endpoint
+    image_bytes = payload_bytes(image)
+
+    cache_key = None
+    if result_cache.enabled:
+        cache_key = result_cache.make_key(model_id, image_bytes)
+        cached = await result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    batcher = get_batcher(model)
+    with metrics.stage(f"scoring_{model}"):
+        if batcher is not None:
+            # El backend local recibe la imagen ya decodificada
+            result = await batcher.predict(image if local else image_bytes)
+        elif local:
+            result = await get_local_backend().predict(model, image)
+        else:
+            result = await get_resilient_caller(model).call(
+                lambda: client.predict(image_bytes, timeout=timeout)
+            )
+
+    if cache_key is not None:
+        result_cache.put(cache_key, result)
+    return result
+
+
+async def predict_level_async(image_bytes: bytes, *, timeout=None):
+    return await _predict_async("level", image_bytes, timeout)
+
+
+async def predict_tap_async(image_bytes: bytes, *, timeout=None):
+    return await _predict_async("tap", image_bytes, timeout)
+
+
+async def warmup_inference():
+    """
+    Con el backend local, carga las sesiones ONNX al arrancar la app para que
+    la primera botella no pague la carga del modelo.
+    """
+    if _use_local_backend():
+        await get_local_backend().warmup()
+
+
+async def close_async_clients():
+    """Cierra los batchers, los pools async y el backend local (shutdown de la app)."""
+    batchers = list(_batchers.values())
+    _batchers.clear()
+    for batcher in batchers:
+        await batcher.aclose()
+
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
+    close_local_backend()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+PredictBatchFn = Callable[[list[bytes]], Awaitable[list[tuple[str, float]]]]
+
+
+class MicroBatcher:
+    """
+    Agrupa predicciones individuales en peticiones batch a un modelo.
+
+    Cada llamada a predict() deja su imagen en el lote actual y espera su
+    resultado. El lote se envía cuando llega a `max_batch_size` imágenes o
+    cuando han pasado `max_wait_ms` desde la primera, lo que ocurra antes.
+    La respuesta batch se reparte después a cada llamador, en orden.
+    """
+
+    def __init__(
+        self,
+        predict_batch: PredictBatchFn,
+        *,
+        max_batch_size: int,
+        max_wait_ms: float,
+        name: str = "",
+    ):
+        self.name = name
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000
+        self._predict_batch = predict_batch
+        self._pending: list[tuple[bytes, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._in_flight: set[asyncio.Task] = set()
+
+        self.batches = 0
+        self.images = 0
+        self.full_batches = 0
+
+    async def predict(self, image_bytes: bytes) -> tuple[str, float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((image_bytes, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self.full_batches += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_s, self._flush)
+
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000,
+            "batches": self.batches,
+            "images": self.images,
+            "full_batches": self.full_batches,
+            "avg_batch_size": round(self.images / self.batches, 2) if self.batches else 0.0,
+            "pending": len(self._pending),
+        }
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        # Los llamadores que ya se han cancelado no se envían
+        batch = [(image, future) for image, future in batch if not future.done()]
+        if not batch:
+            return
+
+        self.batches += 1
+        self.images += len(batch)
+        task = asyncio.get_running_loop().create_task(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch: list[tuple[bytes, asyncio.Future]]):
+        try:
+            results = await self._predict_batch([image for image, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(
+                    f"Batch de {len(batch)} imatges amb {len(results)} resultats"
+                )
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"[batching] ❌ {self.name} - Error en batch de {len(batch)}: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def aclose(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for _, future in self._pending:
+            future.cancel()
+        self._pending = []
+        for task in list(self._in_flight):
+            task.cancel()
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
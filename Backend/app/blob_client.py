@@ -1,6 +1,34 @@
+import asyncio
+import logging
 import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
 from azure.storage.blob import BlobServiceClient, ContentSettings
-from .config import AZURE_STORAGE_CONNECTION_STRING, CONTAINER_ERRORS
+from .buffers import BufferWriter
+from .metrics import metrics
+from .config import (
+    AZURE_STORAGE_CONNECTION_STRING,
+    BLOB_LOCAL_ROOT,
+    BLOB_NAME_PREFIX,
+    CONTAINER_ERRORS,
+    UPLOAD_BACKOFF_S,
+    UPLOAD_BLOCK_CONCURRENCY,
+    UPLOAD_BLOCK_SIZE_MB,
+    UPLOAD_DRAIN_TIMEOUT_S,
+    UPLOAD_MAX_BACKOFF_S,
+    UPLOAD_QUEUE_SIZE,
+    UPLOAD_RETRIES,
+    UPLOAD_SINGLE_PUT_MB,
+    UPLOAD_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
 
 _service_client: BlobServiceClient | None = None
 
@@ -10,20 +38,72 @@ def _get_service_client() -> BlobServiceClient:
     if _service_client is None:
         if not AZURE_STORAGE_CONNECTION_STRING:
             raise RuntimeError("AZURE_STORAGE_CONNECTION_STRING no está configurada")
-        _service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
+        # Por encima de max_single_put_size, upload_blob sube el blob por
+        # bloques (stage_block + commit) con max_concurrency hilos
+        _service_client = BlobServiceClient.from_connection_string(
+            AZURE_STORAGE_CONNECTION_STRING,
+            max_single_put_size=UPLOAD_SINGLE_PUT_MB * 2**20,
+            max_block_size=UPLOAD_BLOCK_SIZE_MB * 2**20,
+        )
     return _service_client
 
-def read_image_bytes(container: str, blob_name: str) -> bytes:
+
+def _local_path(container: str, blob_name: str = "") -> Path:
+    """Ruta del blob dentro del sustituto local (BLOB_LOCAL_ROOT)."""
+    return Path(BLOB_LOCAL_ROOT) / container / blob_name
+
+
+def _write_local(container: str, blob_name: str, data: bytes):
+    path = _local_path(container, blob_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_bytes(data)
+    # Renombrado atómico: el watcher nunca ve un fichero a medio escribir
+    os.replace(tmp, path)
+
+
+@metrics.timed("read_image_bytes")
+def read_image_bytes(container: str, blob_name: str) -> bytearray:
+    """
+    Descarga un blob directamente en un bytearray del tamaño exacto
+    (sin el buffer intermedio + copia final de readall()).
+    """
+    if BLOB_LOCAL_ROOT:
+        path = _local_path(container, blob_name)
+        with open(path, "rb", buffering=0) as f:
+            buffer = bytearray(os.fstat(f.fileno()).st_size)
+            f.readinto(buffer)
+        return buffer
+
     blob = _get_service_client().get_blob_client(container=container, blob=blob_name)
     max_concurrency = int(os.getenv("AZURE_BLOB_DOWNLOAD_CONCURRENCY", "4"))
     if max_concurrency < 1:
         max_concurrency = 1
-    return blob.download_blob(max_concurrency=max_concurrency).readall()
+    downloader = blob.download_blob(max_concurrency=max_concurrency)
+    buffer = bytearray(downloader.size)
+    with BufferWriter(buffer) as writer:
+        downloader.readinto(writer)
+    return buffer
+
+
+@metrics.timed("upload_blob")
+def _put_blob(container: str, blob_name: str, data: bytes, content_type: str = "application/octet-stream"):
+    if BLOB_LOCAL_ROOT:
+        _write_local(container, blob_name, data)
+        return
+
+    blob = _get_service_client().get_blob_client(container=container, blob=blob_name)
+    blob.upload_blob(
+        data,
+        overwrite=True,
+        max_concurrency=UPLOAD_BLOCK_CONCURRENCY,
+        content_settings=ContentSettings(content_type=content_type),
+    )
 
 
 def upload_pdf(filename: str, pdf_bytes: bytes):
-    blob = _get_service_client().get_blob_client(container=CONTAINER_ERRORS, blob=filename)
-    blob.upload_blob(pdf_bytes, overwrite=True)
+    """Subida síncrona (bloquea el hilo). Desde código async: upload_service."""
+    _put_blob(CONTAINER_ERRORS, filename, pdf_bytes, "application/pdf")
 
 
 def upload_image_bytes(
@@ -38,16 +118,414 @@ def upload_image_bytes(
     Aunque el sistema sea Blob-only, esto evita errores de import y permite
     guardar evidencias (si se usa).
     """
-    blob = _get_service_client().get_blob_client(container=container, blob=blob_name)
-    blob.upload_blob(
-        image_bytes,
-        overwrite=True,
-        content_settings=ContentSettings(content_type=content_type),
-    )
+    _put_blob(container, blob_name, image_bytes, content_type)
+
+
+class UploadQueueFull(Exception):
+    """La cola de subidas está llena: el llamador decide si descarta o reintenta."""
+
+
+@dataclass
+class UploadResult:
+    upload_id: int
+    container: str
+    blob_name: str
+    size: int
+    ok: bool
+    attempts: int
+    seconds: float  # desde que se encoló hasta que terminó
+    coalesced: int = 0
+    error: str | None = None
+
+
+@dataclass(eq=False)
+class Upload:
+    """Subida aceptada por el UploadService. `done` se resuelve con un UploadResult."""
+    upload_id: int
+    container: str
+    blob_name: str
+    data: bytes
+    content_type: str
+    done: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    callbacks: list[Callable[[UploadResult], None]] = field(default_factory=list)
+    coalesced: int = 0
+    started: bool = False
+
+
+class UploadService:
+    """
+    Subidas a Blob Storage en segundo plano, fuera del event loop y del
+    executor por defecto (que usa el pipeline).
+
+    - Cola acotada: submit_nowait() lanza UploadQueueFull si está llena;
+      submit() espera hueco (contrapresión para productores en segundo plano).
+    - Coalescencia: una subida al mismo blob que aún espera en la cola
+      sustituye los datos de la pendiente (overwrite=True: solo cuenta la
+      última) y comparte su resultado.
+    - Blobs grandes por bloques en paralelo (UPLOAD_BLOCK_* en el cliente).
+    - Reintentos con backoff exponencial y jitter.
+    - Al terminar: `Upload.done`, los callbacks `on_done`, status(upload_id)
+      y stats().
+    """
+
+    def __init__(
+        self,
+        workers: int = UPLOAD_WORKERS,
+        queue_size: int = UPLOAD_QUEUE_SIZE,
+        retries: int = UPLOAD_RETRIES,
+        backoff_s: float = UPLOAD_BACKOFF_S,
+        max_backoff_s: float = UPLOAD_MAX_BACKOFF_S,
+        drain_timeout_s: float = UPLOAD_DRAIN_TIMEOUT_S,
+        keep_results: int = 1000,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max(backoff_s, max_backoff_s)
+        self.drain_timeout_s = drain_timeout_s
+        self.keep_results = keep_results
+        self._rng = rng
+        self._queue: asyncio.Queue | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._next_id = 1
+        self._waiting: dict[tuple[str, str], Upload] = {}  # en cola, aún sin empezar
+        self._active: dict[int, Upload] = {}
+        self._results: OrderedDict[int, UploadResult] = OrderedDict()
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.uploaded = 0
+        self.failed = 0
+        self.retried = 0
+        self.in_flight = 0
+        self.bytes_uploaded = 0
+        self.upload_seconds_total = 0.0
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload")
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    def _coalesce(self, container, blob_name, data, content_type, on_done) -> Upload | None:
+        upload = self._waiting.get((container, blob_name))
+        if upload is None or upload.started:
+            return None
+        upload.data = data
+        upload.content_type = content_type
+        upload.coalesced += 1
+        if on_done is not None:
+            upload.callbacks.append(on_done)
+        self.submitted += 1
+        self.coalesced += 1
+        return upload
+
+    def _new_upload(self, container, blob_name, data, content_type, on_done) -> Upload:
+        upload = Upload(
+            upload_id=self._next_id,
+            container=container,
+            blob_name=blob_name,
+            data=data,
+            content_type=content_type,
+            done=asyncio.get_running_loop().create_future(),
+            callbacks=[on_done] if on_done is not None else [],
+        )
+        self._next_id += 1
+        return upload
+
+    def _accept(self, upload: Upload):
+        self._waiting[(upload.container, upload.blob_name)] = upload
+        self._active[upload.upload_id] = upload
+        self.submitted += 1
+
+    def submit_nowait(
+        self,
+        container: str,
+        blob_name: str,
+        data: bytes,
+        *,
+        content_type: str = "application/octet-stream",
+        on_done: Callable[[UploadResult], None] | None = None,
+    ) -> Upload:
+        """Encola una subida sin esperar. Lanza UploadQueueFull si no cabe."""
+        self._ensure_started()
+        upload = self._coalesce(container, blob_name, data, content_type, on_done)
+        if upload is not None:
+            return upload
+        upload = self._new_upload(container, blob_name, data, content_type, on_done)
+        try:
+            self._queue.put_nowait(upload)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise UploadQueueFull(f"{container}/{blob_name}") from None
+        self._accept(upload)
+        return upload
+
+    async def submit(
+        self,
+        container: str,
+        blob_name: str,
+        data: bytes,
+        *,
+        content_type: str = "application/octet-stream",
+        on_done: Callable[[UploadResult], None] | None = None,
+    ) -> Upload:
+        """Como submit_nowait(), pero espera hueco en la cola si está llena."""
+        self._ensure_started()
+        upload = self._coalesce(container, blob_name, data, content_type, on_done)
+        if upload is not None:
+            return upload
+        upload = self._new_upload(container, blob_name, data, content_type, on_done)
+        await self._queue.put(upload)
+        self._accept(upload)
+        return upload
+
+    async def upload(self, container: str, blob_name: str, data: bytes, **kwargs) -> UploadResult:
+        """Encola y espera el resultado (sin bloquear el event loop)."""
+        upload = await self.submit(container, blob_name, data, **kwargs)
+        # shield: si se cancela quien espera, la subida sigue para los demás
+        return await asyncio.shield(upload.done)
+
+    def status(self, upload_id: int) -> dict | None:
+        upload = self._active.get(upload_id)
+        if upload is not None:
+            return {
+                "upload_id": upload_id,
+                "container": upload.container,
+                "blob_name": upload.blob_name,
+                "status": "uploading" if upload.started else "queued",
+            }
+        result = self._results.get(upload_id)
+        if result is None:
+            return None
+        return {**result.__dict__, "status": "stored" if result.ok else "failed"}
+
+    async def stop(self):
+        """Intenta vaciar la cola (hasta drain_timeout_s) y para los workers."""
+        if not self._tasks:
+            return
+        pending = self._queue.qsize() + self.in_flight
+        if pending:
+            logger.info(f"[blob_client] ⏳ Esperando {pending} subidas pendientes")
+            try:
+                await asyncio.wait_for(self._queue.join(), self.drain_timeout_s)
+            except asyncio.TimeoutError:
+                logger.error(
+                    f"[blob_client] ❌ {self._queue.qsize() + self.in_flight} subidas sin terminar al parar"
+                )
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for upload in self._active.values():
+            if not upload.done.done():
+                upload.done.cancel()
+        self._active.clear()
+        self._waiting.clear()
+        self._queue = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "uploaded": self.uploaded,
+            "failed": self.failed,
+            "retries": self.retried,
+            "mb_uploaded": round(self.bytes_uploaded / 2**20, 2),
+            "upload_ms_avg": round(1000 * self.upload_seconds_total / self.uploaded, 2) if self.uploaded else 0.0,
+        }
+
+    async def _run(self):
+        while True:
+            upload = await self._queue.get()
+            self._waiting.pop((upload.container, upload.blob_name), None)
+            upload.started = True
+            self.in_flight += 1
+            try:
+                result = await self._upload(upload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = self._result(upload, ok=False, attempts=0, error=str(e))
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+            self._complete(upload, result)
+
+    def _result(self, upload: Upload, ok: bool, attempts: int, error: str | None = None) -> UploadResult:
+        return UploadResult(
+            upload_id=upload.upload_id,
+            container=upload.container,
+            blob_name=upload.blob_name,
+            size=len(upload.data),
+            ok=ok,
+            attempts=attempts,
+            seconds=round(time.monotonic() - upload.enqueued_at, 4),
+            coalesced=upload.coalesced,
+            error=error,
+        )
+
+    async def _upload(self, upload: Upload) -> UploadResult:
+        loop = asyncio.get_running_loop()
+        metrics.observe("upload_wait", time.monotonic() - upload.enqueued_at)
+        name = f"{upload.container}/{upload.blob_name}"
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                await loop.run_in_executor(
+                    self._executor, _put_blob, upload.container, upload.blob_name, upload.data, upload.content_type
+                )
+            except Exception as e:
+                if attempt == self.retries:
+                    logger.error(f"[blob_client] ❌ {name} - Subida fallida tras {attempt + 1} intentos: {e}")
+                    return self._result(upload, ok=False, attempts=attempt + 1, error=str(e))
+                self.retried += 1
+                delay = min(self.max_backoff_s, self.backoff_s * (2 ** attempt)) * (0.5 + self._rng())
+                logger.warning(f"[blob_client] 🔁 {name} - Reintento de subida en {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                continue
+            self.uploaded += 1
+            self.bytes_uploaded += len(upload.data)
+            self.upload_seconds_total += time.perf_counter() - start
+            return self._result(upload, ok=True, attempts=attempt + 1)
+
+    def _complete(self, upload: Upload, result: UploadResult):
+        if not result.ok:
+            self.failed += 1
+        self._active.pop(upload.upload_id, None)
+        self._results[upload.upload_id] = result
+        while len(self._results) > self.keep_results:
+            self._results.popitem(last=False)
+        upload.data = b""  # los bytes no se retienen en el historial
+        if not upload.done.done():
+            upload.done.set_result(result)
+        for callback in upload.callbacks:
+            try:
+                callback(result)
+            except Exception as e:
+                logger.error(f"[blob_client] ❌ Error en el callback de {upload.blob_name}: {e}")
+
+
+upload_service = UploadService()
+
+metrics.gauge(
+    "upload_queue_depth",
+    "Pujades a Blob Storage esperant a la cua",
+    lambda: upload_service._queue.qsize() if upload_service._queue else 0,
+)
+metrics.gauge(
+    "uploads_in_flight",
+    "Pujades a Blob Storage en curs",
+    lambda: upload_service.in_flight,
+)
+metrics.gauge(
+    "upload_failures_total",
+    "Pujades a Blob Storage fallides després de tots els reintents",
+    lambda: upload_service.failed,
+    kind="counter",
+)
+
 
 def list_blobs(container: str):
     """
     Devuelve una lista de nombres de blobs en el contenedor dado.
     """
+    if BLOB_LOCAL_ROOT:
+        names, _ = list_blob_page(container, page_size=None)
+        return names
+
+    container_client = _get_service_client().get_container_client(container)
+    return [blob.name for blob in container_client.list_blobs()]
+
+
+@metrics.timed("reconcile_listing")
+def list_blobs_modified_since(
+    container: str,
+    since: float,
+    prefix: str | None = BLOB_NAME_PREFIX,
+) -> list[tuple[str, float]]:
+    """
+    (nombre, última modificación epoch) de los blobs modificados desde
+    `since`. Recorre el contenedor entero: solo para la reconciliación
+    periódica del cursor, nunca en cada poll.
+    """
+    if BLOB_LOCAL_ROOT:
+        directory = _local_path(container)
+        if not directory.is_dir():
+            return []
+        recent = []
+        for entry in os.scandir(directory):
+            if not entry.is_file() or entry.name.endswith(".part"):
+                continue
+            if prefix is not None and not entry.name.startswith(prefix):
+                continue
+            modified = entry.stat().st_mtime
+            if modified >= since:
+                recent.append((entry.name, modified))
+        return sorted(recent)
+
+    container_client = _get_service_client().get_container_client(container)
+    recent = []
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        modified = blob.last_modified.timestamp()
+        if modified >= since:
+            recent.append((blob.name, modified))
+    return recent
+
+
+@metrics.timed("listing")
+def list_blob_page(
+    container: str,
+    marker: str | None = None,
+    page_size: int | None = 1000,
+    prefix: str | None = BLOB_NAME_PREFIX,
+) -> tuple[list[str], str | None]:
+    """
+    Devuelve UNA página del listado (orden lexicográfico) empezando en `marker`.
+
+    Retorna (nombres, siguiente_marker). `siguiente_marker` es None cuando la
+    página es la última del contenedor. El marker es opaco para el llamador:
+    en Azure es el continuation token del servicio, en el sustituto local es
+    el último nombre de la página anterior.
+    """
+    if BLOB_LOCAL_ROOT:
+        directory = _local_path(container)
+        if not directory.is_dir():
+            return [], None
+        names = sorted(
+            entry.name
+            for entry in os.scandir(directory)
+            if entry.is_file()
+            and not entry.name.endswith(".part")
+            and (prefix is None or entry.name.startswith(prefix))
+            and (marker is None or entry.name > marker)
+        )
+        if page_size is None or len(names) <= page_size:
+            return names, None
+        page = names[:page_size]
+        return page, page[-1]
+
     container_client = _get_service_client().get_container_client(container)
-    return [blob.name for blob in container_client.list_blobs()]
\ No newline at end of file
+    pager = container_client.list_blobs(
+        name_starts_with=prefix,
+        results_per_page=page_size,
+    ).by_page(continuation_token=marker)
+    try:
+        page = next(pager)
+    except StopIteration:
+        return [], None
+    names = [blob.name for blob in page]
+    return names, pager.continuation_token or None
@@ -0,0 +1,151 @@
+import bisect
+import logging
+import time
+from typing import Callable
+
+from .blob_client import list_blob_page, list_blobs_modified_since
+from .config import BLOB_LIST_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# (container, marker, page_size) -> (nombres, siguiente_marker)
+ListPageFn = Callable[[str, str | None, int], tuple[list[str], str | None]]
+# (container, since) -> [(nombre, última modificación)]
+ListRecentFn = Callable[[str, float], list[tuple[str, float]]]
+
+# Margen sobre la hora de modificación al decidir si un blob quedó por
+# detrás del cursor (relojes de Storage y listados en curso)
+_FLOOR_MARGIN_S = 5.0
+# Solape entre reconciliaciones (blobs cuya subida terminó durante el listado)
+_RECONCILE_OVERLAP_S = 60.0
+
+
+class ContainerCursor:
+    """
+    Descubrimiento incremental de blobs nuevos en un contenedor.
+
+    En lugar de listar el contenedor entero en cada poll, el cursor recuerda
+    el marker de la última página (la que aún se está llenando) y solo vuelve
+    a pedir desde ahí. El coste de cada poll es, como mucho, una página más
+    lo que haya llegado desde el poll anterior, sin importar cuántos blobs
+    históricos tenga el contenedor.
+
+    Supone que los nombres nuevos se ordenan lexicográficamente DESPUÉS de
+    los existentes (p. ej. bottle_000013_tap.jpg con contador con ceros a la
+    izquierda, o prefijos de fecha). Un blob que se escriba "por detrás" del
+    marker actual no lo devuelve poll(): reconcile() los busca con un
+    listado completo (periódico, desde el watcher).
+    """
+
+    def __init__(
+        self,
+        container: str,
+        list_page: ListPageFn = list_blob_page,
+        page_size: int = BLOB_LIST_PAGE_SIZE,
+        list_recent: ListRecentFn = list_blobs_modified_since,
+    ):
+        self.container = container
+        self.page_size = max(1, page_size)
+        self._list_page = list_page
+        self._list_recent = list_recent
+        # Marker de la página actual y nombres ya vistos dentro de ella
+        self.page_marker: str | None = None
+        self._page_seen: set[str] = set()
+        # Último nombre de las páginas completas ya dejadas atrás (el marker
+        # de Azure es opaco): poll() no volverá a ver nada <= page_floor.
+        # _floors: (hora, suelo) de cada avance, para la reconciliación
+        self.page_floor: str | None = None
+        self._floors: list[tuple[float, str]] = []
+        # Última reconciliación y desde qué hora listará la siguiente (esta
+        # se persiste con el cursor: el histórico anterior no se reconcilia)
+        self.reconciled_at: float | None = None
+        self.reconcile_from: float | None = None
+        # Peticiones de listado hechas (cada una es una llamada a Storage)
+        self.list_calls = 0
+
+    def poll(self) -> list[str]:
+        """Devuelve los blobs aparecidos desde el poll anterior (bloqueante)."""
+        new_blobs: list[str] = []
+        while True:
+            names, next_marker = self._list_page(
+                self.container, self.page_marker, self.page_size
+            )
+            self.list_calls += 1
+            new_blobs.extend(n for n in names if n not in self._page_seen)
+
+            if next_marker is None:
+                # Última página: la recordamos para el próximo poll
+                self._page_seen = set(names)
+                return new_blobs
+
+            # Página completa: avanzamos y ya no la volveremos a pedir
+            self.page_marker = next_marker
+            self._page_seen = set()
+            if names:
+                self.page_floor = max(names[-1], self.page_floor or "")
+                self._floors.append((time.time(), self.page_floor))
+
+    def get_state(self) -> dict:
+        """Estado serializable del cursor (para persistirlo en el ledger)."""
+        return {
+            "page_marker": self.page_marker,
+            "page_seen": sorted(self._page_seen),
+            "page_floor": self.page_floor,
+            "reconcile_from": self.reconcile_from,
+        }
+
+    def set_state(self, state: dict):
+        self.page_marker = state.get("page_marker")
+        self._page_seen = set(state.get("page_seen") or ())
+        self.page_floor = state.get("page_floor")
+        self.reconciled_at = time.time()
+        # Estado guardado antes de existir la reconciliación: cuenta desde ahora
+        self.reconcile_from = state.get("reconcile_from") or self.reconciled_at
+        self._floors = []
+
+    def _floor_at(self, when: float) -> str | None:
+        """Suelo del cursor en el instante `when` (el actual si no hay historia)."""
+        i = bisect.bisect_right(self._floors, when, key=lambda floor: floor[0])
+        if i:
+            return self._floors[i - 1][1]
+        # Antes del primer avance conocido (o tras reanudar): el más bajo que se sabe
+        return self._floors[0][1] if self._floors else self.page_floor
+
+    def reconcile_due(self, interval: float) -> bool:
+        return self.reconciled_at is not None and time.time() - self.reconciled_at >= interval
+
+    def reconcile(self) -> list[str]:
+        """
+        Blobs modificados desde la reconciliación anterior que poll() no ha
+        podido devolver: su nombre ya quedaba por detrás del suelo del cursor
+        cuando se escribieron. Listado completo del contenedor (bloqueante,
+        caro: solo cada BLOB_RECONCILE_INTERVAL_S).
+        """
+        started = time.time()
+        since = self.reconcile_from or started
+        missed = []
+        if self.page_floor is not None:
+            for name, modified in self._list_recent(self.container, since):
+                floor = self._floor_at(modified + _FLOOR_MARGIN_S)
+                if floor is not None and name <= floor:
+                    missed.append(name)
+        # La historia anterior a esta reconciliación ya no hace falta
+        keep = bisect.bisect_left(self._floors, since, key=lambda floor: floor[0])
+        if keep:
+            self._floors = self._floors[keep - 1:]
+        self.reconciled_at = started
+        # Con solape, pero nunca antes del histórico que saltó fast_forward()
+        self.reconcile_from = max(started - _RECONCILE_OVERLAP_S, since)
+        return missed
+
+    def fast_forward(self) -> list[str]:
+        """
+        Sitúa el cursor al final del contenedor.
+
+        Se usa al arrancar para no reprocesar el histórico. Devuelve solo los
+        nombres de la última página (los más recientes), que son los únicos
+        que pueden estar esperando a su pareja.
+        """
+        self.poll()
+        self.reconciled_at = self.reconcile_from = time.time()
+        return sorted(self._page_seen)
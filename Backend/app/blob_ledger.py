@@ -0,0 +1,285 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .config import (
+    BLOB_LEDGER_CACHE_SIZE,
+    BLOB_LEDGER_PATH,
+    BLOB_LEDGER_RETENTION_S,
+)
+
+from .sharding import coordinator
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    blob TEXT PRIMARY KEY,
+    processed_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS processed_at_idx ON processed (processed_at);
+
+CREATE TABLE IF NOT EXISTS pending (
+    container TEXT NOT NULL,
+    blob TEXT NOT NULL,
+    bottle_id TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (container, blob)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS inflight (
+    bottle_id TEXT PRIMARY KEY,
+    tap_blob TEXT NOT NULL,
+    level_blob TEXT NOT NULL,
+    submitted_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS cursors (
+    container TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class BlobLedger:
+    """
+    Registro persistente (SQLite, WAL) del estado del blob_watcher.
+
+    Sustituye al antiguo set `processed_blobs` en memoria:
+    - `processed`: blobs ya procesados ("contenedor/blob"), con retención
+      (BLOB_LEDGER_RETENTION_S) para que el fichero no crezca sin límite.
+    - `pending`: imágenes descubiertas que esperan a su pareja.
+    - `inflight`: botellas enviadas al pipeline y aún no publicadas; tras un
+      reinicio se vuelven a procesar.
+    - `cursors`: estado de los ContainerCursor, para reanudar el listado
+      justo donde se quedó.
+
+    Las consultas usan la clave primaria y un LRU pequeño en memoria delante
+    (BLOB_LEDGER_CACHE_SIZE), así la memoria del proceso queda acotada.
+
+    Los métodos son síncronos; desde el event loop se llaman con run()
+    (esperando el resultado) o submit() (sin esperar). Las dos van a un
+    único hilo propio, así que las operaciones se aplican en orden FIFO y
+    la conexión y el LRU nunca se tocan desde dos hilos a la vez.
+    """
+
+    def __init__(
+        self,
+        path: str = BLOB_LEDGER_PATH,
+        cache_size: int = BLOB_LEDGER_CACHE_SIZE,
+        retention_s: float = BLOB_LEDGER_RETENTION_S,
+    ):
+        self.path = path
+        self.cache_size = cache_size
+        self.retention_s = retention_s
+        self._recent: OrderedDict[str, None] = OrderedDict()
+        self._finished_since_prune = 0
+
+        # Se abre aquí pero se usa desde el hilo del ledger
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blob_ledger")
+
+    async def run(self, fn, *args):
+        """Ejecuta `fn(*args)` en el hilo del ledger y espera su resultado."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+
+    def submit(self, fn, *args) -> Future:
+        """Como run(), sin esperar: los errores solo se registran en el log."""
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._log_error)
+        return future
+
+    @staticmethod
+    def _log_error(future: Future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"[blob_ledger] ❌ Error en escritura diferida: {error}")
+
+    def close(self):
+        # Las escrituras encoladas (finish_bottle de las últimas botellas) se aplican antes
+        self._executor.shutdown(wait=True)
+        self._db.close()
+
+    # ---------------------------------------------------------------
+    # Blobs procesados
+    # ---------------------------------------------------------------
+    def _remember(self, blob_key: str):
+        if self.cache_size <= 0:
+            return
+        self._recent[blob_key] = None
+        self._recent.move_to_end(blob_key)
+        while len(self._recent) > self.cache_size:
+            self._recent.popitem(last=False)
+
+    def is_processed(self, blob_key: str) -> bool:
+        if blob_key in self._recent:
+            return True
+        row = self._db.execute(
+            "SELECT 1 FROM processed WHERE blob = ?", (blob_key,)
+        ).fetchone()
+        if row is not None:
+            self._remember(blob_key)
+            return True
+        return False
+
+    def processed_among(self, blob_keys: list[str]) -> set[str]:
+        """Las claves de `blob_keys` ya procesadas (una llamada por poll)."""
+        return {key for key in blob_keys if self.is_processed(key)}
+
+    def unknown_among(self, items: list[tuple[str, str]]) -> list[tuple[str, str]]:
+        """
+        (contenedor, blob) que el ledger no conoce: ni procesados, ni
+        esperando pareja, ni en una botella en vuelo (reconciliación).
+        """
+        unknown = []
+        for container, blob in items:
+            if self.is_processed(f"{container}/{blob}"):
+                continue
+            if self._db.execute(
+                "SELECT 1 FROM pending WHERE container = ? AND blob = ?", (container, blob)
+            ).fetchone() is not None:
+                continue
+            if self._db.execute(
+                "SELECT 1 FROM inflight WHERE tap_blob = ? OR level_blob = ?", (blob, blob)
+            ).fetchone() is not None:
+                continue
+            unknown.append((container, blob))
+        return unknown
+
+    def mark_processed(self, blob_keys: list[str]):
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO processed (blob, processed_at) VALUES (?, ?)",
+                [(key, now) for key in blob_keys],
+            )
+        for key in blob_keys:
+            self._remember(key)
+
+    def processed_count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
+
+    def prune(self):
+        """Elimina entradas `processed` más antiguas que la retención."""
+        cutoff = time.time() - self.retention_s
+        with self._db:
+            deleted = self._db.execute(
+                "DELETE FROM processed WHERE processed_at < ?", (cutoff,)
+            ).rowcount
+        if deleted:
+            logger.info(f"[blob_ledger] 🧹 {deleted} entradas antiguas eliminadas")
+
+    # ---------------------------------------------------------------
+    # Cursores de listado
+    # ---------------------------------------------------------------
+    def load_cursor(self, container: str) -> dict | None:
+        row = self._db.execute(
+            "SELECT state FROM cursors WHERE container = ?", (container,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def record_poll(self, cursor_states: dict[str, dict], new_pending: list[tuple[str, str, str]]):
+        """
+        Guarda en UNA transacción el avance de los cursores y las imágenes
+        nuevas (contenedor, blob, bottle_id) que esperan pareja.
+        """
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO cursors (container, state) VALUES (?, ?)",
+                [(container, json.dumps(state)) for container, state in cursor_states.items()],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO pending (container, blob, bottle_id, seen_at)"
+                " VALUES (?, ?, ?, ?)",
+                [(container, blob, bottle_id, now) for container, blob, bottle_id in new_pending],
+            )
+
+    def load_pending(self) -> list[tuple[str, str, str, float]]:
+        """(contenedor, blob, bottle_id, seen_at) por orden de llegada."""
+        return self._db.execute(
+            "SELECT container, blob, bottle_id, seen_at FROM pending ORDER BY seen_at"
+        ).fetchall()
+
+    def discard_pending(self, items: list[tuple[str, str]]):
+        """Quita (contenedor, blob) de `pending` sin procesarlos."""
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM pending WHERE container = ? AND blob = ?", items
+            )
+
+    # ---------------------------------------------------------------
+    # Botellas en vuelo
+    # ---------------------------------------------------------------
+    def start_bottle(self, bottle_id: str, tap: tuple[str, str], level: tuple[str, str]):
+        """La pareja sale de `pending` y entra en `inflight` (atómico)."""
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM pending WHERE container = ? AND blob = ?", [tap, level]
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO inflight (bottle_id, tap_blob, level_blob, submitted_at)"
+                " VALUES (?, ?, ?, ?)",
+                (bottle_id, tap[1], level[1], time.time()),
+            )
+
+    def finish_bottle(self, bottle_id: str, blob_keys: list[str]):
+        """Botella publicada: pasa de `inflight` a `processed`."""
+        now = time.time()
+        with self._db:
+            self._db.execute("DELETE FROM inflight WHERE bottle_id = ?", (bottle_id,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO processed (blob, processed_at) VALUES (?, ?)",
+                [(key, now) for key in blob_keys],
+            )
+        for key in blob_keys:
+            self._remember(key)
+
+        self._finished_since_prune += 1
+        if self._finished_since_prune >= 1000:
+            self._finished_since_prune = 0
+            self.prune()
+
+    def load_inflight(self) -> list[tuple[str, str, str]]:
+        return self._db.execute(
+            "SELECT bottle_id, tap_blob, level_blob FROM inflight ORDER BY submitted_at"
+        ).fetchall()
+
+
+_ledger: BlobLedger | None = None
+
+
+def _ledger_path() -> str:
+    """Con varios workers cada slot tiene su propio ledger (sus cursores y sus botellas)."""
+    if not coordinator.enabled:
+        return BLOB_LEDGER_PATH
+    if coordinator.index is None:
+        raise RuntimeError("Aquest worker no té cap slot assignat")
+    root, ext = os.path.splitext(BLOB_LEDGER_PATH)
+    return f"{root}.w{coordinator.index}{ext}"
+
+
+def get_ledger() -> BlobLedger:
+    """Ledger compartido del proceso (watcher + ingesta push)."""
+    global _ledger
+    if _ledger is None:
+        _ledger = BlobLedger(_ledger_path())
+    return _ledger
+
+
+def close_ledger():
+    global _ledger
+    if _ledger is not None:
+        _ledger.close()
+        _ledger = None
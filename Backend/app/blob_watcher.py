@@ -1,36 +1,69 @@
 import asyncio
 import logging
-import os
-from typing import Set
+import time
 
-from .blob_client import list_blobs
-from .processor import process_bottle_from_blobs
+from .blob_discovery import ContainerCursor
+from .blob_ledger import get_ledger
+from .metrics import COUNT_BUCKETS, metrics
+from .pairing import PairingIndex, bottle_id_of, publish_orphans, register_index
+from .pipeline import BottlePipeline, set_active_pipeline
+from .poll_scheduler import poll_scheduler
+from .prefetch import prefetch_cache
+from .processor import expire_push_orphans
+from .sharding import coordinator
 from .config import (
+    BLOB_RECONCILE_INTERVAL_S,
     CONTAINER_TAP,
     CONTAINER_LEVEL,
-    SYSTEM_POLL_INTERVAL,
 )
 
 logger = logging.getLogger(__name__)
 
-processed_blobs: Set[str] = set()
+poll_seconds = metrics.histogram("poll_seconds", "Duració d'un poll (llistat dels dos contenidors)")
+blobs_per_poll = metrics.histogram("blobs_per_poll", "Blobs nous llistats per poll", COUNT_BUCKETS)
+
+# Blobs escritos por detrás del marker del cursor y recuperados por la reconciliación
+_recovered_behind_cursor = 0
+metrics.gauge(
+    "blobs_behind_cursor_total",
+    "Blobs escrits per darrere del cursor i recuperats per la reconciliació",
+    lambda: _recovered_behind_cursor,
+    kind="counter",
+)
 
 
-def _get_bottle_id(blob_name: str) -> str:
-    name_without_ext = blob_name.rsplit(".", 1)[0]
-    if "_tap" in name_without_ext:
-        return name_without_ext.replace("_tap", "")
-    elif "_level" in name_without_ext:
-        return name_without_ext.replace("_level", "")
-    return name_without_ext
+CONTAINERS = {"tap": CONTAINER_TAP, "level": CONTAINER_LEVEL}
+KINDS = {CONTAINER_TAP: "tap", CONTAINER_LEVEL: "level"}
 
 
-async def _list_blobs_async(container: str):
+async def _run_blocking(fn):
     """
-    Wrapper async para list_blobs (bloqueante)
+    Wrapper async para las llamadas de listado (bloqueantes)
     """
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, list_blobs, container)
+    return await loop.run_in_executor(None, fn)
+
+
+async def _reconcile(cursors: list[ContainerCursor], ledger) -> list[tuple[str, str, str]]:
+    """
+    Red de seguridad del cursor: blobs de este worker escritos por detrás
+    del marker que el ledger no conoce. Devuelve (contenedor, blob, bottle_id).
+    """
+    global _recovered_behind_cursor
+    missed = await asyncio.gather(*(_run_blocking(cursor.reconcile) for cursor in cursors))
+    candidates = [
+        (cursor.container, blob)
+        for cursor, blobs in zip(cursors, missed)
+        for blob in blobs
+        if coordinator.owns(bottle_id_of(blob))
+    ]
+    if not candidates:
+        return []
+    unknown = await ledger.run(ledger.unknown_among, candidates)
+    for container, blob in unknown:
+        logger.warning(f"[blob_watcher] ⚠️ {container}/{blob} escrito por detrás del cursor: recuperado")
+    _recovered_behind_cursor += len(unknown)
+    return [(container, blob, bottle_id_of(blob)) for container, blob in unknown]
 
 
 async def watch_containers(get_system_running_flag, system_running_event: asyncio.Event):
@@ -39,29 +72,94 @@ async def watch_containers(get_system_running_flag, system_running_event: asynci
     - NO bloquea el event loop
     - Cancelable
     - Apagado inmediato
+    - Reanuda donde lo dejó (cursores, parejas pendientes y botellas en
+      vuelo se guardan en el BlobLedger)
+    - Emparejado incremental (PairingIndex): cada poll solo procesa los
+      blobs nuevos, y las imágenes sin pareja caducan como huérfanas
+    - Descarga anticipada (prefetch_cache): cada imagen se empieza a
+      descargar al descubrirla, antes de que la botella esté completa
     """
-    global processed_blobs
-
     logger.info("[blob_watcher] 🚀 Iniciado")
 
-    # Inicialización (en executor)
-    try:
-        tap_blobs, level_blobs = await asyncio.gather(
-            _list_blobs_async(CONTAINER_TAP),
-            _list_blobs_async(CONTAINER_LEVEL),
+    ledger = get_ledger()
+
+    tap_cursor = ContainerCursor(CONTAINER_TAP)
+    level_cursor = ContainerCursor(CONTAINER_LEVEL)
+
+    # Imágenes descubiertas que aún esperan a su pareja (valor: nombre del blob)
+    pairing: PairingIndex[str] = register_index(PairingIndex("blob"))
+    # Botellas completas pendientes de enviar al pipeline
+    ready: list[tuple[str, str, str]] = []
+
+    def cursor_states() -> dict[str, dict]:
+        return {
+            CONTAINER_TAP: tap_cursor.get_state(),
+            CONTAINER_LEVEL: level_cursor.get_state(),
+        }
+
+    def on_bottle_done(bottle_id: str, tap_blob: str, level_blob: str):
+        # Sin esperar: el hilo del ledger la aplica después del start_bottle
+        ledger.submit(
+            ledger.finish_bottle,
+            bottle_id,
+            [f"{CONTAINER_TAP}/{tap_blob}", f"{CONTAINER_LEVEL}/{level_blob}"],
         )
-        for blob in tap_blobs:
-            processed_blobs.add(f"{CONTAINER_TAP}/{blob}")
-        for blob in level_blobs:
-            processed_blobs.add(f"{CONTAINER_LEVEL}/{blob}")
-        logger.info(f"[blob_watcher] ✅ {len(processed_blobs)} blobs iniciales marcados")
-    except Exception as e:
-        logger.error(f"[blob_watcher] ❌ Error en init: {e}")
 
-    poll_interval = max(
-        0.05,
-        float(os.getenv("BLOB_POLL_INTERVAL_S", SYSTEM_POLL_INTERVAL)),
-    )
+    # Todo el SQLite del ledger va en su hilo (ledger.run), nunca en el event loop
+    tap_state = await ledger.run(ledger.load_cursor, CONTAINER_TAP)
+    level_state = await ledger.run(ledger.load_cursor, CONTAINER_LEVEL)
+    resume_bottles: list[tuple[str, str, str]] = []
+
+    if tap_state is not None and level_state is not None:
+        # Reanudación: seguimos exactamente donde se paró el watcher anterior
+        tap_cursor.set_state(tap_state)
+        level_cursor.set_state(level_state)
+        restored = await ledger.run(ledger.load_pending)
+        for container, blob, bottle_id, seen_at in restored:
+            pair = pairing.add(bottle_id, KINDS[container], blob, seen_at)
+            if pair is not None:
+                ready.append((bottle_id, *pair))
+        resume_bottles = await ledger.run(ledger.load_inflight)
+        logger.info(
+            f"[blob_watcher] ♻️ Reanudando: {len(restored)} imágenes "
+            f"pendientes, {len(resume_bottles)} botellas en vuelo"
+        )
+    else:
+        # Primer arranque (en executor): el cursor salta el histórico y solo
+        # conservamos la última página por si alguna pareja está a medias
+        try:
+            recent_tap, recent_level = await asyncio.gather(
+                _run_blocking(tap_cursor.fast_forward),
+                _run_blocking(level_cursor.fast_forward),
+            )
+            # Con varios workers, cada uno solo se queda con sus botellas
+            recent_tap = [b for b in recent_tap if coordinator.owns(bottle_id_of(b))]
+            recent_level = [b for b in recent_level if coordinator.owns(bottle_id_of(b))]
+            # Las parejas ya completas al arrancar cuentan como procesadas:
+            # add() las devuelve y no se guardan
+            for kind, blobs in (("tap", recent_tap), ("level", recent_level)):
+                for blob in blobs:
+                    pairing.add(bottle_id_of(blob), kind, blob)
+
+            await ledger.run(
+                ledger.mark_processed,
+                [f"{CONTAINER_TAP}/{blob}" for blob in recent_tap]
+                + [f"{CONTAINER_LEVEL}/{blob}" for blob in recent_level],
+            )
+            await ledger.run(
+                ledger.record_poll,
+                cursor_states(),
+                [(CONTAINERS[kind], blob, bottle_id) for bottle_id, kind, blob in pairing.pending()],
+            )
+            logger.info(f"[blob_watcher] ✅ {len(recent_tap) + len(recent_level)} blobs iniciales marcados")
+        except Exception as e:
+            logger.error(f"[blob_watcher] ❌ Error en init: {e}")
+
+    # Pipeline concurrente: descarga + inferencia de varias botellas a la vez
+    pipeline = BottlePipeline(on_done=on_bottle_done)
+    await pipeline.start()
+
+    poll_scheduler.reset()
 
     try:
         while True:
@@ -71,47 +169,121 @@ async def watch_containers(get_system_running_flag, system_running_event: asynci
             if not get_system_running_flag():
                 continue
 
-            # 🔹 Listado NO bloqueante
-            tap_blobs, level_blobs = await asyncio.gather(
-                _list_blobs_async(CONTAINER_TAP),
-                _list_blobs_async(CONTAINER_LEVEL),
-            )
+            # 🔹 La ingesta push solo acepta imágenes con el sistema encendido
+            set_active_pipeline(pipeline)
 
-            bottles_tap = {_get_bottle_id(b): b for b in tap_blobs}
-            bottles_level = {_get_bottle_id(b): b for b in level_blobs}
+            # 🔹 Botellas que quedaron a medias en la ejecución anterior
+            while resume_bottles:
+                bottle_id, tap_blob, level_blob = resume_bottles.pop(0)
+                logger.info(f"[blob_watcher] ♻️ Reprocesando botella en vuelo: {bottle_id}")
+                await pipeline.submit(bottle_id, tap_blob, level_blob)
 
-            complete_bottles = sorted(
-                set(bottles_tap) & set(bottles_level)
+            # 🔹 Listado incremental NO bloqueante: solo blobs nuevos
+            poll_start = time.perf_counter()
+            list_calls = tap_cursor.list_calls + level_cursor.list_calls
+            new_tap, new_level = await asyncio.gather(
+                _run_blocking(tap_cursor.poll),
+                _run_blocking(level_cursor.poll),
             )
+            poll_duration = time.perf_counter() - poll_start
+            if metrics.enabled:
+                poll_seconds.observe(poll_duration)
+                blobs_per_poll.observe(len(new_tap) + len(new_level))
+            # Intervalo hasta el siguiente poll: 0 si ha habido blobs (ráfaga)
+            poll_delay = poll_scheduler.after_poll(
+                len(new_tap) + len(new_level),
+                poll_duration,
+                tap_cursor.list_calls + level_cursor.list_calls - list_calls,
+            )
+
+            # 🔹 Blobs nuevos de este worker que el ledger no da por procesados
+            # (archivados por la ingesta push, última página al reanudar...):
+            # una sola consulta, antes de descargarlos o emparejarlos
+            listed = []
+            for container, blobs in ((CONTAINER_TAP, new_tap), (CONTAINER_LEVEL, new_level)):
+                for blob in blobs:
+                    bottle_id = bottle_id_of(blob)
+                    if coordinator.owns(bottle_id):
+                        listed.append((container, blob, bottle_id))
+            processed: set[str] = set()
+            if listed:
+                processed = await ledger.run(
+                    ledger.processed_among, [f"{container}/{blob}" for container, blob, _ in listed]
+                )
+
+            # 🔹 Reconciliación periódica: listado completo (solo lo modificado
+            # desde la anterior) en busca de nombres por detrás del marker
+            reconciled = False
+            if BLOB_RECONCILE_INTERVAL_S and tap_cursor.reconcile_due(BLOB_RECONCILE_INTERVAL_S):
+                try:
+                    recovered = await _reconcile([tap_cursor, level_cursor], ledger)
+                    # Lo que este mismo poll ya ha listado aún no está en el ledger
+                    seen = {(container, blob) for container, blob, _ in listed}
+                    listed.extend(item for item in recovered if item[:2] not in seen)
+                    reconciled = True
+                except Exception as e:
+                    logger.error(f"[blob_watcher] ❌ Error en la reconciliación: {e}")
+
+            # 🔹 Emparejado incremental: O(1) por blob nuevo
+            new_pending = []
+            for container, blob, bottle_id in listed:
+                if f"{container}/{blob}" in processed:
+                    continue
+                new_pending.append((container, blob, bottle_id))
+                # Descarga anticipada: no espera a la pareja ni al pipeline
+                prefetch_cache.prefetch(container, blob)
+                pair = pairing.add(bottle_id, KINDS[container], blob)
+                if pair is not None:
+                    ready.append((bottle_id, *pair))
 
-            for bottle_id in complete_bottles:
+            if listed or reconciled:
+                await ledger.run(ledger.record_poll, cursor_states(), new_pending)
+
+            # 🔹 Imágenes que llevan demasiado sin pareja (Blob y push)
+            orphans = pairing.expire()
+            if orphans:
+                await ledger.run(ledger.discard_pending, [(CONTAINERS[o.kind], o.value) for o in orphans])
+                for orphan in orphans:
+                    prefetch_cache.discard(CONTAINERS[orphan.kind], orphan.value)
+                await publish_orphans("blob", orphans)
+            await expire_push_orphans()
+
+            ready.sort()
+            while ready:
                 if not get_system_running_flag():
                     logger.warning("[blob_watcher] 🛑 Apagado detectado")
                     return
 
-                tap_blob = bottles_tap[bottle_id]
-                level_blob = bottles_level[bottle_id]
+                bottle_id, tap_blob, level_blob = ready.pop(0)
 
                 tap_id = f"{CONTAINER_TAP}/{tap_blob}"
                 level_id = f"{CONTAINER_LEVEL}/{level_blob}"
 
-                if tap_id in processed_blobs and level_id in processed_blobs:
+                if await ledger.run(lambda: ledger.is_processed(tap_id) and ledger.is_processed(level_id)):
+                    ledger.submit(ledger.discard_pending, [(CONTAINER_TAP, tap_blob), (CONTAINER_LEVEL, level_blob)])
+                    prefetch_cache.discard(CONTAINER_TAP, tap_blob)
+                    prefetch_cache.discard(CONTAINER_LEVEL, level_blob)
                     continue
 
                 logger.info(f"[blob_watcher] 🧴 Botella nueva: {bottle_id}")
 
-                processed_blobs.add(tap_id)
-                processed_blobs.add(level_id)
-
-                await process_bottle_from_blobs(
-                    bottle_id, tap_blob, level_blob
+                await ledger.run(
+                    ledger.start_bottle, bottle_id, (CONTAINER_TAP, tap_blob), (CONTAINER_LEVEL, level_blob)
                 )
 
-            # 🔹 Espera cancelable
-            await asyncio.sleep(poll_interval)
+                # Backpressure: espera si el pipeline ya está lleno
+                await pipeline.submit(bottle_id, tap_blob, level_blob)
+
+            # 🔹 Espera cancelable (adaptativa: ráfaga / régimen / backoff)
+            await asyncio.sleep(poll_delay)
 
     except asyncio.CancelledError:
         logger.warning("[blob_watcher] ✋ Cancelado limpiamente")
         raise
     except Exception as e:
         logger.error(f"[blob_watcher] 💥 Error fatal: {e}")
+    finally:
+        # Apagado inmediato: cancela también las botellas en vuelo
+        set_active_pipeline(None)
+        await pipeline.stop()
+        prefetch_cache.clear()
@@ -0,0 +1,64 @@
+import io
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+
+class BufferWriter(io.RawIOBase):
+    """
+    Stream escribible y con seek sobre un bytearray ya reservado.
+
+    Permite que el SDK de Blob (StorageStreamDownloader.readinto, también en
+    descarga paralela) escriba directamente en el buffer final, sin el
+    BytesIO intermedio ni la copia de readall().
+    """
+
+    def __init__(self, buffer: bytearray):
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = offset
+        return self._pos
+
+    def write(self, data) -> int:
+        size = len(data)
+        self._view[self._pos:self._pos + size] = data
+        self._pos += size
+        return size
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+async def read_upload(file: UploadFile) -> bytearray:
+    """
+    Lee un UploadFile en un único bytearray del tamaño exacto.
+
+    Starlette ya guarda las subidas grandes en un SpooledTemporaryFile (en
+    disco a partir de 1 MB); aquí evitamos además las copias intermedias de
+    UploadFile.read() leyendo con readinto en un hilo.
+    """
+    if file.size is None:
+        return bytearray(await file.read())
+
+    buffer = bytearray(file.size)
+    await file.seek(0)
+    read = await run_in_threadpool(file.file.readinto, buffer)
+    if read != file.size:
+        del buffer[read:]
+    return buffer
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable
+
+from .config import (
+    CASCADE_DEFER_QUEUE_SIZE,
+    CASCADE_MODE,
+    CASCADE_ORDER,
+    CASCADE_THRESHOLDS,
+)
+from .metrics import metrics
+from .verdicts import PASS_LABELS
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "skip", "defer")
+MODELS = ("tap", "level")
+
+
+def parse_thresholds(spec: str) -> dict[str, float]:
+    """"tap_missing:0.95,low:0.97" -> {"tap_missing": 0.95, "low": 0.97}."""
+    thresholds = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        label, _, value = item.rpartition(":")
+        if not label:
+            raise ValueError(f"Llindar de cascada sense etiqueta: {item}")
+        thresholds[label.strip()] = float(value)
+    return thresholds
+
+
+class CascadePolicy:
+    """
+    Inferencia en cascada: primero el modelo `order[0]`; si su veredicto es
+    un defecto con confianza >= el umbral de esa etiqueta, la botella ya es
+    FAIL diga lo que diga el otro modelo, y el segundo:
+
+    - skip:  no se llama ("{modelo}_skipped")
+    - defer: se llama más tarde en una cola de baja prioridad (un worker,
+             `defer_queue_size` como mucho) para completar la evidencia del
+             PDF ("{modelo}_deferred" en el resultado publicado)
+
+    Sin veredicto decisivo se llama al segundo modelo después del primero,
+    así que en las botellas que no lo son la latencia es la suma de los dos
+    (en paralelo era el máximo): stats() cuenta las dos cosas.
+
+    Solo deciden etiquetas de defecto con umbral; las correctas
+    (PASS_LABELS) necesitan siempre los dos modelos.
+    """
+
+    def __init__(
+        self,
+        mode: str = CASCADE_MODE,
+        order: tuple[str, ...] = CASCADE_ORDER,
+        thresholds: dict[str, float] | None = None,
+        defer_queue_size: int = CASCADE_DEFER_QUEUE_SIZE,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"CASCADE_MODE desconegut: {mode} (disponibles: {', '.join(MODES)})")
+        if sorted(order) != sorted(MODELS):
+            raise ValueError(f"CASCADE_ORDER ha de contenir tap i level: {order}")
+        self.mode = mode
+        self.first, self.second = order
+        thresholds = parse_thresholds(CASCADE_THRESHOLDS) if thresholds is None else thresholds
+        ignored = [label for label in thresholds if label in PASS_LABELS.values()]
+        if ignored:
+            logger.warning(f"[cascade] ⚠️ Las etiquetas correctas no deciden solas: {', '.join(ignored)}")
+        self.thresholds = {label: t for label, t in thresholds.items() if label not in ignored}
+        self.defer_queue_size = defer_queue_size
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+
+        self.bottles = 0
+        self.decisive = 0
+        self.decisive_by_label: dict[str, int] = defaultdict(int)
+        self.calls_skipped = 0
+        self.calls_deferred = 0
+        self.deferred_done = 0
+        self.deferred_failed = 0
+        self.deferred_dropped = 0
+        self.latency_saved_s = 0.0
+        self.latency_added_s = 0.0
+        self._second_s: float | None = None  # EWMA de la latencia del segundo modelo
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def is_decisive(self, model: str, label: str, confidence: float) -> bool:
+        if label == PASS_LABELS[model]:
+            return False
+        threshold = self.thresholds.get(label)
+        return threshold is not None and confidence >= threshold
+
+    def record_decisive(self, label: str, first_s: float):
+        """
+        Botella decidida por el primer modelo. Ahorro estimado frente al
+        paralelo, que esperaba max(primero, segundo).
+        """
+        self.bottles += 1
+        self.decisive += 1
+        self.decisive_by_label[label] += 1
+        if self.mode == "skip":
+            self.calls_skipped += 1
+        else:
+            self.calls_deferred += 1
+        if self._second_s is not None:
+            self.latency_saved_s += max(0.0, self._second_s - first_s)
+
+    def record_full(self, first_s: float, second_s: float):
+        """Botella con los dos modelos en serie: paga min(primero, segundo) de más."""
+        self.bottles += 1
+        self.latency_added_s += min(first_s, second_s)
+        self._second_s = second_s if self._second_s is None else 0.9 * self._second_s + 0.1 * second_s
+
+    # ---------------------------------------------------------------
+    # Cola diferida (mode="defer")
+    # ---------------------------------------------------------------
+    def defer(self, bottle_id: str, job: Callable[[], Awaitable[None]]) -> bool:
+        """Encola el segundo modelo de una botella ya decidida. False si no cabe."""
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.defer_queue_size)
+            self._task = asyncio.create_task(self._run())
+        try:
+            self._queue.put_nowait((bottle_id, job))
+        except asyncio.QueueFull:
+            self.deferred_dropped += 1
+            logger.warning(f"[cascade] ⚠️ {bottle_id} - Cola diferida llena, informe sin el segundo modelo")
+            return False
+        return True
+
+    async def _run(self):
+        while True:
+            bottle_id, job = await self._queue.get()
+            try:
+                await job()
+                self.deferred_done += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.deferred_failed += 1
+                logger.error(f"[cascade] ❌ {bottle_id} - Error en el modelo diferido: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        pending = self._queue.qsize()
+        if pending:
+            logger.warning(f"[cascade] 🛑 {pending} llamadas diferidas sin hacer al parar")
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "order": [self.first, self.second],
+            "thresholds": self.thresholds,
+            "bottles": self.bottles,
+            "decisive": self.decisive,
+            "decisive_rate": round(self.decisive / self.bottles, 4) if self.bottles else 0.0,
+            "decisive_by_label": dict(self.decisive_by_label),
+            "calls_skipped": self.calls_skipped,
+            "calls_deferred": self.calls_deferred,
+            "deferred_pending": self._queue.qsize() if self._queue else 0,
+            "deferred_done": self.deferred_done,
+            "deferred_failed": self.deferred_failed,
+            "deferred_dropped": self.deferred_dropped,
+            "latency_saved_s": round(self.latency_saved_s, 3),
+            "latency_added_s": round(self.latency_added_s, 3),
+        }
+
+
+cascade = CascadePolicy()
+
+metrics.gauge(
+    "cascade_calls_saved_total",
+    "Crides d'scoring evitades (skip) o ajornades (defer) per la cascada",
+    lambda: cascade.calls_skipped + cascade.calls_deferred,
+    kind="counter",
+)
+metrics.gauge(
+    "cascade_deferred_pending",
+    "Crides del segon model esperant a la cua diferida",
+    lambda: cascade._queue.qsize() if cascade._queue else 0,
+)
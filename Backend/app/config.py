@@ -7,3 +7,148 @@ CONTAINER_LEVEL = "images-level"
 CONTAINER_ERRORS = "errors-pdf"
 
 SYSTEM_POLL_INTERVAL = 0.3 # segons
+
+# Descobriment incremental de blobs
+BLOB_LIST_PAGE_SIZE = int(os.getenv("BLOB_LIST_PAGE_SIZE", "1000"))
+BLOB_NAME_PREFIX = os.getenv("BLOB_NAME_PREFIX") or None
+# Xarxa de seguretat del cursor: cada BLOB_RECONCILE_INTERVAL_S es llista el
+# contenidor sencer (només els blobs modificats des de la darrera vegada) per
+# trobar els noms escrits per darrere del marker (ids UUID, comptadors sense
+# zeros a l'esquerra...). 0 = desactivat
+BLOB_RECONCILE_INTERVAL_S = max(0.0, float(os.getenv("BLOB_RECONCILE_INTERVAL_S", "600")))
+
+# Polling adaptatiu del blob_watcher: si un poll troba blobs es repeteix de
+# seguida; sense feina es manté l'interval base durant BLOB_POLL_IDLE_GRACE_S
+# i després es multiplica per BLOB_POLL_BACKOFF fins a BLOB_POLL_MAX_INTERVAL_S
+BLOB_POLL_INTERVAL_S = max(0.05, float(os.getenv("BLOB_POLL_INTERVAL_S", str(SYSTEM_POLL_INTERVAL))))
+BLOB_POLL_MAX_INTERVAL_S = float(os.getenv("BLOB_POLL_MAX_INTERVAL_S", "5"))
+BLOB_POLL_BACKOFF = float(os.getenv("BLOB_POLL_BACKOFF", "2"))
+BLOB_POLL_BURST_DELAY_S = float(os.getenv("BLOB_POLL_BURST_DELAY_S", "0.05"))  # pausa mínima en ràfega
+BLOB_POLL_IDLE_GRACE_S = float(os.getenv("BLOB_POLL_IDLE_GRACE_S", "10"))
+BLOB_POLL_JITTER = float(os.getenv("BLOB_POLL_JITTER", "0.2"))  # fracció (±)
+
+# Emparellament TAP + LEVEL: una imatge sense parella passats
+# PAIRING_ORPHAN_TTL_S segons es descarta com a òrfena (0 = mai)
+PAIRING_ORPHAN_TTL_S = max(0.0, float(os.getenv("PAIRING_ORPHAN_TTL_S", "60")))
+
+# Substitut local de Blob Storage (desenvolupament / proves offline):
+# si està definit, cada contenidor és un directori dins d'aquesta ruta.
+BLOB_LOCAL_ROOT = os.getenv("BLOB_LOCAL_ROOT") or None
+
+# Servei de pujades a Blob Storage (cua acotada en segon pla, amb reintents)
+UPLOAD_WORKERS = max(1, int(os.getenv("UPLOAD_WORKERS", "4")))
+UPLOAD_QUEUE_SIZE = max(1, int(os.getenv("UPLOAD_QUEUE_SIZE", "500")))
+UPLOAD_RETRIES = max(0, int(os.getenv("UPLOAD_RETRIES", os.getenv("REPORT_UPLOAD_RETRIES", "3"))))
+UPLOAD_BACKOFF_S = float(os.getenv("UPLOAD_BACKOFF_S", os.getenv("REPORT_UPLOAD_BACKOFF_S", "0.5")))
+UPLOAD_MAX_BACKOFF_S = float(os.getenv("UPLOAD_MAX_BACKOFF_S", "10"))
+# Blobs grans: per sobre de UPLOAD_SINGLE_PUT_MB es pugen per blocs de
+# UPLOAD_BLOCK_SIZE_MB, UPLOAD_BLOCK_CONCURRENCY blocs en paral·lel
+UPLOAD_SINGLE_PUT_MB = max(1, int(os.getenv("UPLOAD_SINGLE_PUT_MB", "4")))
+UPLOAD_BLOCK_SIZE_MB = max(1, int(os.getenv("UPLOAD_BLOCK_SIZE_MB", "4")))
+UPLOAD_BLOCK_CONCURRENCY = max(1, int(os.getenv("UPLOAD_BLOCK_CONCURRENCY", "4")))
+# Temps màxim per buidar la cua en aturar l'aplicació
+UPLOAD_DRAIN_TIMEOUT_S = float(os.getenv("UPLOAD_DRAIN_TIMEOUT_S", "10"))
+
+# Descàrrega anticipada: el watcher descarrega cada imatge en descobrir-la,
+# sense esperar la parella (memòria cau LRU de PREFETCH_MAX_MB)
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+PREFETCH_MAX_MB = max(1, int(os.getenv("PREFETCH_MAX_MB", "256")))
+PREFETCH_WORKERS = max(1, int(os.getenv("PREFETCH_WORKERS", "4")))
+PREFETCH_MAX_IN_FLIGHT = max(1, int(os.getenv("PREFETCH_MAX_IN_FLIGHT", "64")))
+
+# Pipeline concurrent de botelles (blob_watcher)
+PIPELINE_CONCURRENCY = max(1, int(os.getenv("PIPELINE_CONCURRENCY", "4")))
+PIPELINE_MAX_QUEUE = max(0, int(os.getenv("PIPELINE_MAX_QUEUE", str(4 * PIPELINE_CONCURRENCY))))
+PROCESSOR_MAX_WORKERS = max(1, int(os.getenv("PROCESSOR_MAX_WORKERS", str(2 * PIPELINE_CONCURRENCY))))
+
+# Generació d'informes PDF (procés separat)
+REPORT_WORKERS = max(1, int(os.getenv("REPORT_WORKERS", "2")))
+REPORT_QUEUE_SIZE = max(1, int(os.getenv("REPORT_QUEUE_SIZE", "200")))
+# Temps màxim per buidar la cua d'informes en aturar (la resta es compta com a descartada)
+REPORT_DRAIN_TIMEOUT_S = float(os.getenv("REPORT_DRAIN_TIMEOUT_S", "10"))
+# Miniatures JPEG incrustades als PDF (costat llarg en píxels; 0 = imatge original)
+REPORT_THUMBNAIL_PX = max(0, int(os.getenv("REPORT_THUMBNAIL_PX", "384")))
+REPORT_THUMBNAIL_QUALITY = min(95, max(1, int(os.getenv("REPORT_THUMBNAIL_QUALITY", "75"))))
+# Informes per lots: un PDF (amb índex) per finestra de temps o cada
+# REPORT_BATCH_MAX_BOTTLES ampolles. 0 = un PDF per ampolla
+REPORT_BATCH_WINDOW_S = max(0.0, float(os.getenv("REPORT_BATCH_WINDOW_S", "0")))
+REPORT_BATCH_MAX_BOTTLES = max(1, int(os.getenv("REPORT_BATCH_MAX_BOTTLES", "200")))
+
+# Inferència en cascada: si el primer model de CASCADE_ORDER veu un defecte
+# amb confiança >= el llindar de l'etiqueta (CASCADE_THRESHOLDS), el segon
+# no es crida (skip) o es crida més tard per al PDF (defer). off = en paral·lel
+CASCADE_MODE = os.getenv("CASCADE_MODE", "off").strip().lower()  # off | skip | defer
+CASCADE_ORDER = tuple(m.strip() for m in os.getenv("CASCADE_ORDER", "tap,level").split(","))
+CASCADE_THRESHOLDS = os.getenv("CASCADE_THRESHOLDS", "tap_missing:0.95,full:0.97,low:0.97")
+CASCADE_DEFER_QUEUE_SIZE = max(1, int(os.getenv("CASCADE_DEFER_QUEUE_SIZE", "1000")))
+
+# Memòria cau de resultats d'inferència (hash del contingut de la imatge)
+RESULT_CACHE_MAX_ENTRIES = max(0, int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000")))
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "3600"))
+RESULT_CACHE_SQLITE_PATH = os.getenv("RESULT_CACHE_SQLITE_PATH") or None
+RESULT_CACHE_DISK_MAX_ENTRIES = max(1, int(os.getenv("RESULT_CACHE_DISK_MAX_ENTRIES", "200000")))
+# El nivell en disc s'escriu per lots des d'un fil, cada RESULT_CACHE_FLUSH_MS com a molt
+RESULT_CACHE_FLUSH_MS = max(1.0, float(os.getenv("RESULT_CACHE_FLUSH_MS", "200")))
+
+# Registre persistent de blobs processats (reprèn el watcher després d'un reinici)
+BLOB_LEDGER_PATH = os.getenv("BLOB_LEDGER_PATH", "blob_ledger.sqlite3")
+BLOB_LEDGER_CACHE_SIZE = max(0, int(os.getenv("BLOB_LEDGER_CACHE_SIZE", "10000")))
+BLOB_LEDGER_RETENTION_S = float(os.getenv("BLOB_LEDGER_RETENTION_S", str(7 * 24 * 3600)))
+
+# Històric de resultats d'inspecció (SQLite WAL, consultable per /api/results).
+# Buit = desactivat. S'escriu per lots des d'un fil, fora del camí d'inspecció
+RESULT_STORE_PATH = os.getenv("RESULT_STORE_PATH", "results.sqlite3") or None
+RESULT_STORE_BATCH_SIZE = max(1, int(os.getenv("RESULT_STORE_BATCH_SIZE", "500")))
+RESULT_STORE_FLUSH_MS = max(1.0, float(os.getenv("RESULT_STORE_FLUSH_MS", "200")))
+# Resultats pendents d'escriure a partir dels quals es descarten (disc massa lent)
+RESULT_STORE_MAX_PENDING = max(1, int(os.getenv("RESULT_STORE_MAX_PENDING", "100000")))
+RESULT_STORE_RETENTION_S = float(os.getenv("RESULT_STORE_RETENTION_S", str(90 * 24 * 3600)))  # 0 = sempre
+
+# Ingesta push (càmeres que envien les imatges directament)
+INGEST_ARCHIVE_TO_BLOB = os.getenv("INGEST_ARCHIVE_TO_BLOB", "false").lower() in ("1", "true", "yes")
+
+# Backend d'inferència: "azure" (endpoints d'Azure ML) o "onnx" (CPU local)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "azure").strip().lower()
+ONNX_MODEL_TAP = os.getenv("ONNX_MODEL_TAP", "models/resnet18_tap.onnx")
+ONNX_MODEL_LEVEL = os.getenv("ONNX_MODEL_LEVEL", "models/resnet18_level.onnx")
+# Etiquetes en l'ordre de sortida del model (ImageFolder: ordre alfabètic)
+ONNX_LABELS_TAP = [l.strip() for l in os.getenv("ONNX_LABELS_TAP", "tap_missing,tap_present").split(",")]
+ONNX_LABELS_LEVEL = [l.strip() for l in os.getenv("ONNX_LABELS_LEVEL", "full,low,ok").split(",")]
+ONNX_INPUT_SIZE = int(os.getenv("ONNX_INPUT_SIZE", "224"))
+ONNX_INTRA_OP_THREADS = max(0, int(os.getenv("ONNX_INTRA_OP_THREADS", "0")))  # 0 = per defecte
+ONNX_MAX_WORKERS = max(1, int(os.getenv("ONNX_MAX_WORKERS", "2")))
+ONNX_BATCH_MAX_SIZE = int(os.getenv("ONNX_BATCH_MAX_SIZE", "8"))
+ONNX_BATCH_MAX_WAIT_MS = float(os.getenv("ONNX_BATCH_MAX_WAIT_MS", "2"))
+
+# Preprocés d'imatges: es descodifiquen un cop, es redueixen (costat curt) i
+# es tornen a codificar en JPEG per a l'scoring i els informes PDF
+PREPROCESS_IMAGES = os.getenv("PREPROCESS_IMAGES", "true").lower() in ("1", "true", "yes")
+PREPROCESS_SHORT_SIDE = max(1, int(os.getenv("PREPROCESS_SHORT_SIDE", "256")))
+PREPROCESS_JPEG_QUALITY = min(95, max(1, int(os.getenv("PREPROCESS_JPEG_QUALITY", "90"))))
+
+# Repartiment de botelles entre diversos processos del backend (mateixa màquina)
+WORKER_COUNT = max(1, int(os.getenv("WORKER_COUNT", "1")))
+WORKER_INDEX = int(os.environ["WORKER_INDEX"]) if os.getenv("WORKER_INDEX") else None  # None = slot automàtic
+WORKER_COORD_PATH = os.getenv("WORKER_COORD_PATH", "workers.sqlite3")
+WORKER_LEASE_TTL_S = float(os.getenv("WORKER_LEASE_TTL_S", "10"))
+WORKER_HEARTBEAT_S = float(os.getenv("WORKER_HEARTBEAT_S", "1"))
+
+# Difusió WebSocket als dashboards
+WS_CLIENT_QUEUE_SIZE = max(1, int(os.getenv("WS_CLIENT_QUEUE_SIZE", "256")))
+WS_SEND_TIMEOUT_S = float(os.getenv("WS_SEND_TIMEOUT_S", "5"))
+WS_SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest")  # drop_oldest | disconnect
+# Agrupació d'analysis_result en un sol frame: 1 = desactivada
+WS_BATCH_MAX = max(1, int(os.getenv("WS_BATCH_MAX", "1")))
+WS_BATCH_WINDOW_MS = float(os.getenv("WS_BATCH_WINDOW_MS", "100"))
+
+# Estadístiques de qualitat per finestres de temps (1 min, 15 min, 1 h)
+QUALITY_STATS_BUCKET_S = max(1.0, float(os.getenv("QUALITY_STATS_BUCKET_S", "5")))
+QUALITY_STATS_HISTOGRAM_BINS = max(1, int(os.getenv("QUALITY_STATS_HISTOGRAM_BINS", "10")))
+# Resum periòdic pel WebSocket ("quality_stats"): 0 = desactivat
+QUALITY_STATS_BROADCAST_S = float(os.getenv("QUALITY_STATS_BROADCAST_S", "5"))
+
+# Instrumentació del pipeline (/metrics en format Prometheus)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Traces per ampolla (spans de cada etapa); es guarden les últimes METRICS_TRACE_KEEP
+METRICS_TRACE_BOTTLES = os.getenv("METRICS_TRACE_BOTTLES", "false").lower() in ("1", "true", "yes")
+METRICS_TRACE_KEEP = max(1, int(os.getenv("METRICS_TRACE_KEEP", "200")))
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+
+from fastapi import APIRouter, File, HTTPException, UploadFile, WebSocket, WebSocketDisconnect
+
+from .blob_client import UploadQueueFull, UploadResult, upload_service
+from .blob_ledger import get_ledger
+from .buffers import read_upload
+from .config import CONTAINER_LEVEL, CONTAINER_TAP, INGEST_ARCHIVE_TO_BLOB
+from .pairing import IMAGE_KINDS
+from .pipeline import get_active_pipeline
+from .processor import add_image
+from .sharding import coordinator
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def _blob_name(bottle_id: str, kind: str, filename: str | None) -> str:
+    """
+    Nombre canónico `<bottle_id>_<kind><ext>` (el que entiende
+    parse_blob_name). Del nombre que manda la cámara solo se aprovecha la
+    extensión: suele ser siempre el mismo ("image.jpg", "blob") y como
+    clave del ledger o nombre del archivo pisaría la botella anterior.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in _IMAGE_EXTENSIONS:
+        ext = ".jpg"
+    return f"{bottle_id}_{kind}{ext}"
+
+
+def _archive_pair(bottle_id: str, tap: tuple[str, bytes], level: tuple[str, bytes]):
+    """
+    Copia las dos imágenes originales a Blob (opcional, nunca bloquea la
+    inspección). Recibe (nombre, bytes) ya capturados: el pipeline sustituye
+    los frames del BottlePair por su versión reducida y luego los libera.
+    """
+    def on_done(result: UploadResult):
+        if not result.ok:
+            logger.error(f"[ingest] ❌ {bottle_id} - Error archivando {result.blob_name}: {result.error}")
+
+    for container, (blob_name, image_bytes) in ((CONTAINER_TAP, tap), (CONTAINER_LEVEL, level)):
+        try:
+            upload_service.submit_nowait(container, blob_name, image_bytes, on_done=on_done)
+        except UploadQueueFull:
+            logger.error(f"[ingest] 🗑️ {bottle_id} - Cola de subidas llena, {blob_name} no se archiva")
+
+
+async def ingest_image(bottle_id: str, kind: str, image_bytes: bytes, filename: str | None = None) -> str:
+    """
+    Entrada común de la ingesta push (HTTP y WebSocket).
+
+    La imagen va al barrier de processor; cuando la botella está completa se
+    envía directamente al pipeline del watcher, sin pasar por Blob Storage.
+    Devuelve "waiting_pair", "queued" o "forwarded".
+    """
+    if kind not in IMAGE_KINDS:
+        raise HTTPException(status_code=400, detail=f"Tipus d'imatge desconegut: {kind}")
+
+    pipeline = get_active_pipeline()
+    if pipeline is None:
+        raise HTTPException(status_code=409, detail="El sistema està apagat")
+
+    blob_name = _blob_name(bottle_id, kind, filename)
+
+    if not coordinator.owns(bottle_id):
+        # La botella es de otro worker: se deja en Blob y la recoge su watcher.
+        # Nombre canónico, para que el watcher deduzca el mismo bottle_id.
+        container = CONTAINER_TAP if kind == "tap" else CONTAINER_LEVEL
+        result = await upload_service.upload(container, blob_name, image_bytes)
+        if not result.ok:
+            raise HTTPException(status_code=502, detail=f"No s'ha pogut reenviar la imatge: {result.error}")
+        return "forwarded"
+
+    pair = add_image(bottle_id, kind, image_bytes, blob_name)
+    if pair is None:
+        return "waiting_pair"
+
+    logger.info(f"[ingest] 🧴 Botella recibida por push: {bottle_id}")
+
+    # Los blobs archivados ya cuentan como procesados: el watcher no los
+    # volverá a inspeccionar cuando aparezcan en el listado
+    ledger = get_ledger()
+    await ledger.run(ledger.mark_processed, [
+        f"{CONTAINER_TAP}/{pair.tap_blob_name}",
+        f"{CONTAINER_LEVEL}/{pair.level_blob_name}",
+    ])
+
+    if INGEST_ARCHIVE_TO_BLOB:
+        _archive_pair(
+            bottle_id,
+            (pair.tap_blob_name, pair.tap_bytes),
+            (pair.level_blob_name, pair.level_bytes),
+        )
+
+    await pipeline.submit(bottle_id, pair.tap_blob_name, pair.level_blob_name, pair=pair)
+    return "queued"
+
+
+@router.post("/api/ingest/{bottle_id}/{kind}")
+async def ingest_upload(bottle_id: str, kind: str, file: UploadFile = File(...)):
+    image_bytes = await read_upload(file)
+    status = await ingest_image(bottle_id, kind, image_bytes, file.filename)
+    return {"bottle_id": bottle_id, "kind": kind, "status": status}
+
+
+@router.websocket("/ws/ingest")
+async def ingest_websocket(ws: WebSocket):
+    """
+    Ingesta por WebSocket. Por cada imagen, el cliente envía:
+      1. un frame de texto JSON: {"bottle_id": ..., "kind": "tap"|"level", "filename": opcional}
+      2. un frame binario con los bytes de la imagen
+    y recibe {"bottle_id", "kind", "status"} (o {"error"}).
+
+    Una cabecera que no es JSON (o un frame binario donde tocaba la
+    cabecera) se contesta con {"error"} y se espera la siguiente: la
+    conexión de la cámara no se corta por un frame malo.
+    """
+    await ws.accept()
+    try:
+        while True:
+            try:
+                header = json.loads(await ws.receive_text())
+                if not isinstance(header, dict):
+                    raise ValueError(header)
+            except (ValueError, KeyError):
+                # KeyError: el frame era binario (receive_text no tiene "text")
+                await ws.send_json({"error": "Capçalera no vàlida: s'esperava un JSON amb bottle_id i kind"})
+                continue
+            try:
+                image_bytes = await ws.receive_bytes()
+            except KeyError:
+                await ws.send_json({"bottle_id": header.get("bottle_id"), "error": "S'esperava la imatge (frame binari)"})
+                continue
+            bottle_id = header.get("bottle_id")
+            kind = header.get("kind")
+            filename = header.get("filename")
+            try:
+                # Tipos del JSON: un id numérico o una lista rompen el barrier
+                # y el sharding (y 123 y "123" no formarían pareja)
+                if not bottle_id:
+                    raise HTTPException(status_code=400, detail="Falta bottle_id")
+                if not isinstance(bottle_id, str):
+                    raise HTTPException(status_code=400, detail="bottle_id ha de ser un text")
+                if not isinstance(kind, str):
+                    raise HTTPException(status_code=400, detail="kind ha de ser un text (tap o level)")
+                if filename is not None and not isinstance(filename, str):
+                    raise HTTPException(status_code=400, detail="filename ha de ser un text")
+                status = await ingest_image(bottle_id, kind, image_bytes, filename)
+                await ws.send_json({"bottle_id": bottle_id, "kind": kind, "status": status})
+            except HTTPException as e:
+                await ws.send_json({"bottle_id": bottle_id, "kind": kind, "error": e.detail})
+    except WebSocketDisconnect:
+        logger.info("[ingest] ❌ Cámara desconectada")
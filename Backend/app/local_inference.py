@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import (
+    ONNX_INPUT_SIZE,
+    ONNX_INTRA_OP_THREADS,
+    ONNX_LABELS_LEVEL,
+    ONNX_LABELS_TAP,
+    ONNX_MAX_WORKERS,
+    ONNX_MODEL_LEVEL,
+    ONNX_MODEL_TAP,
+)
+from .preprocessing import to_model_input
+
+logger = logging.getLogger(__name__)
+
+
+def _require_runtime():
+    """numpy y onnxruntime solo hacen falta con INFERENCE_BACKEND=onnx."""
+    try:
+        import numpy
+        import onnxruntime
+    except ImportError as e:
+        raise RuntimeError(
+            "El backend 'onnx' necesita numpy i onnxruntime: pip install -r requirements-onnx.txt"
+        ) from e
+    return numpy, onnxruntime
+
+
+def _to_probabilities(np, outputs):
+    """Softmax por fila, salvo que el modelo ya devuelva probabilidades."""
+    outputs = outputs.astype(np.float32, copy=False)
+    if outputs.min() >= 0 and np.allclose(outputs.sum(axis=1), 1, atol=1e-3):
+        return outputs
+    exp = np.exp(outputs - outputs.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class OnnxClassifier:
+    """
+    Clasificador ResNet18 exportado a ONNX, servido en CPU con onnxruntime.
+
+    La InferenceSession se crea una sola vez (warmup() al arrancar la app) y
+    se comparte entre hilos: session.run() es thread-safe y libera el GIL.
+    reload() la vuelve a crear tras re-exportar el modelo.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        labels: list[str],
+        *,
+        input_size: int = ONNX_INPUT_SIZE,
+        intra_op_threads: int = ONNX_INTRA_OP_THREADS,
+    ):
+        self.model_path = model_path
+        self.labels = labels
+        self.input_size = input_size
+        self.intra_op_threads = intra_op_threads
+        self._session = None
+        self._input_name = None
+        self._fixed_batch = False
+        self._identity: str | None = None
+        self._lock = threading.Lock()
+
+    def _file_identity(self) -> str:
+        try:
+            mtime = int(os.path.getmtime(self.model_path))
+        except OSError:
+            mtime = 0
+        return f"onnx:{os.path.abspath(self.model_path)}:{mtime}"
+
+    @property
+    def identity(self) -> str:
+        """
+        Identidad del modelo para la caché de resultados: ruta + mtime del
+        fichero al cargar la sesión. Se calcula al cargar (no en cada
+        predicción, que la consulta para la clave) y cambia con reload().
+        """
+        if self._identity is None:
+            self._identity = self._file_identity()
+        return self._identity
+
+    def _get_session(self):
+        if self._session is not None:
+            return self._session
+        with self._lock:
+            if self._session is None:
+                _, ort = _require_runtime()
+                options = ort.SessionOptions()
+                if self.intra_op_threads > 0:
+                    options.intra_op_num_threads = self.intra_op_threads
+                identity = self._file_identity()
+                session = ort.InferenceSession(
+                    self.model_path, options, providers=["CPUExecutionProvider"]
+                )
+                model_input = session.get_inputs()[0]
+                self._input_name = model_input.name
+                # Modelos exportados sin eje batch dinámico: de una en una
+                self._fixed_batch = model_input.shape[0] == 1
+                self._identity = identity
+                self._session = session
+                logger.info(f"[local_inference] 🚀 Model carregat: {self.model_path}")
+        return self._session
+
+    def reload(self):
+        """Descarta la sesión y carga el fichero de nuevo (nueva identidad)."""
+        with self._lock:
+            self._session = None
+            self._identity = None
+        self._get_session()
+
+    def warmup(self):
+        """Carga la sesión y hace una inferencia en vacío (primera llamada lenta)."""
+        np, _ = _require_runtime()
+        session = self._get_session()
+        dummy = np.zeros((1, 3, self.input_size, self.input_size), dtype=np.float32)
+        session.run(None, {self._input_name: dummy})
+
+    def predict_batch(self, images: list) -> list[tuple[str, float]]:
+        """`images`: bytes o PreprocessedImage (ya decodificadas)."""
+        np, _ = _require_runtime()
+        session = self._get_session()
+        tensor = to_model_input(images, self.input_size)
+
+        if self._fixed_batch:
+            outputs = np.concatenate(
+                [session.run(None, {self._input_name: tensor[i:i + 1]})[0] for i in range(len(images))]
+            )
+        else:
+            outputs = session.run(None, {self._input_name: tensor})[0]
+
+        probabilities = _to_probabilities(np, outputs.reshape(len(images), -1))
+        if probabilities.shape[1] != len(self.labels):
+            raise ValueError(
+                f"El model {self.model_path} retorna {probabilities.shape[1]} classes "
+                f"i hi ha {len(self.labels)} etiquetes configurades"
+            )
+        best = probabilities.argmax(axis=1)
+        return [
+            (self.labels[index], float(probabilities[row, index]))
+            for row, index in enumerate(best)
+        ]
+
+    def predict(self, image) -> tuple[str, float]:
+        return self.predict_batch([image])[0]
+
+
+class LocalInferenceBackend:
+    """
+    Backend de inferencia en CPU local (alternativa a los endpoints de Azure ML).
+
+    Un OnnxClassifier por modelo ('tap', 'level'); las inferencias se ejecutan
+    en un ThreadPoolExecutor propio para no bloquear el event loop.
+    """
+
+    def __init__(self, max_workers: int = ONNX_MAX_WORKERS):
+        self.classifiers = {
+            "tap": OnnxClassifier(ONNX_MODEL_TAP, ONNX_LABELS_TAP),
+            "level": OnnxClassifier(ONNX_MODEL_LEVEL, ONNX_LABELS_LEVEL),
+        }
+        self._max_workers = max(1, max_workers)
+        self._executor: ThreadPoolExecutor | None = None
+
+    def get_classifier(self, model: str) -> OnnxClassifier:
+        classifier = self.classifiers.get(model)
+        if classifier is None:
+            raise ValueError(f"Model desconegut: {model}")
+        return classifier
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self._max_workers, thread_name_prefix="onnx"
+            )
+        return self._executor
+
+    async def warmup(self):
+        loop = asyncio.get_running_loop()
+        for classifier in self.classifiers.values():
+            await loop.run_in_executor(self._get_executor(), classifier.warmup)
+
+    async def predict(self, model: str, image) -> tuple[str, float]:
+        return (await self.predict_batch(model, [image]))[0]
+
+    async def predict_batch(self, model: str, images: list) -> list[tuple[str, float]]:
+        classifier = self.get_classifier(model)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._get_executor(), classifier.predict_batch, images
+        )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_local_backend: LocalInferenceBackend | None = None
+_local_backend_lock = threading.Lock()
+
+
+def get_local_backend() -> LocalInferenceBackend:
+    global _local_backend
+    with _local_backend_lock:
+        if _local_backend is None:
+            _local_backend = LocalInferenceBackend()
+        return _local_backend
+
+
+def close_local_backend():
+    global _local_backend
+    with _local_backend_lock:
+        if _local_backend is not None:
+            _local_backend.close()
+            _local_backend = None
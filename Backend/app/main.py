@@ -2,13 +2,38 @@
 import logging
 from fastapi import FastAPI, WebSocket, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
 import asyncio
 
-from app.azure_client import predict_level_from_bytes_azure, predict_tap_from_bytes_azure
+from app.azure_client import (
+    close_async_clients,
+    predict_level_async,
+    predict_tap_async,
+    resilience_stats,
+    warmup_inference,
+)
 from app.websocket_manager import manager
 from app.pdf_receiver import router as pdf_router
+from app.ingest import router as ingest_router
 from app.blob_watcher import watch_containers
+from app.poll_scheduler import poll_scheduler
+from app.pairing import pairing_stats
+from app.prefetch import prefetch_cache
+from app.report_worker import report_worker
+from app.blob_client import upload_service
+from app.cascade import cascade
+from app.result_cache import result_cache
+from app.result_store import EXPORT_FORMATS, parse_time, result_store
+from app.blob_ledger import close_ledger
+from app.buffers import read_upload
+from app.preprocessing import prepare_image, preprocess_stats
+from app.sharding import coordinator
+from app.quality_stats import WINDOWS, quality_stats
+from app.metrics import metrics
+from app.config import QUALITY_STATS_BROADCAST_S, WORKER_HEARTBEAT_S
+from app import processor
 
 # Configurar logging
 logging.basicConfig(
@@ -28,6 +53,8 @@ logging.getLogger('app.blob_watcher').setLevel(logging.INFO)
 system_running = False
 system_running_event = asyncio.Event()  # Evento para parada reactiva
 watcher_task = None
+coordinator_task = None
+quality_task = None
 
 
 def is_system_running() -> bool:
@@ -38,15 +65,79 @@ def is_system_running() -> bool:
     return system_running
 
 
+def _local_counters() -> dict:
+    """Contadores de este proceso que se suman entre workers."""
+    return {
+        "bottles_processed": processor.bottle_counter,
+        "reports_rendered": report_worker.rendered,
+        "reports_dropped": report_worker.dropped,
+    }
+
+
+async def _coordinator_loop():
+    """
+    Heartbeat del worker (solo con WORKER_COUNT > 1): renueva el lease,
+    comparte contadores y aplica el ON/OFF pedido a cualquier otro worker.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            state = await loop.run_in_executor(None, coordinator.heartbeat, _local_counters())
+            shared = state.get("system_running")
+            if shared == "1" and not system_running:
+                logger.warning("⚡ Encendido pedido desde otro worker")
+                await _turn_on()
+            elif shared == "0" and system_running:
+                logger.warning("🛑 Apagado pedido desde otro worker")
+                _turn_off()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error en el heartbeat del worker: {e}")
+        await asyncio.sleep(WORKER_HEARTBEAT_S)
+
+
+async def _quality_stats_loop():
+    """
+    Resumen periódico de calidad a los dashboards. Con coalesce_key, un
+    cliente lento solo guarda el último resumen pendiente.
+    """
+    while True:
+        await asyncio.sleep(QUALITY_STATS_BROADCAST_S)
+        if not manager.connections:
+            continue
+        try:
+            await manager.broadcast(
+                {"type": "quality_stats", "data": quality_stats.summary()},
+                coalesce_key="quality_stats",
+            )
+        except Exception as e:
+            logger.error(f"❌ Error difundiendo las estadísticas de calidad: {e}")
+
+
 # ==== LIFESPAN: ARRANCAR EL WATCHER AL INICIAR LA APP ====
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # STARTUP: lanzamos watcher en segundo plano
-    global watcher_task, system_running_event
+    global watcher_task, system_running_event, coordinator_task, quality_task
+    if coordinator.enabled:
+        # Slot del worker antes de abrir el ledger (hay uno por slot)
+        await asyncio.get_running_loop().run_in_executor(None, coordinator.acquire)
+        coordinator_task = asyncio.create_task(_coordinator_loop())
+    try:
+        await warmup_inference()
+    except Exception as e:
+        logger.error(f"❌ Error cargando el backend de inferencia: {e}")
+    if QUALITY_STATS_BROADCAST_S > 0:
+        quality_task = asyncio.create_task(_quality_stats_loop())
     logger.info("🚀 Iniciando blob_watcher...")
     watcher_task = asyncio.create_task(watch_containers(is_system_running, system_running_event))
     yield
     # SHUTDOWN: cancelar el watcher si está corriendo
+    if coordinator_task and not coordinator_task.done():
+        coordinator_task.cancel()
+    if quality_task and not quality_task.done():
+        quality_task.cancel()
     if watcher_task and not watcher_task.done():
         logger.info("🛑 Cancelando blob_watcher...")
         watcher_task.cancel()
@@ -54,10 +145,21 @@ async def lifespan(app: FastAPI):
             await watcher_task
         except asyncio.CancelledError:
             pass
+    await manager.aclose()
+    await cascade.stop()
+    await report_worker.stop()
+    await upload_service.stop()
+    prefetch_cache.close()
+    await close_async_clients()
+    result_cache.close()
+    result_store.close()
+    close_ledger()
+    coordinator.release()
 
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(pdf_router)
+app.include_router(ingest_router)
 
 # Orígenes permitidos (tu front en Vite: 5173)
 origins = [
@@ -92,17 +194,9 @@ async def websocket_endpoint(ws: WebSocket):
 
 
 # ==== CONTROL DESDE EL FRONT: ENCENDER / APAGAR SISTEMA ====
-@app.post("/system/on")
-async def system_on():
-    """
-    Llamada desde el front para ENCENDER el sistema.
-    """
+async def _turn_on():
     global system_running, system_running_event, watcher_task
-    
-    # Si ya está encendido, no hacer nada
-    if system_running:
-        return {"status": "ON", "message": "Ya estaba encendido"}
-    
+
     system_running = True
     system_running_event.set()
     
@@ -118,6 +212,40 @@ async def system_on():
     watcher_task = asyncio.create_task(watch_containers(is_system_running, system_running_event))
     
     logger.warning("⚡ SISTEMA ENCENDIDO")
+
+
+def _turn_off():
+    global system_running, system_running_event, watcher_task
+
+    # 🔹 Apagar flags (esto despierta al watcher)
+    system_running = False
+    system_running_event.clear()
+
+    logger.warning("🛑 APAGANDO SISTEMA...")
+
+    # 🔹 Cancelar watcher SIN esperar (clave para no bloquear)
+    if watcher_task and not watcher_task.done():
+        watcher_task.cancel()
+        logger.warning("📛 Cancelación del watcher solicitada")
+
+    logger.warning("🛑 SISTEMA APAGADO (respuesta inmediata)")
+
+
+@app.post("/system/on")
+async def system_on():
+    """
+    Llamada desde el front para ENCENDER el sistema.
+    Con varios workers, los demás lo aplican en su siguiente heartbeat.
+    """
+    await asyncio.get_running_loop().run_in_executor(
+        None, coordinator.set_shared, "system_running", "1"
+    )
+
+    # Si ya está encendido, no hacer nada
+    if system_running:
+        return {"status": "ON", "message": "Ya estaba encendido"}
+    
+    await _turn_on()
     return {"status": "ON"}
 
 
@@ -127,10 +255,12 @@ async def system_off():
     Apaga el sistema de forma inmediata y no bloqueante.
     Idempotente: si ya está apagado, no hace nada.
     """
-    global system_running, system_running_event, watcher_task
-
     logger.warning("📥 /system/off recibido")
 
+    await asyncio.get_running_loop().run_in_executor(
+        None, coordinator.set_shared, "system_running", "0"
+    )
+
     # 🔹 Idempotencia
     if not system_running:
         logger.info("ℹ️ Sistema ya estaba apagado")
@@ -139,18 +269,7 @@ async def system_off():
             "message": "El sistema ya estaba apagado"
         }
 
-    # 🔹 Apagar flags (esto despierta al watcher)
-    system_running = False
-    system_running_event.clear()
-
-    logger.warning("🛑 APAGANDO SISTEMA...")
-
-    # 🔹 Cancelar watcher SIN esperar (clave para no bloquear)
-    if watcher_task and not watcher_task.done():
-        watcher_task.cancel()
-        logger.warning("📛 Cancelación del watcher solicitada")
-
-    logger.warning("🛑 SISTEMA APAGADO (respuesta inmediata)")
+    _turn_off()
 
     return {
         "status": "OFF",
@@ -158,14 +277,209 @@ async def system_off():
     }
 
 
+# ==== POLLING ADAPTATIVO DEL BLOB_WATCHER ====
+@app.get("/api/watcher/poll-stats")
+async def watcher_poll_stats():
+    return poll_scheduler.stats()
+
+
+# ==== EMPAREJADO TAP + LEVEL E IMÁGENES HUÉRFANAS ====
+@app.get("/api/pairing/stats")
+async def get_pairing_stats():
+    return pairing_stats()
+
+
+# ==== DESCARGA ANTICIPADA DE IMÁGENES ====
+@app.get("/api/prefetch/stats")
+async def prefetch_stats():
+    return prefetch_cache.stats()
+
+
+# ==== REPARTO ENTRE WORKERS (WORKER_COUNT > 1) ====
+@app.get("/api/workers/stats")
+async def workers_stats():
+    return await asyncio.get_running_loop().run_in_executor(
+        None, coordinator.stats, _local_counters()
+    )
+
+
+# ==== ESTADÍSTICAS DE CALIDAD POR VENTANAS DE TIEMPO ====
+@app.get("/api/quality/stats")
+async def quality_stats_endpoint(window: str | None = None):
+    """
+    PASS/FAIL, etiquetas e histogramas de confianza en 1m, 15m y 1h
+    (`?window=15m` para una sola ventana). Son de este worker.
+    """
+    if window is not None and window not in WINDOWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Finestra desconeguda: {window} (disponibles: {', '.join(WINDOWS)})",
+        )
+    return quality_stats.summary([window] if window else None)
+
+
+# ==== INSTRUMENTACIÓN DEL PIPELINE ====
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Scrape de Prometheus (histogramas por etapa, colas, botellas en vuelo)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/metrics/summary")
+async def metrics_summary():
+    return metrics.summary()
+
+
+@app.get("/api/metrics/traces")
+async def metrics_traces(limit: int = 50):
+    """Últimas trazas por botella (solo con METRICS_TRACE_BOTTLES=true)."""
+    return {"enabled": metrics.trace_bottles, "traces": metrics.traces(max(1, limit))}
+
+
+# ==== DIFUSIÓN WEBSOCKET ====
+@app.get("/api/ws/stats")
+async def ws_stats():
+    return manager.stats()
+
+
+# ==== ESTADO DE LA GENERACIÓN DE INFORMES PDF ====
+@app.get("/api/reports/stats")
+async def reports_stats():
+    return report_worker.metrics()
+
+
+# ==== RESILIENCIA DEL SCORING (HEDGING, REINTENTOS, CIRCUIT BREAKER) ====
+@app.get("/api/scoring/resilience")
+async def scoring_resilience():
+    return resilience_stats()
+
+
+# ==== INFERENCIA EN CASCADA (CASCADE_MODE) ====
+@app.get("/api/scoring/cascade")
+async def scoring_cascade():
+    return cascade.stats()
+
+
+# ==== SUBIDAS A BLOB STORAGE EN SEGUNDO PLANO ====
+@app.get("/api/uploads/stats")
+async def uploads_stats():
+    return upload_service.stats()
+
+
+@app.get("/api/uploads/{upload_id}")
+async def upload_status(upload_id: int):
+    status = upload_service.status(upload_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Pujada desconeguda: {upload_id}")
+    return status
+
+
+# ==== HISTÓRICO DE RESULTADOS DE INSPECCIÓN ====
+def _result_filters(
+    since: str | None,
+    until: str | None,
+    status: str | None,
+    label: str | None,
+    model: str | None,
+    bottle_id: str | None,
+    order: str,
+) -> dict:
+    if model not in (None, "tap", "level"):
+        raise HTTPException(status_code=400, detail=f"Model desconegut: {model} (tap o level)")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail=f"Ordre desconegut: {order} (asc o desc)")
+    try:
+        return {
+            "since": parse_time(since),
+            "until": parse_time(until),
+            "status": status,
+            "label": label,
+            "model": model,
+            "bottle_id": bottle_id,
+            "order": order,
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/results")
+async def list_results(
+    since: str | None = None,
+    until: str | None = None,
+    status: str | None = None,
+    label: str | None = None,
+    model: str | None = None,
+    bottle_id: str | None = None,
+    cursor: str | None = None,
+    limit: int = 100,
+    order: str = "desc",
+):
+    """
+    Resultados guardados, paginados por cursor (`next_cursor` -> `?cursor=`).
+    `since`/`until` en segundos epoch o ISO 8601 (UTC); `label` con `model`
+    opcional (tap o level). Son de toda la línea (fichero compartido).
+    """
+    filters = _result_filters(since, until, status, label, model, bottle_id, order)
+    try:
+        results, next_cursor = await run_in_threadpool(
+            result_store.query, cursor=cursor, limit=min(max(1, limit), 1000), **filters
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"results": results, "next_cursor": next_cursor}
+
+
+@app.get("/api/results/export")
+async def export_results(
+    format: str = "csv",
+    since: str | None = None,
+    until: str | None = None,
+    status: str | None = None,
+    label: str | None = None,
+    model: str | None = None,
+    bottle_id: str | None = None,
+    order: str = "asc",
+):
+    """Exportación en streaming (CSV o NDJSON) con los mismos filtros que /api/results."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Format desconegut: {format} (disponibles: {', '.join(EXPORT_FORMATS)})",
+        )
+    filters = _result_filters(since, until, status, label, model, bottle_id, order)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        result_store.export(format, **filters),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="results.{format}"'},
+    )
+
+
+@app.get("/api/results/stats")
+async def results_stats():
+    return await run_in_threadpool(result_store.stats)
+
+
+# ==== CACHÉ DE RESULTADOS DE INFERENCIA ====
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return result_cache.stats()
+
+
+# ==== PREPROCESO DE IMÁGENES ====
+@app.get("/api/preprocessing/stats")
+async def preprocessing_stats():
+    return preprocess_stats.as_dict()
+
+
 # ==== RUTAS PARA ANALIZAR IMÁGENES A DEMANDA DESDE EL FRONT ====
 # (Compatibilidad: el front aún llama a /api/analyze/*)
 
 @app.post("/api/analyze/level")
 async def analyze_level(file: UploadFile = File(...)):
     try:
-        image_bytes = await file.read()
-        label, confidence = predict_level_from_bytes_azure(image_bytes)
+        image = await run_in_threadpool(prepare_image, await read_upload(file))
+        label, confidence = await predict_level_async(image)
         return {
             "label": label,
             "confidence": confidence,
@@ -177,8 +491,8 @@ async def analyze_level(file: UploadFile = File(...)):
 @app.post("/api/analyze/tap")
 async def analyze_tap(file: UploadFile = File(...)):
     try:
-        image_bytes = await file.read()
-        label, confidence = predict_tap_from_bytes_azure(image_bytes)
+        image = await run_in_threadpool(prepare_image, await read_upload(file))
+        label, confidence = await predict_tap_async(image)
         return {
             "label": label,
             "confidence": confidence,
@@ -0,0 +1,304 @@
+import contextvars
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Callable
+
+from .config import (
+    METRICS_ENABLED,
+    METRICS_TRACE_BOTTLES,
+    METRICS_TRACE_KEEP,
+)
+
+PREFIX = "bottle_vision_"
+
+# Límites superiores (segundos) de los buckets de latencia: de 1 ms a 30 s
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+
+class Histogram:
+    """
+    Histograma de buckets fijos (semántica de Prometheus: `le` inclusivo).
+    observe() es un bisect + tres sumas bajo un lock: sin asignar memoria.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> tuple[list[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q: float) -> float:
+        """Cuantil aproximado (límite superior del bucket que lo contiene)."""
+        counts, _, count = self.snapshot()
+        if not count:
+            return 0.0
+        rank = math.ceil(q * count)
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class HistogramFamily:
+    """Un Histogram por valor de la etiqueta (p. ej. stage="scoring_tap")."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...], label: str | None = None):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.label = label
+        self._children: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, value: str = "") -> Histogram:
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(value, Histogram(self.buckets))
+        return child
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def children(self) -> list[tuple[str, Histogram]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class Trace:
+    """Spans (etapa, inicio relativo, duración) de UNA botella."""
+
+    __slots__ = ("bottle_id", "started_at", "_t0", "spans")
+
+    def __init__(self, bottle_id: str):
+        self.bottle_id = bottle_id
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.spans: list[tuple[str, float, float]] = []
+
+    def add(self, stage: str, start: float, duration: float):
+        self.spans.append((stage, start - self._t0, duration))
+
+    def as_dict(self) -> dict:
+        return {
+            "bottle_id": self.bottle_id,
+            "started_at": self.started_at,
+            "spans": [
+                {"stage": stage, "start_ms": round(start * 1000, 3), "duration_ms": round(duration * 1000, 3)}
+                for stage, start, duration in self.spans
+            ],
+        }
+
+
+_current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar("bottle_trace", default=None)
+
+
+class _Stage:
+    __slots__ = ("histogram", "stage", "start")
+
+    def __init__(self, histogram: Histogram, stage: str):
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        self.histogram.observe(duration)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(self.stage, self.start, duration)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Metrics:
+    """
+    Instrumentación del pipeline, pensada para el camino caliente.
+
+    - `stage(nombre)`: context manager que mide una etapa (listing,
+      read_image_bytes, scoring, generate_error_pdf, upload_blob, ws_broadcast…)
+      en el histograma `bottle_vision_stage_seconds{stage=...}`. Cuesta
+      unos µs (benchmarks/bench_metrics.py); con METRICS_ENABLED=false no
+      hace nada.
+    - `timed(nombre)`: lo mismo como decorador de funciones síncronas.
+    - Gauges por callback (profundidad de colas, botellas en vuelo): se leen
+      solo al hacer scrape, no cuestan nada en el camino caliente.
+    - Trazas por botella opcionales (METRICS_TRACE_BOTTLES): los spans de las
+      etapas se acumulan en la traza del contexto actual y se guardan las
+      últimas METRICS_TRACE_KEEP.
+
+    render() genera el formato de texto de Prometheus para /metrics.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = METRICS_ENABLED,
+        trace_bottles: bool = METRICS_TRACE_BOTTLES,
+        trace_keep: int = METRICS_TRACE_KEEP,
+    ):
+        self.enabled = enabled
+        self.trace_bottles = enabled and trace_bottles
+        self._histograms: dict[str, HistogramFamily] = {}
+        self._gauges: dict[str, tuple[str, str, Callable[[], float]]] = {}
+        self._traces: deque[Trace] = deque(maxlen=max(1, trace_keep))
+        self._lock = threading.Lock()
+
+        self.stage_seconds = self.histogram(
+            "stage_seconds", "Duració de cada etapa del pipeline", LATENCY_BUCKETS, label="stage"
+        )
+
+    # ---- Registro ----
+
+    def histogram(
+        self, name: str, help_text: str, buckets: tuple[float, ...] = LATENCY_BUCKETS, label: str | None = None
+    ) -> HistogramFamily:
+        with self._lock:
+            family = self._histograms.get(name)
+            if family is None:
+                family = self._histograms[name] = HistogramFamily(PREFIX + name, help_text, buckets, label)
+            return family
+
+    def gauge(self, name: str, help_text: str, fn: Callable[[], float], kind: str = "gauge"):
+        """Registra un valor leído en cada scrape (`kind`="counter" si solo crece)."""
+        self._gauges[name] = (help_text, kind, fn)
+
+    # ---- Etapas ----
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self.stage_seconds.labels(name), name)
+
+    def timed(self, name: str):
+        """Decorador: mide cada llamada como la etapa `name`."""
+        def decorator(fn):
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, stage: str, seconds: float):
+        """Etapa medida por el llamador (p. ej. desde un timestamp previo)."""
+        if not self.enabled:
+            return
+        self.stage_seconds.labels(stage).observe(seconds)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(stage, time.perf_counter() - seconds, seconds)
+
+    # ---- Trazas por botella ----
+
+    def start_trace(self, bottle_id: str) -> Trace | None:
+        """Abre la traza de una botella en el contexto actual (la tarea asyncio)."""
+        if not self.trace_bottles:
+            return None
+        trace = Trace(bottle_id)
+        _current_trace.set(trace)
+        return trace
+
+    def use_trace(self, trace: Trace | None):
+        """Continúa en esta tarea una traza abierta en otra."""
+        if self.trace_bottles:
+            _current_trace.set(trace)
+
+    def finish_trace(self, trace: Trace | None):
+        if trace is None:
+            return
+        if _current_trace.get() is trace:
+            _current_trace.set(None)
+        self._traces.append(trace)
+
+    def traces(self, limit: int | None = None) -> list[dict]:
+        traces = list(self._traces)
+        if limit is not None:
+            traces = traces[-limit:]
+        return [trace.as_dict() for trace in reversed(traces)]
+
+    # ---- Exposición ----
+
+    def summary(self) -> dict:
+        """Resumen JSON por etapa (p50/p95/p99 aproximados por bucket)."""
+        stages = {}
+        for stage, histogram in self.stage_seconds.children():
+            _, total, count = histogram.snapshot()
+            stages[stage] = {
+                "count": count,
+                "avg_ms": round(1000 * total / count, 3) if count else 0.0,
+                "p50_ms": histogram.quantile(0.50) * 1000,
+                "p95_ms": histogram.quantile(0.95) * 1000,
+                "p99_ms": histogram.quantile(0.99) * 1000,
+            }
+        return {"enabled": self.enabled, "tracing": self.trace_bottles, "stages": stages}
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for family in sorted(self._histograms.values(), key=lambda f: f.name):
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} histogram")
+            for value, histogram in family.children():
+                counts, total, count = histogram.snapshot()
+                label = f'{family.label}="{value}",' if family.label else ""
+                cumulative = 0
+                for bound, bucket_count in zip(family.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{family.name}_bucket{{{label}le="{bound:g}"}} {cumulative}')
+                lines.append(f'{family.name}_bucket{{{label}le="+Inf"}} {count}')
+                plain = f"{{{label.rstrip(',')}}}" if label else ""
+                lines.append(f"{family.name}_sum{plain} {total:.6f}")
+                lines.append(f"{family.name}_count{plain} {count}")
+
+        for name, (help_text, kind, fn) in sorted(self._gauges.items()):
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            lines.append(f"{PREFIX}{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
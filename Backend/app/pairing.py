@@ -0,0 +1,210 @@
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Generic, TypeVar
+
+from .config import PAIRING_ORPHAN_TTL_S
+from .metrics import metrics
+from .websocket_manager import manager
+
+logger = logging.getLogger(__name__)
+
+IMAGE_KINDS = ("tap", "level")
+
+V = TypeVar("V")
+
+
+def parse_blob_name(blob_name: str) -> tuple[str, str | None]:
+    """
+    (bottle_id, kind) de un nombre de imagen: `<bottle_id>_<tap|level>[.ext]`.
+
+    Solo cuenta el sufijo al FINAL del nombre (sin extensión, sin distinguir
+    mayúsculas): "bottle_tap_07_level.jpg" -> ("bottle_tap_07", "level"),
+    no "bottle_07" como al reemplazar "_tap" en cualquier posición. Los
+    puntos de los directorios virtuales ("linea.2/x_tap.jpg") no son
+    extensión. Sin sufijo reconocido devuelve (nombre sin extensión, None).
+    """
+    dot = blob_name.rfind(".")
+    stem = blob_name[:dot] if dot > blob_name.rfind("/") + 1 else blob_name
+    if stem.endswith("_tap"):
+        kind = "tap"
+    elif stem.endswith("_level"):
+        kind = "level"
+    else:
+        lowered = stem.lower()
+        kind = "tap" if lowered.endswith("_tap") else "level" if lowered.endswith("_level") else None
+    if kind is None or len(stem) <= len(kind) + 1:
+        return stem, None
+    return stem[: -len(kind) - 1], kind
+
+
+def bottle_id_of(blob_name: str) -> str:
+    return parse_blob_name(blob_name)[0]
+
+
+@dataclass
+class Orphan:
+    bottle_id: str
+    kind: str  # la imagen que SÍ llegó
+    value: object
+    age_s: float
+
+    @property
+    def missing(self) -> str:
+        return "level" if self.kind == "tap" else "tap"
+
+
+class _Entry:
+    __slots__ = ("tap", "level", "first_seen")
+
+    def __init__(self, first_seen: float):
+        self.tap = None
+        self.level = None
+        self.first_seen = first_seen
+
+
+class PairingIndex(Generic[V]):
+    """
+    Emparejado incremental TAP + LEVEL por bottle_id.
+
+    Solo recibe las imágenes nuevas (add() es O(1)) y devuelve la pareja en
+    cuanto está completa. Las entradas se guardan por orden de llegada, así
+    expire() solo mira las más antiguas: cuesta O(huérfanas), no
+    O(pendientes). Una imagen sin pareja tras `orphan_ttl_s` se descarta
+    como huérfana; si su pareja llega después, empieza una espera nueva.
+    """
+
+    def __init__(self, name: str, orphan_ttl_s: float = PAIRING_ORPHAN_TTL_S):
+        self.name = name
+        self.orphan_ttl_s = orphan_ttl_s
+        self._pending: OrderedDict[str, _Entry] = OrderedDict()
+        self.paired = 0
+        self.orphans = 0
+        self.replaced = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, bottle_id: str) -> bool:
+        return bottle_id in self._pending
+
+    def add(self, bottle_id: str, kind: str, value: V, seen_at: float | None = None) -> tuple[V, V] | None:
+        """Añade una imagen; devuelve (tap, level) si completa la botella."""
+        if kind not in IMAGE_KINDS:
+            raise ValueError(f"Tipus d'imatge desconegut: {kind}")
+        entry = self._pending.get(bottle_id)
+        if entry is None:
+            entry = _Entry(time.time() if seen_at is None else seen_at)
+            self._pending[bottle_id] = entry
+        if kind == "tap":
+            if entry.tap is not None:
+                self.replaced += 1
+            entry.tap = value
+        else:
+            if entry.level is not None:
+                self.replaced += 1
+            entry.level = value
+
+        if entry.tap is None or entry.level is None:
+            return None
+        del self._pending[bottle_id]
+        self.paired += 1
+        return entry.tap, entry.level
+
+    def discard(self, bottle_id: str):
+        self._pending.pop(bottle_id, None)
+
+    def pending(self) -> list[tuple[str, str, V]]:
+        """(bottle_id, kind, valor) de las imágenes que esperan pareja."""
+        return [
+            (bottle_id, kind, getattr(entry, kind))
+            for bottle_id, entry in self._pending.items()
+            for kind in IMAGE_KINDS
+            if getattr(entry, kind) is not None
+        ]
+
+    def expire(self, now: float | None = None) -> list[Orphan]:
+        if self.orphan_ttl_s <= 0 or not self._pending:
+            return []
+        now = time.time() if now is None else now
+        orphans = []
+        while self._pending:
+            bottle_id, entry = next(iter(self._pending.items()))
+            age = now - entry.first_seen
+            if age < self.orphan_ttl_s:
+                break
+            del self._pending[bottle_id]
+            kind = "tap" if entry.tap is not None else "level"
+            orphans.append(Orphan(bottle_id, kind, getattr(entry, kind), round(age, 1)))
+        self.orphans += len(orphans)
+        return orphans
+
+    def stats(self, now: float | None = None) -> dict:
+        now = time.time() if now is None else now
+        oldest = next(iter(self._pending.values()), None)
+        waiting_level = sum(entry.level is None for entry in self._pending.values())
+        return {
+            "pending": len(self._pending),
+            "waiting_level": waiting_level,
+            "waiting_tap": len(self._pending) - waiting_level,
+            "oldest_age_s": round(now - oldest.first_seen, 1) if oldest else 0.0,
+            "orphan_ttl_s": self.orphan_ttl_s,
+            "paired": self.paired,
+            "orphans": self.orphans,
+            "replaced": self.replaced,
+        }
+
+
+_indexes: dict[str, PairingIndex] = {}
+
+
+def register_index(index: PairingIndex) -> PairingIndex:
+    """Índices visibles en /api/pairing/stats y en el contador de huérfanas."""
+    _indexes[index.name] = index
+    return index
+
+
+def pairing_stats() -> dict:
+    return {name: index.stats() for name, index in sorted(_indexes.items())}
+
+
+async def publish_orphans(
+    source: str,
+    orphans: list[Orphan],
+    blob_name: Callable[[Orphan], str | None] = lambda orphan: orphan.value,
+):
+    """
+    Avisa a los dashboards (evento "orphan_image") de las imágenes sin
+    pareja. `blob_name` saca el nombre del valor guardado en el índice.
+    """
+    for orphan in orphans:
+        name = blob_name(orphan)
+        logger.warning(
+            f"[pairing] 🧩 {orphan.bottle_id} - {orphan.kind.upper()} sin {orphan.missing.upper()} "
+            f"tras {orphan.age_s:.0f}s, descartada ({source})"
+        )
+        await manager.broadcast({
+            "type": "orphan_image",
+            "data": {
+                "bottle_id": orphan.bottle_id,
+                "kind": orphan.kind,
+                "missing": orphan.missing,
+                "blob_name": name,
+                "age_s": orphan.age_s,
+                "source": source,
+            },
+        })
+
+
+metrics.gauge(
+    "orphan_images_total",
+    "Imatges descartades sense parella després de PAIRING_ORPHAN_TTL_S",
+    lambda: sum(index.orphans for index in _indexes.values()),
+    kind="counter",
+)
+metrics.gauge(
+    "pairing_pending",
+    "Imatges esperant la seva parella",
+    lambda: sum(len(index) for index in _indexes.values()),
+)
@@ -5,60 +5,136 @@ from reportlab.lib.units import cm
 from reportlab.lib.utils import ImageReader
 from datetime import datetime
 from io import BytesIO
+from math import ceil
 
+from PIL import Image
 
-def generate_error_pdf(
-    bottle_id: str,
-    tap_result: dict,
-    level_result: dict,
-    tap_image_bytes: bytes,
-    level_image_bytes: bytes,
-):
+from .config import REPORT_THUMBNAIL_PX, REPORT_THUMBNAIL_QUALITY
+from .verdicts import PASS_LABELS, has_verdict, is_cascaded, is_defect
+
+WIDTH, HEIGHT = A4
+
+# Geometría de la página de una botella (fija: la comparten plantilla y datos)
+RESULT_Y = HEIGHT - 120
+REASONS_Y = RESULT_Y - 110
+IMAGES_Y = REASONS_Y - 120
+IMG_WIDTH = 7 * cm
+IMG_HEIGHT = 9 * cm
+IMG_Y = IMAGES_Y - 25 - IMG_HEIGHT - 10
+LEFT_X = 2 * cm
+RIGHT_X = WIDTH / 2 + 1 * cm
+
+INDEX_ROWS_PER_PAGE = 40
+INDEX_ROW_HEIGHT = 16
+
+# Estado de un modelo en el informe: ok, error (defecto), sin veredicto o
+# no evaluado (la cascada no lo llamó)
+STATE_TEXT = {"ok": "OK", "error": "ERROR", "none": "SENSE VEREDICTE", "skipped": "NO AVALUAT"}
+STATE_BACKGROUND = {
+    "ok": colors.lightgreen, "error": colors.salmon, "none": colors.lightgrey, "skipped": colors.whitesmoke,
+}
+STATE_COLOR = {"ok": colors.green, "error": colors.red, "none": colors.grey, "skipped": colors.lightgrey}
+INDEX_COLOR = {"ok": colors.black, "error": colors.red, "none": colors.grey, "skipped": colors.grey}
+
+
+def make_thumbnail(
+    image_bytes,
+    max_px: int = REPORT_THUMBNAIL_PX,
+    quality: int = REPORT_THUMBNAIL_QUALITY,
+) -> bytes | None:
     """
-    tap_result   = {"label": "tap_present", "confidence": 0.97}
-    level_result = {"label": "ok", "confidence": 0.91}
-    image_bytes  = bytes (jpg / png)
+    JPEG reducido (lado largo <= max_px) para incrustar en el PDF.
+
+    Un JPEG que ya cabe (p. ej. el que deja app.preprocessing) se devuelve
+    tal cual, sin decodificarlo. max_px <= 0 desactiva la reducción.
     """
+    if not image_bytes:
+        return None
+    if max_px <= 0:
+        return bytes(image_bytes)
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            # Image.open solo lee la cabecera: aún no se ha decodificado nada
+            if image.format == "JPEG" and max(image.size) <= max_px:
+                return bytes(image_bytes)
+            image.draft("RGB", (max_px, max_px))
+            image = image.convert("RGB")
+            image.thumbnail((max_px, max_px), Image.Resampling.BILINEAR)
+            buffer = BytesIO()
+            image.save(buffer, format="JPEG", quality=quality)
+            return buffer.getvalue()
+    except Exception:
+        # Imagen ilegible: que reportlab lo intente con los bytes originales
+        return bytes(image_bytes)
 
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
+
+def _state(model: str, result: dict) -> str:
+    label = result["label"]
+    if label == PASS_LABELS[model]:
+        return "ok"
+    if has_verdict(label):
+        return "error"
+    # Ni OK ni defecto: "_skipped"/"_deferred" o "_timeout"/"_unavailable"/"_error"
+    return "skipped" if is_cascaded(label) else "none"
+
+
+def _has_error(tap_result: dict, level_result: dict) -> bool:
+    return is_defect("tap", tap_result["label"]) or is_defect("level", level_result["label"])
+
+
+class _ReportCanvas:
+    """
+    Canvas de informes con la parte estática de la página pre-renderizada.
+
+    Cabecera, títulos de sección y rótulos se dibujan UNA vez por documento
+    como form XObject (beginForm/doForm); cada página solo añade sus datos.
+    En un PDF por lotes la plantilla se escribe una sola vez en el fichero.
+    """
+
+    def __init__(self, buffer: BytesIO, thumbnail_px: int = REPORT_THUMBNAIL_PX):
+        self.c = canvas.Canvas(buffer, pagesize=A4)
+        self.thumbnail_px = thumbnail_px
+        self._templates: set[str] = set()
 
     # ==========================================================
-    # HEADER
+    # TEMPLATE (ESTÁTICO)
     # ==========================================================
-    has_error = (
-        tap_result["label"] != "tap_present"
-        or level_result["label"] != "ok"
-    )
+    def _template(self, has_error: bool) -> str:
+        name = "bottle_page_error" if has_error else "bottle_page_ok"
+        if name in self._templates:
+            return name
 
-    header_color = colors.red if has_error else colors.green
+        c = self.c
+        c.beginForm(name)
 
-    c.setFillColor(header_color)
-    c.rect(0, height - 80, width, 80, fill=1, stroke=0)
+        c.setFillColor(colors.red if has_error else colors.green)
+        c.rect(0, HEIGHT - 80, WIDTH, 80, fill=1, stroke=0)
 
-    c.setFillColor(colors.white)
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(2 * cm, height - 50, "INFORME DE CONTROL DE QUALITAT")
+        c.setFillColor(colors.white)
+        c.setFont("Helvetica-Bold", 20)
+        c.drawString(2 * cm, HEIGHT - 50, "INFORME DE CONTROL DE QUALITAT")
 
-    c.setFont("Helvetica", 11)
-    c.drawString(2 * cm, height - 70, f"Ampolla ID: {bottle_id}")
-    c.drawRightString(
-        width - 2 * cm,
-        height - 70,
-        datetime.now().strftime("%d/%m/%Y %H:%M:%S"),
-    )
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica-Bold", 14)
+        c.drawString(2 * cm, REASONS_Y, "Motiu del rebuig:")
+        c.drawString(2 * cm, IMAGES_Y, "Imatges de la inspecció")
+
+        c.setFont("Helvetica-Bold", 12)
+        c.drawString(LEFT_X, IMAGES_Y - 25, "Tap")
+        c.drawString(RIGHT_X, IMAGES_Y - 25, "Nivell")
 
-    y = height - 120
+        c.endForm()
+        self._templates.add(name)
+        return name
 
     # ==========================================================
     # FUNCTIONS
     # ==========================================================
-    def draw_result_block(title, result, x, y):
-        ok = result["label"] in ("ok", "tap_present")
-        bg = colors.lightgreen if ok else colors.salmon
+    def _draw_result_block(self, title, model, result, x, y):
+        c = self.c
+        state = _state(model, result)
 
-        c.setFillColor(bg)
+        c.setFillColor(STATE_BACKGROUND[state])
         c.rect(x, y - 80, 240, 80, fill=1, stroke=0)
 
         c.setFillColor(colors.black)
@@ -66,7 +142,7 @@ def generate_error_pdf(
         c.drawString(x + 10, y - 25, title)
 
         c.setFont("Helvetica-Bold", 20)
-        c.drawString(x + 10, y - 55, "OK" if ok else "ERROR")
+        c.drawString(x + 10, y - 55, STATE_TEXT[state])
 
         c.setFont("Helvetica", 11)
         c.drawString(
@@ -74,13 +150,16 @@ def generate_error_pdf(
             y - 70,
             f"Etiqueta: {result['label']}",
         )
-        c.drawString(
-            x + 120,
-            y - 55,
-            f"Confiança: {result['confidence']:.3f}",
-        )
+        if state in ("ok", "error"):
+            c.drawString(
+                x + 120,
+                y - 55,
+                f"Confiança: {result['confidence']:.3f}",
+            )
 
-    def draw_image_from_bytes(image_bytes, x, y, w, h):
+    def _draw_image_from_bytes(self, image_bytes, x, y, w, h):
+        c = self.c
+        image_bytes = make_thumbnail(image_bytes, self.thumbnail_px)
         if not image_bytes:
             c.setFont("Helvetica", 10)
             c.drawString(x, y + h / 2, "Imatge no disponible")
@@ -98,94 +177,194 @@ def generate_error_pdf(
             mask="auto",
         )
 
-    def draw_image_border(ok, x, y, w, h):
-        c.setStrokeColor(colors.green if ok else colors.red)
+    def _draw_image_border(self, state, x, y, w, h):
+        c = self.c
+        c.setStrokeColor(STATE_COLOR[state])
         c.setLineWidth(3)
         c.rect(x - 2, y - 2, w + 4, h + 4, fill=0)
 
     # ==========================================================
-    # RESULT BLOCKS
+    # PÁGINA DE UNA BOTELLA
     # ==========================================================
-    draw_result_block("TAP", tap_result, 2 * cm, y)
-    draw_result_block("NIVELL", level_result, width / 2 + 1 * cm, y)
+    def bottle_page(
+        self,
+        bottle_id: str,
+        tap_result: dict,
+        level_result: dict,
+        tap_image_bytes,
+        level_image_bytes,
+        timestamp: datetime | None = None,
+        bookmark: str | None = None,
+    ):
+        c = self.c
+        c.doForm(self._template(_has_error(tap_result, level_result)))
+        if bookmark:
+            c.bookmarkPage(bookmark)
+            c.addOutlineEntry(bottle_id, bookmark, level=0)
 
-    # ==========================================================
-    # REASONS
-    # ==========================================================
-    y -= 110
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(2 * cm, y, "Motiu del rebuig:")
-
-    c.setFont("Helvetica", 12)
-    reasons = []
-    if tap_result["label"] != "tap_present":
-        reasons.append("• Absència o defecte en el tap")
-    if level_result["label"] != "ok":
-        reasons.append("• Nivell incorrecte de líquid")
-
-    if not reasons:
-        c.drawString(2 * cm, y - 25, "— Cap error detectat")
-    else:
-        for i, r in enumerate(reasons):
-            c.drawString(2 * cm, y - 25 - i * 18, r)
+        # HEADER (datos)
+        c.setFillColor(colors.white)
+        c.setFont("Helvetica", 11)
+        c.drawString(2 * cm, HEIGHT - 70, f"Ampolla ID: {bottle_id}")
+        c.drawRightString(
+            WIDTH - 2 * cm,
+            HEIGHT - 70,
+            (timestamp or datetime.now()).strftime("%d/%m/%Y %H:%M:%S"),
+        )
+
+        # RESULT BLOCKS
+        tap_state, level_state = _state("tap", tap_result), _state("level", level_result)
+        self._draw_result_block("TAP", "tap", tap_result, 2 * cm, RESULT_Y)
+        self._draw_result_block("NIVELL", "level", level_result, WIDTH / 2 + 1 * cm, RESULT_Y)
+
+        # REASONS
+        c.setFillColor(colors.black)
+        c.setFont("Helvetica", 12)
+        reasons = []
+        if tap_state == "error":
+            reasons.append("• Absència o defecte en el tap")
+        if level_state == "error":
+            reasons.append("• Nivell incorrecte de líquid")
+
+        if not reasons:
+            c.drawString(2 * cm, REASONS_Y - 25, "— Cap error detectat")
+        else:
+            for i, r in enumerate(reasons):
+                c.drawString(2 * cm, REASONS_Y - 25 - i * 18, r)
+
+        # IMAGES
+        self._draw_image_from_bytes(tap_image_bytes, LEFT_X, IMG_Y, IMG_WIDTH, IMG_HEIGHT)
+        self._draw_image_border(tap_state, LEFT_X, IMG_Y, IMG_WIDTH, IMG_HEIGHT)
+        self._draw_image_from_bytes(level_image_bytes, RIGHT_X, IMG_Y, IMG_WIDTH, IMG_HEIGHT)
+        self._draw_image_border(level_state, RIGHT_X, IMG_Y, IMG_WIDTH, IMG_HEIGHT)
+
+        c.showPage()
 
     # ==========================================================
-    # IMAGES SECTION
+    # ÍNDICE DE UN LOTE
     # ==========================================================
-    y -= 120
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(2 * cm, y, "Imatges de la inspecció")
+    def index_pages(self, title: str, reports: list, first_bottle_page: int):
+        c = self.c
+        pages = ceil(len(reports) / INDEX_ROWS_PER_PAGE)
+        tap_errors = sum(is_defect("tap", r.tap_result["label"]) for r in reports)
+        level_errors = sum(is_defect("level", r.level_result["label"]) for r in reports)
+        columns = [(2 * cm, "#"), (3.2 * cm, "Ampolla"), (6.6 * cm, "Hora"),
+                   (9.6 * cm, "Tap"), (13.6 * cm, "Nivell"), (WIDTH - 2 * cm, "Pàgina")]
 
-    img_width = 7 * cm
-    img_height = 9 * cm
-    img_y = y - 220
+        for page in range(pages):
+            c.setFillColor(colors.darkred)
+            c.rect(0, HEIGHT - 80, WIDTH, 80, fill=1, stroke=0)
+            c.setFillColor(colors.white)
+            c.setFont("Helvetica-Bold", 20)
+            c.drawString(2 * cm, HEIGHT - 50, "ÍNDEX D'AMPOLLES REBUTJADES")
+            c.setFont("Helvetica", 11)
+            c.drawString(2 * cm, HEIGHT - 70, title)
+            c.drawRightString(WIDTH - 2 * cm, HEIGHT - 70, f"Full {page + 1}/{pages}")
 
-        # Subtitles Y
-    subtitle_y = y - 25
+            c.setFillColor(colors.black)
+            y = HEIGHT - 110
+            if page == 0:
+                c.setFont("Helvetica", 12)
+                c.drawString(
+                    2 * cm, y,
+                    f"Ampolles: {len(reports)}   ·   Errors de tap: {tap_errors}"
+                    f"   ·   Errors de nivell: {level_errors}",
+                )
+                y -= 30
 
-    # Image Y (separado claramente)
-    img_y = subtitle_y - img_height - 10
+            c.setFont("Helvetica-Bold", 11)
+            for x, name in columns:
+                (c.drawRightString if name == "Pàgina" else c.drawString)(x, y, name)
+            y -= INDEX_ROW_HEIGHT + 4
 
-    # TAP IMAGE
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(2 * cm, y - 25, "Tap")
-    draw_image_from_bytes(
-        tap_image_bytes,
-        2 * cm,
-        img_y,
-        img_width,
-        img_height,
-    )
-    draw_image_border(
-        tap_result["label"] == "tap_present",
-        2 * cm,
-        img_y,
-        img_width,
-        img_height,
-    )
+            c.setFont("Helvetica", 10)
+            start = page * INDEX_ROWS_PER_PAGE
+            for i, report in enumerate(reports[start:start + INDEX_ROWS_PER_PAGE], start):
+                tap, level = report.tap_result, report.level_result
+                c.setFillColor(colors.black)
+                c.drawString(columns[0][0], y, str(i + 1))
+                c.drawString(columns[1][0], y, report.bottle_id)
+                c.drawString(columns[2][0], y, report.created_at.strftime("%d/%m %H:%M:%S"))
+                for x, model, result in ((columns[3][0], "tap", tap), (columns[4][0], "level", level)):
+                    state = _state(model, result)
+                    c.setFillColor(INDEX_COLOR[state])
+                    text = f"{result['label']} ({result['confidence']:.2f})" if state in ("ok", "error") else result["label"]
+                    c.drawString(x, y, text)
+                c.setFillColor(colors.blue)
+                c.drawRightString(columns[5][0], y, str(first_bottle_page + i))
+                # Toda la fila enlaza a la página de la botella
+                c.linkRect("", f"bottle_{i}", (2 * cm, y - 4, WIDTH - 2 * cm, y + 12), relative=0)
+                y -= INDEX_ROW_HEIGHT
 
-    # LEVEL IMAGE
-    c.drawString(width / 2 + 1 * cm, y - 25, "Nivell")
-    draw_image_from_bytes(
-        level_image_bytes,
-        width / 2 + 1 * cm,
-        img_y,
-        img_width,
-        img_height,
-    )
-    draw_image_border(
-        level_result["label"] == "ok",
-        width / 2 + 1 * cm,
-        img_y,
-        img_width,
-        img_height,
+            c.showPage()
+        return pages
+
+    def save(self):
+        self.c.save()
+
+
+def generate_error_pdf(
+    bottle_id: str,
+    tap_result: dict,
+    level_result: dict,
+    tap_image_bytes: bytes,
+    level_image_bytes: bytes,
+    *,
+    timestamp: datetime | None = None,
+    thumbnail_px: int = REPORT_THUMBNAIL_PX,
+):
+    """
+    tap_result   = {"label": "tap_present", "confidence": 0.97}
+    level_result = {"label": "ok", "confidence": 0.91}
+    image_bytes  = bytes (jpg / png); se incrustan como miniatura JPEG
+                   (lado largo <= thumbnail_px). El JPEG que llega del
+                   pipeline (app.preprocessing) ya cabe y va tal cual.
+    """
+    buffer = BytesIO()
+    report = _ReportCanvas(buffer, thumbnail_px)
+    report.bottle_page(
+        bottle_id, tap_result, level_result, tap_image_bytes, level_image_bytes, timestamp
     )
+    report.save()
 
-    # ==========================================================
-    # FINALIZE
-    # ==========================================================
-    c.showPage()
-    c.save()
+    buffer.seek(0)
+    return buffer
+
+
+def generate_batch_pdf(
+    reports: list,
+    title: str | None = None,
+    *,
+    thumbnail_px: int = REPORT_THUMBNAIL_PX,
+):
+    """
+    Un único PDF para varias botellas FAIL (una ventana de tiempo o un lote):
+    páginas de índice (con enlaces y marcadores) + una página por botella.
+
+    `reports`: objetos con bottle_id, tap_result, level_result,
+    tap_image_bytes, level_image_bytes y created_at (p. ej. ReportJob).
+    """
+    if not reports:
+        raise ValueError("Un informe per lots necessita almenys una ampolla")
+    if title is None:
+        first, last = reports[0].created_at, reports[-1].created_at
+        title = f"{first:%d/%m/%Y %H:%M:%S} – {last:%H:%M:%S}"
+
+    buffer = BytesIO()
+    report = _ReportCanvas(buffer, thumbnail_px)
+    index_pages = ceil(len(reports) / INDEX_ROWS_PER_PAGE)
+    report.index_pages(title, reports, first_bottle_page=index_pages + 1)
+    for i, job in enumerate(reports):
+        report.bottle_page(
+            job.bottle_id,
+            job.tap_result,
+            job.level_result,
+            job.tap_image_bytes,
+            job.level_image_bytes,
+            job.created_at,
+            bookmark=f"bottle_{i}",
+        )
+    report.save()
 
     buffer.seek(0)
     return buffer
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, UploadFile, File
-from .blob_client import upload_pdf
+from fastapi import APIRouter, UploadFile, File, HTTPException
+from .blob_client import UploadQueueFull, upload_service
 from .config import CONTAINER_ERRORS
 
 router = APIRouter()
 
-@router.post("/upload-error-pdf")
+@router.post("/upload-error-pdf", status_code=202)
 async def upload_error_pdf(file: UploadFile = File(...)):
     pdf_bytes = await file.read()
-    upload_pdf(file.filename, pdf_bytes)
-    return {"status": "stored"}
+    # La subida va en segundo plano: su estado en /api/uploads/{upload_id}
+    try:
+        upload = upload_service.submit_nowait(
+            CONTAINER_ERRORS, file.filename, pdf_bytes, content_type="application/pdf"
+        )
+    except UploadQueueFull:
+        raise HTTPException(status_code=503, detail="Cua de pujades plena, torna-ho a provar")
+    return {"status": "queued", "upload_id": upload.upload_id}
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+
+from .config import PIPELINE_CONCURRENCY, PIPELINE_MAX_QUEUE
+from .metrics import metrics
+from .processor import (
+    BottlePair,
+    analyze_bottle,
+    bottles,
+    download_bottle,
+    publish_result,
+    queue_error_report,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BottlePipeline:
+    """
+    Pipeline concurrente de botellas para el blob_watcher.
+
+    - `concurrency` workers solapan descarga + inferencia de varias botellas.
+    - Como mucho `concurrency + max_queue` botellas en vuelo: submit() espera
+      (backpressure) cuando se supera, así el watcher deja de descubrir más.
+    - Los resultados se publican por WebSocket en el MISMO orden de submit(),
+      aunque las inferencias terminen desordenadas.
+    - Los PDF de las botellas FAIL se delegan al report_worker y no frenan la
+      emisión de las siguientes.
+
+    stop() cancela todo lo que está en vuelo (semántica de /system/off).
+    `on_done(bottle_id, tap_blob, level_blob)` se llama cuando una botella
+    termina (publicada o con error), no cuando se cancela.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = PIPELINE_CONCURRENCY,
+        max_queue: int = PIPELINE_MAX_QUEUE,
+        on_done: Callable[[str, str, str], None] | None = None,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.max_in_flight = self.concurrency + max(0, max_queue)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._jobs: asyncio.Queue = asyncio.Queue()
+        self._emit_order: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._on_done = on_done
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.concurrency)
+        ]
+        self._tasks.append(asyncio.create_task(self._emitter()))
+        logger.info(
+            f"[pipeline] 🚀 {self.concurrency} workers, máx. {self.max_in_flight} botellas en vuelo"
+        )
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.warning("[pipeline] 🛑 Detenido")
+
+    async def submit(
+        self,
+        bottle_id: str,
+        tap_blob_name: str,
+        level_blob_name: str,
+        pair: BottlePair | None = None,
+    ):
+        """
+        Encola una botella completa. Espera si el pipeline está lleno.
+        Si se pasa `pair` (imágenes ya en memoria) no se descarga de Blob.
+        """
+        await self._slots.acquire()
+        self.in_flight += 1
+
+        result = asyncio.get_running_loop().create_future()
+        submitted_at = time.perf_counter()
+        self._jobs.put_nowait((bottle_id, tap_blob_name, level_blob_name, pair, result, submitted_at))
+        self._emit_order.put_nowait((bottle_id, tap_blob_name, level_blob_name, result, submitted_at))
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued": self._jobs.qsize(),
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    async def _worker(self, worker_id: int):
+        while True:
+            bottle_id, tap_blob_name, level_blob_name, pair, result, submitted_at = await self._jobs.get()
+            trace = metrics.start_trace(bottle_id)
+            metrics.observe("queue_wait", time.perf_counter() - submitted_at)
+            try:
+                if pair is None:
+                    pair = await download_bottle(bottle_id, tap_blob_name, level_blob_name)
+                result.set_result((pair, await analyze_bottle(bottle_id, pair), trace))
+            except asyncio.CancelledError:
+                result.cancel()
+                raise
+            except Exception as e:
+                result.set_exception(e)
+
+    async def _emitter(self):
+        while True:
+            bottle_id, tap_blob_name, level_blob_name, result, submitted_at = await self._emit_order.get()
+            try:
+                pair, final_result, trace = await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[pipeline] ❌ {bottle_id} - Error: {e}", exc_info=True)
+                self.failed += 1
+                self._finish(bottle_id, tap_blob_name, level_blob_name)
+                continue
+
+            # Un fallo al publicar o al encolar el PDF no puede tumbar el
+            # emisor: los slots no se liberarían y submit() esperaría siempre
+            try:
+                # La traza se abrió en el worker; la publicación se mide en ella
+                metrics.use_trace(trace)
+                await publish_result(final_result)
+                metrics.observe("bottle_total", time.perf_counter() - submitted_at)
+                metrics.finish_trace(trace)
+                self.processed += 1
+
+                if final_result["status"] == "FAIL":
+                    queue_error_report(bottle_id, pair, final_result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[pipeline] ❌ {bottle_id} - Error al publicar: {e}", exc_info=True)
+                self.failed += 1
+            finally:
+                # El ReportJob (si lo hay) ya tiene sus referencias a las imágenes
+                pair.release()
+            self._finish(bottle_id, tap_blob_name, level_blob_name)
+
+    def _finish(self, bottle_id: str, tap_blob_name: str, level_blob_name: str):
+        bottles.discard(bottle_id)
+        self.in_flight -= 1
+        self._slots.release()
+        if self._on_done is not None:
+            try:
+                self._on_done(bottle_id, tap_blob_name, level_blob_name)
+            except Exception as e:
+                logger.error(f"[pipeline] ❌ {bottle_id} - Error en on_done: {e}")
+
+
+# Pipeline del watcher en marcha (None con el sistema apagado). Lo usa la
+# ingesta push para alimentar el mismo pipeline que el polling de Blob.
+_active_pipeline: BottlePipeline | None = None
+
+
+def set_active_pipeline(pipeline: BottlePipeline | None):
+    global _active_pipeline
+    _active_pipeline = pipeline
+
+
+def get_active_pipeline() -> BottlePipeline | None:
+    return _active_pipeline
+
+
+metrics.gauge(
+    "bottles_in_flight",
+    "Ampolles al pipeline (descarregant, analitzant o esperant per publicar)",
+    lambda: _active_pipeline.in_flight if _active_pipeline else 0,
+)
@@ -0,0 +1,128 @@
+import random
+import time
+from typing import Callable
+
+from .config import (
+    BLOB_POLL_BACKOFF,
+    BLOB_POLL_BURST_DELAY_S,
+    BLOB_POLL_IDLE_GRACE_S,
+    BLOB_POLL_INTERVAL_S,
+    BLOB_POLL_JITTER,
+    BLOB_POLL_MAX_INTERVAL_S,
+)
+from .metrics import metrics
+
+
+class PollScheduler:
+    """
+    Intervalo adaptativo entre polls del blob_watcher.
+
+    - Ráfaga: si el poll ha encontrado blobs, el siguiente va enseguida
+      (tras `burst_delay_s`, que solo acota los listados por segundo): con
+      la línea a tope no se duerme un intervalo entero entre tandas.
+    - Régimen: sin blobs nuevos se vuelve al intervalo base; durante
+      `idle_grace_s` desde el último trabajo se mantiene, así los huecos
+      normales entre botellas no suben la latencia de detección.
+    - Backoff: pasada la gracia, el intervalo se multiplica por `backoff` en
+      cada poll vacío hasta `max_interval_s` (línea parada = pocos listados).
+    - Jitter: ±`jitter` (fracción) para que varios workers no listen a la vez.
+    """
+
+    def __init__(
+        self,
+        base_interval_s: float = BLOB_POLL_INTERVAL_S,
+        max_interval_s: float = BLOB_POLL_MAX_INTERVAL_S,
+        backoff: float = BLOB_POLL_BACKOFF,
+        burst_delay_s: float = BLOB_POLL_BURST_DELAY_S,
+        jitter: float = BLOB_POLL_JITTER,
+        idle_grace_s: float = BLOB_POLL_IDLE_GRACE_S,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.base_interval_s = base_interval_s
+        self.max_interval_s = max(base_interval_s, max_interval_s)
+        self.backoff = max(1.0, backoff)
+        self.burst_delay_s = max(0.0, burst_delay_s)
+        self.jitter = min(1.0, max(0.0, jitter))
+        self.idle_grace_s = max(0.0, idle_grace_s)
+        self._rng = rng
+
+        self.started_at = time.monotonic()
+        self.polls = 0
+        self.polls_with_work = 0
+        self.blobs_found = 0
+        self.list_calls = 0
+        self.poll_seconds_total = 0.0
+        self.reset()
+
+    def reset(self, now: float | None = None):
+        """Arranque del watcher: empieza en régimen, como si acabara de haber trabajo."""
+        now = time.monotonic() if now is None else now
+        self.interval_s = self.base_interval_s
+        self.last_work_at = now
+        self.mode = "steady"
+        self.last_delay_s = self.base_interval_s
+
+    def after_poll(
+        self, found: int, duration_s: float = 0.0, list_calls: int = 0, now: float | None = None
+    ) -> float:
+        """Registra un poll y devuelve cuánto esperar antes del siguiente."""
+        now = time.monotonic() if now is None else now
+        self.polls += 1
+        self.blobs_found += found
+        self.list_calls += list_calls
+        self.poll_seconds_total += duration_s
+
+        if found:
+            self.polls_with_work += 1
+            self.last_work_at = now
+            self.interval_s = self.base_interval_s
+            self.mode = "burst"
+            self.last_delay_s = self.burst_delay_s
+            return self.last_delay_s
+
+        if now - self.last_work_at < self.idle_grace_s:
+            self.interval_s = self.base_interval_s
+            self.mode = "steady"
+        elif self.mode != "backoff":
+            self.mode = "backoff"
+        else:
+            self.interval_s = min(self.max_interval_s, self.interval_s * self.backoff)
+
+        delay = self.interval_s
+        if self.jitter:
+            delay *= 1 + self.jitter * (2 * self._rng() - 1)
+        self.last_delay_s = delay
+        return delay
+
+    def stats(self) -> dict:
+        uptime_h = max(time.monotonic() - self.started_at, 1e-9) / 3600
+        return {
+            "mode": self.mode,
+            "next_delay_s": round(self.last_delay_s, 3),
+            "base_interval_s": self.base_interval_s,
+            "max_interval_s": self.max_interval_s,
+            "idle_for_s": round(time.monotonic() - self.last_work_at, 1),
+            "polls": self.polls,
+            "polls_with_work": self.polls_with_work,
+            "empty_polls": self.polls - self.polls_with_work,
+            "blobs_found": self.blobs_found,
+            "list_calls": self.list_calls,
+            "polls_per_hour": round(self.polls / uptime_h),
+            "list_calls_per_hour": round(self.list_calls / uptime_h),
+            "poll_ms_avg": round(1000 * self.poll_seconds_total / self.polls, 2) if self.polls else 0.0,
+        }
+
+
+poll_scheduler = PollScheduler()
+
+metrics.gauge(
+    "poll_delay_seconds",
+    "Espera fins al següent poll del blob_watcher",
+    lambda: poll_scheduler.last_delay_s,
+)
+metrics.gauge(
+    "list_calls_total",
+    "Crides de llistat a Blob Storage del blob_watcher",
+    lambda: poll_scheduler.list_calls,
+    kind="counter",
+)
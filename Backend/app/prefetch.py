@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .blob_client import read_image_bytes
+from .config import (
+    PREFETCH_ENABLED,
+    PREFETCH_MAX_IN_FLIGHT,
+    PREFETCH_MAX_MB,
+    PREFETCH_WORKERS,
+)
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchCache:
+    """
+    Descarga especulativa de imágenes en cuanto el watcher las descubre,
+    sin esperar a que llegue su pareja.
+
+    prefetch() lanza la descarga en un executor propio (no quita hilos al
+    del processor) y los bytes se guardan por (contenedor, blob) en un LRU
+    acotado a `max_bytes`. Cuando la botella se completa, take() entrega
+    los bytes ya en memoria o espera a la descarga que está en curso; así
+    el tiempo de descarga sale del camino crítico. Con un fallo (o si los
+    bytes ya se desalojaron) take() devuelve None y se descarga como antes.
+
+    Cada imagen se entrega una sola vez: take() la saca de la caché.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = PREFETCH_ENABLED,
+        max_bytes: int = PREFETCH_MAX_MB * 2**20,
+        workers: int = PREFETCH_WORKERS,
+        max_in_flight: int = PREFETCH_MAX_IN_FLIGHT,
+    ):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self._entries: OrderedDict[tuple[str, str], bytearray] = OrderedDict()
+        self._in_flight: dict[tuple[str, str], asyncio.Future] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self.bytes_held = 0
+
+        self.started = 0
+        self.skipped = 0
+        self.hits = 0
+        self.waited = 0  # aciertos que aún esperaban la descarga
+        self.misses = 0
+        self.evicted = 0
+        self.discarded = 0
+        self.failed = 0
+        self.wait_seconds_total = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch")
+        return self._executor
+
+    def prefetch(self, container: str, blob_name: str):
+        """Empieza a descargar el blob en segundo plano (no espera)."""
+        if not self.enabled:
+            return
+        key = (container, blob_name)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        if key in self._in_flight:
+            return
+        if len(self._in_flight) >= self.max_in_flight:
+            self.skipped += 1
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_executor(), read_image_bytes, container, blob_name)
+        self._in_flight[key] = future
+        self.started += 1
+        future.add_done_callback(lambda f: self._landed(key, f))
+
+    def _landed(self, key: tuple[str, str], future: asyncio.Future):
+        registered = self._in_flight.get(key) is future
+        if registered:
+            del self._in_flight[key]
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            self.failed += 1
+            logger.warning(f"[prefetch] ⚠️ {key[0]}/{key[1]} - Descarga anticipada fallida: {error}")
+            return
+        # Sin registrar: discard() o clear() mientras se descargaba
+        if registered:
+            self._store(key, future.result())
+
+    def _store(self, key: tuple[str, str], data: bytearray):
+        if len(data) > self.max_bytes:
+            self.evicted += 1
+            return
+        self._entries[key] = data
+        self.bytes_held += len(data)
+        while self.bytes_held > self.max_bytes:
+            _, oldest = self._entries.popitem(last=False)
+            self.bytes_held -= len(oldest)
+            self.evicted += 1
+
+    def _pop(self, key: tuple[str, str]) -> bytearray | None:
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self.bytes_held -= len(data)
+        return data
+
+    async def take(self, container: str, blob_name: str) -> bytearray | None:
+        """
+        Bytes del blob si se anticipó su descarga (esperándola si aún está en
+        curso), o None si hay que descargarlo.
+        """
+        if not self.enabled:
+            return None
+        key = (container, blob_name)
+        data = self._pop(key)
+        if data is not None:
+            self.hits += 1
+            return data
+        future = self._in_flight.get(key)
+        if future is None:
+            self.misses += 1
+            return None
+        start = time.perf_counter()
+        try:
+            # shield: si se cancela la botella, la descarga sigue en la caché
+            data = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.misses += 1
+            return None
+        self.wait_seconds_total += time.perf_counter() - start
+        self._pop(key)
+        self.hits += 1
+        self.waited += 1
+        return data
+
+    def discard(self, container: str, blob_name: str):
+        """La imagen ya no se va a procesar (huérfana o ya procesada)."""
+        key = (container, blob_name)
+        if self._pop(key) is not None or self._in_flight.pop(key, None) is not None:
+            self.discarded += 1
+
+    def clear(self):
+        """Suelta todo; las descargas en curso ya no se guardan."""
+        self._entries.clear()
+        self._in_flight.clear()
+        self.bytes_held = 0
+
+    def close(self):
+        self.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "mb_held": round(self.bytes_held / 2**20, 2),
+            "max_mb": round(self.max_bytes / 2**20, 2),
+            "in_flight": len(self._in_flight),
+            "started": self.started,
+            "skipped": self.skipped,
+            "hits": self.hits,
+            "waited": self.waited,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evicted": self.evicted,
+            "discarded": self.discarded,
+            "failed": self.failed,
+            "wait_ms_avg": round(1000 * self.wait_seconds_total / self.waited, 2) if self.waited else 0.0,
+        }
+
+
+prefetch_cache = PrefetchCache()
+
+metrics.gauge(
+    "prefetch_bytes",
+    "Bytes d'imatges descarregades per endavant esperant la seva ampolla",
+    lambda: prefetch_cache.bytes_held,
+)
+metrics.gauge(
+    "prefetch_hits_total",
+    "Imatges servides per la descàrrega anticipada",
+    lambda: prefetch_cache.hits,
+    kind="counter",
+)
+metrics.gauge(
+    "prefetch_misses_total",
+    "Imatges que s'han hagut de descarregar en completar-se l'ampolla",
+    lambda: prefetch_cache.misses,
+    kind="counter",
+)
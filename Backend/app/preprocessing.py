@@ -0,0 +1,162 @@
+import io
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+from PIL import Image
+
+from .config import (
+    PREPROCESS_IMAGES,
+    PREPROCESS_JPEG_QUALITY,
+    PREPROCESS_SHORT_SIDE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Normalización de ImageNet (la misma que en el entrenamiento de los ResNet18)
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+@dataclass
+class PreprocessedImage:
+    """
+    Imagen de cámara decodificada UNA vez y reducida.
+
+    - `image`: RGB reducido (lado corto = PREPROCESS_SHORT_SIDE), para el
+      backend ONNX local sin volver a decodificar.
+    - `jpeg`: la misma imagen re-codificada en JPEG; es lo que se envía a
+      Azure ML y lo que se incrusta en el PDF (reportlab copia los JPEG tal
+      cual en el PDF, sin re-codificarlos).
+    """
+    image: Image.Image
+    jpeg: bytes
+    original_size: tuple[int, int]
+    original_bytes: int
+
+
+class PreprocessStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds_total = 0.0
+
+    def record(self, bytes_in: int, bytes_out: int, seconds: float):
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.seconds_total += seconds
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": PREPROCESS_IMAGES,
+                "images": self.images,
+                "failures": self.failures,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+                "ms_avg": round(1000 * self.seconds_total / self.images, 2) if self.images else 0.0,
+            }
+
+
+preprocess_stats = PreprocessStats()
+
+
+def _decode(image_bytes, short_side: int) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Decodifica a RGB reduciendo ya en el decoder cuando se puede: con JPEG,
+    draft() descodifica directamente a 1/2, 1/4 o 1/8 de la resolución.
+    Devuelve (imagen, tamaño original).
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    original_size = image.size
+    scale = short_side / min(original_size)
+    if scale < 1:
+        image.draft("RGB", (round(original_size[0] * scale), round(original_size[1] * scale)))
+    image.load()
+    return (image.convert("RGB") if image.mode != "RGB" else image), original_size
+
+
+def preprocess_image(
+    image_bytes,
+    short_side: int = PREPROCESS_SHORT_SIDE,
+    jpeg_quality: int = PREPROCESS_JPEG_QUALITY,
+) -> PreprocessedImage:
+    """Decodifica, reduce (sin ampliar nunca) y re-codifica en JPEG."""
+    start = time.perf_counter()
+    image, original_size = _decode(image_bytes, short_side)
+    width, height = image.size
+    scale = short_side / min(width, height)
+    if scale < 1:
+        image = image.resize(
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            Image.BILINEAR,
+            reducing_gap=2.0,
+        )
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=jpeg_quality)
+    jpeg = buffer.getvalue()
+
+    preprocess_stats.record(len(image_bytes), len(jpeg), time.perf_counter() - start)
+    return PreprocessedImage(
+        image=image,
+        jpeg=jpeg,
+        original_size=original_size,
+        original_bytes=len(image_bytes),
+    )
+
+
+def prepare_image(image_bytes) -> "PreprocessedImage | bytes":
+    """
+    Punto de entrada del pipeline: preprocesa si está activado.
+
+    Si la imagen no se puede decodificar se devuelven los bytes originales,
+    así el endpoint de scoring responde igual que antes del preproceso.
+    """
+    if not PREPROCESS_IMAGES:
+        return image_bytes
+    try:
+        return preprocess_image(image_bytes)
+    except Exception as e:
+        preprocess_stats.record_failure()
+        logger.warning(f"[preprocessing] ⚠️ No s'ha pogut descodificar la imatge: {e}")
+        return image_bytes
+
+
+def payload_bytes(image) -> bytes:
+    """Bytes a enviar al endpoint / incrustar en el PDF."""
+    if isinstance(image, PreprocessedImage):
+        return image.jpeg
+    return image
+
+
+def to_model_input(images: list, size: int):
+    """
+    Lote de imágenes (PreprocessedImage o bytes) -> tensor NCHW float32.
+
+    Cada imagen solo se redimensiona a size×size (las PreprocessedImage ya
+    están decodificadas); la normalización y el paso a NCHW se hacen de una
+    vez sobre el lote entero con NumPy.
+    """
+    import numpy as np
+
+    batch = np.empty((len(images), size, size, 3), dtype=np.uint8)
+    for i, item in enumerate(images):
+        image = item.image if isinstance(item, PreprocessedImage) else _decode(item, size)[0]
+        batch[i] = np.asarray(image.resize((size, size), Image.BILINEAR))
+
+    mean = np.asarray(IMAGENET_MEAN, dtype=np.float32) * 255
+    scale = 1 / (np.asarray(IMAGENET_STD, dtype=np.float32) * 255)
+    tensor = (batch.astype(np.float32) - mean) * scale
+    return np.ascontiguousarray(tensor.transpose(0, 3, 1, 2))
@@ -1,32 +1,63 @@
 import logging
 import asyncio
+import contextvars
+import functools
 import os
+import time
 from collections import defaultdict
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 
-from .blob_client import read_image_bytes, upload_pdf
+from .blob_client import read_image_bytes
 from .azure_client import (
-    predict_tap_from_bytes_azure,
-    predict_level_from_bytes_azure
+    predict_tap_async,
+    predict_level_async
 )
+from .cascade import cascade
+from .pairing import PairingIndex, publish_orphans, register_index
+from .prefetch import prefetch_cache
+from .preprocessing import payload_bytes, prepare_image
+from .resilience import CircuitOpenError
 from .websocket_manager import manager
-from .pdf_generator import generate_error_pdf
+from .report_worker import ReportJob, report_worker
+from .quality_stats import quality_stats
+from .result_store import result_store
+from .metrics import metrics
+from .sharding import coordinator
+from .verdicts import bottle_status
 from .config import (
     CONTAINER_TAP,
     CONTAINER_LEVEL,
-    CONTAINER_ERRORS
+    PROCESSOR_MAX_WORKERS,
 )
 
 logger = logging.getLogger(__name__)
 
-# ThreadPoolExecutor para llamadas síncronas a Azure
-executor = ThreadPoolExecutor(max_workers=4)
+# ThreadPoolExecutor para las llamadas síncronas a Blob Storage y el
+# preproceso de imágenes (cada botella en vuelo ocupa 2 hilos: TAP + LEVEL)
+executor = ThreadPoolExecutor(max_workers=PROCESSOR_MAX_WORKERS)
 
 # Contador global
 bottle_counter = 0
 
+metrics.gauge(
+    "executor_queue_depth",
+    "Tasques esperant un fil de l'executor del processor",
+    lambda: executor._work_queue.qsize(),
+)
+metrics.gauge(
+    "bottles_processed_total",
+    "Ampolles publicades per aquest procés",
+    lambda: bottle_counter,
+    kind="counter",
+)
+
+
+def _in_context(fn, *args):
+    """Callable para run_in_executor que conserva el contexto (traza de la botella)."""
+    return functools.partial(contextvars.copy_context().run, fn, *args)
+
 
 @dataclass
 class BottlePair:
@@ -37,77 +68,247 @@ class BottlePair:
     level_blob_name: str | None = None
     first_seen: datetime = field(default_factory=datetime.utcnow)
 
+    @property
+    def is_complete(self) -> bool:
+        return self.tap_bytes is not None and self.level_bytes is not None
+
+    def release(self):
+        """Suelta los buffers de imagen en cuanto ya no hacen falta."""
+        self.tap_bytes = None
+        self.level_bytes = None
+
+
+# Barrier de la ingesta push por bottle_id: NO importa el orden de llegada.
+# Valores (bytes, nombre del blob); las imágenes sin pareja caducan
+# (PAIRING_ORPHAN_TTL_S, expire_push_orphans) en lugar de quedarse en memoria
+bottles: PairingIndex[tuple[bytes, str | None]] = register_index(PairingIndex("push"))
+
+
+def add_image(bottle_id: str, kind: str, image_bytes: bytes, blob_name: str | None = None) -> BottlePair | None:
+    """
+    Añade una imagen (kind = "tap" | "level") al barrier de su botella.
+
+    Devuelve el BottlePair cuando ya están las dos imágenes (y lo saca del
+    barrier), o None si todavía falta la pareja.
+    """
+    pair = bottles.add(bottle_id, kind, (image_bytes, blob_name))
+    if pair is None:
+        return None
+    (tap_bytes, tap_blob_name), (level_bytes, level_blob_name) = pair
+    return BottlePair(
+        tap_bytes=tap_bytes,
+        level_bytes=level_bytes,
+        tap_blob_name=tap_blob_name,
+        level_blob_name=level_blob_name,
+    )
+
+
+async def expire_push_orphans(now: float | None = None):
+    """Descarta (y notifica) las imágenes push que llevan demasiado sin pareja."""
+    orphans = bottles.expire(now)
+    if orphans:
+        await publish_orphans("push", orphans, blob_name=lambda orphan: orphan.value[1])
+
+
+async def _score(bottle_id: str, model: str, prediction, timeout_s: float) -> tuple[str, float]:
+    """
+    Espera la predicción de UN modelo. Si el endpoint no responde a tiempo,
+    tiene el circuito abierto o falla tras los reintentos, devuelve una
+    etiqueta sin veredicto ("{model}_timeout", "_unavailable", "_error") en
+    lugar de propagar el error: el otro modelo no se pierde por ello.
+    """
+    try:
+        return await asyncio.wait_for(prediction, timeout=timeout_s)
+    except asyncio.TimeoutError:
+        logger.error(f"[processor] ⏱️ {bottle_id} - Timeout de {model}")
+        return f"{model}_timeout", 0.0
+    except CircuitOpenError:
+        logger.warning(f"[processor] 🔌 {bottle_id} - {model} no disponible (circuito abierto)")
+        return f"{model}_unavailable", 0.0
+    except Exception as e:
+        logger.error(f"[processor] ❌ {bottle_id} - Error de {model}: {e!r}")
+        return f"{model}_error", 0.0
+
+
+PREDICTORS = {"tap": predict_tap_async, "level": predict_level_async}
+
 
-# Barrier por bottle_id: NO importa el orden de llegada
-bottles: dict[str, BottlePair] = {}
+def _predict_timeout_s() -> float:
+    # Timeout por modelo, configurable (por defecto 20s)
+    return float(os.getenv("AZURE_PREDICT_TIMEOUT_S", "20"))
 
 
-def _get_bottle_id(blob_name: str) -> str:
+async def _score_cascaded(bottle_id: str, images: dict, timeout_s: float) -> dict[str, tuple[str, float]]:
     """
-    Extreu l'identificador d'ampolla a partir del nom del fitxer
-    Ex: bottle_000013_tap.jpg -> bottle_000013
-    Ex: bottle_000013_level.jpg -> bottle_000013
+    Primero el modelo `cascade.first`; el segundo solo si el primero no
+    decide la botella (ver CascadePolicy). Si la decide, el segundo queda
+    como "{modelo}_skipped" o "{modelo}_deferred" (queue_error_report lo
+    llama más tarde para el PDF).
     """
-    # Elimina extensió
-    name_without_ext = blob_name.rsplit(".", 1)[0]
-    # Elimina sufixos _tap o _level
-    if "_tap" in name_without_ext:
-        return name_without_ext.replace("_tap", "")
-    elif "_level" in name_without_ext:
-        return name_without_ext.replace("_level", "")
-    return name_without_ext
+    first, second = cascade.first, cascade.second
+    start = time.perf_counter()
+    scores = {first: await _score(bottle_id, first, PREDICTORS[first](images[first]), timeout_s)}
+    first_s = time.perf_counter() - start
+    label, confidence = scores[first]
+
+    if cascade.is_decisive(first, label, confidence):
+        cascade.record_decisive(label, first_s)
+        scores[second] = (f"{second}_{'skipped' if cascade.mode == 'skip' else 'deferred'}", 0.0)
+        logger.info(f"[processor] ⏭️ {bottle_id} - {first.upper()} decisivo ({label} {confidence:.2f}), {second.upper()} {cascade.mode}")
+        return scores
+
+    start = time.perf_counter()
+    scores[second] = await _score(bottle_id, second, PREDICTORS[second](images[second]), timeout_s)
+    cascade.record_full(first_s, time.perf_counter() - start)
+    return scores
 
 
 async def process_bottle_parallel(
     bottle_id: str,
-    tap_image_bytes: bytes,
-    level_image_bytes: bytes
+    tap_image_bytes,
+    level_image_bytes
 ):
     """
     Procesa TAP y LEVEL en PARALELO usando dos endpoints Azure ML separados.
     ⏱️ Reduce tiempo de ~5-6s a ~3s.
+
+    Las llamadas son async (httpx): no ocupan hilos del executor y, si vence
+    el timeout de un modelo, wait_for cancela y aborta su petición HTTP.
+    Hedging, reintentos y circuit breaker van por debajo (azure_client).
+    Con CASCADE_MODE los modelos van en serie (_score_cascaded).
     """
-    loop = asyncio.get_running_loop()
-    
-    logger.info(f"[processor] 🚀 {bottle_id} - Procesamiento PARALELO iniciado")
-    
+    timeout_s = _predict_timeout_s()
     try:
-        # Lanzar ambas llamadas a Azure en threads separados con timeout
-        tap_task = loop.run_in_executor(
-            executor,
-            predict_tap_from_bytes_azure,
-            tap_image_bytes
-        )
-        
-        level_task = loop.run_in_executor(
-            executor,
-            predict_level_from_bytes_azure,
-            level_image_bytes
-        )
-        
-        # Esperar a ambas con timeout configurable (por defecto 20s)
-        timeout_s = float(os.getenv("AZURE_PREDICT_TIMEOUT_S", "20"))
-        tap_result, level_result = await asyncio.wait_for(
-            asyncio.gather(tap_task, level_task),
-            timeout=timeout_s,
-        )
-        
-        # Desempaquetar resultados
-        tap_label, tap_confidence = tap_result
-        level_label, level_confidence = level_result
-        
-        logger.info(f"[processor] ✅ {bottle_id} - TAP: {tap_label} ({tap_confidence:.2f}), LEVEL: {level_label} ({level_confidence:.2f})")
-        
-        return tap_label, tap_confidence, level_label, level_confidence
-        
-    except asyncio.TimeoutError:
-        logger.error(f"[processor] ⏱️ Timeout procesando {bottle_id}")
-        # Devolver un resultado para que el sistema siga (se marcará como FAIL)
-        return "tap_timeout", 0.0, "level_timeout", 0.0
+        if cascade.enabled:
+            scores = await _score_cascaded(
+                bottle_id, {"tap": tap_image_bytes, "level": level_image_bytes}, timeout_s
+            )
+            (tap_label, tap_confidence), (level_label, level_confidence) = scores["tap"], scores["level"]
+        else:
+            logger.info(f"[processor] 🚀 {bottle_id} - Procesamiento PARALELO iniciado")
+            (tap_label, tap_confidence), (level_label, level_confidence) = await asyncio.gather(
+                _score(bottle_id, "tap", predict_tap_async(tap_image_bytes), timeout_s),
+                _score(bottle_id, "level", predict_level_async(level_image_bytes), timeout_s),
+            )
     except asyncio.CancelledError:
         logger.warning(f"[processor] ⚠️ Cancelado procesamiento paralelo de {bottle_id}")
         raise
 
+    logger.info(f"[processor] ✅ {bottle_id} - TAP: {tap_label} ({tap_confidence:.2f}), LEVEL: {level_label} ({level_confidence:.2f})")
+
+    return tap_label, tap_confidence, level_label, level_confidence
+
+
+async def preprocess_pair(pair: BottlePair):
+    """
+    Decodifica y reduce TAP+LEVEL una sola vez (en el executor).
+
+    Los frames originales se sustituyen en el BottlePair por su JPEG reducido,
+    que es lo que reutiliza después el PDF; así se liberan cuanto antes.
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.stage("preprocess"):
+        tap_image, level_image = await asyncio.gather(
+            loop.run_in_executor(executor, prepare_image, pair.tap_bytes),
+            loop.run_in_executor(executor, prepare_image, pair.level_bytes),
+        )
+    pair.tap_bytes = payload_bytes(tap_image)
+    pair.level_bytes = payload_bytes(level_image)
+    return tap_image, level_image
+
+
+async def analyze_bottle(bottle_id: str, pair: BottlePair) -> dict:
+    """
+    Inferencia de una botella completa (TAP + LEVEL).
+    Devuelve el resultado SIN publicarlo; el contador y el envío por
+    WebSocket los hace publish_result() para poder emitir en orden.
+    """
+    tap_image, level_image = await preprocess_pair(pair)
+    with metrics.stage("scoring"):
+        tap_label, tap_confidence, level_label, level_confidence = await process_bottle_parallel(
+            bottle_id,
+            tap_image,
+            level_image
+        )
+
+    status = bottle_status(tap_label, level_label)
+    logger.info(f"[processor] 📊 {bottle_id} - {status}")
+
+    return {
+        "bottle_id": bottle_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "tap": {
+            "label": tap_label,
+            "confidence": tap_confidence,
+            "image": pair.tap_blob_name
+        },
+        "level": {
+            "label": level_label,
+            "confidence": level_confidence,
+            "image": pair.level_blob_name
+        },
+        "status": status,
+    }
+
+
+async def publish_result(final_result: dict) -> dict:
+    """Asigna el número de botella y envía el resultado al front."""
+    global bottle_counter
+
+    bottle_counter += 1
+    # Con varios workers, el total de toda la línea (los demás vía heartbeat)
+    final_result["bottles_processed"] = int(coordinator.total("bottles_processed", bottle_counter))
+    quality_stats.record(final_result)
+    result_store.record(final_result)
+
+    await manager.broadcast({
+        "type": "analysis_result",
+        "data": final_result
+    })
+    return final_result
+
+
+def _report_job(bottle_id: str, tap_bytes, level_bytes, final_result: dict) -> ReportJob:
+    return ReportJob(
+        bottle_id=bottle_id,
+        tap_result={
+            "label": final_result["tap"]["label"],
+            "confidence": final_result["tap"]["confidence"],
+        },
+        level_result={
+            "label": final_result["level"]["label"],
+            "confidence": final_result["level"]["confidence"],
+        },
+        tap_image_bytes=tap_bytes,
+        level_image_bytes=level_bytes,
+    )
+
+
+def queue_error_report(bottle_id: str, pair: BottlePair, final_result: dict) -> bool:
+    """
+    Encola el PDF de una botella FAIL en el report_worker (proceso aparte).
+    No espera nunca: la inspección no depende de los informes.
+
+    Si la cascada aplazó un modelo ("_deferred"), el PDF se encola cuando
+    la cola diferida lo haya llamado, con su veredicto como evidencia.
+    """
+    tap_bytes, level_bytes = pair.tap_bytes, pair.level_bytes
+    deferred = next((m for m in ("tap", "level") if final_result[m]["label"] == f"{m}_deferred"), None)
+    if deferred is None:
+        return report_worker.submit(_report_job(bottle_id, tap_bytes, level_bytes, final_result))
+
+    image = tap_bytes if deferred == "tap" else level_bytes
+
+    async def score_and_report():
+        label, confidence = await _score(bottle_id, deferred, PREDICTORS[deferred](image), _predict_timeout_s())
+        logger.info(f"[processor] 🐢 {bottle_id} - {deferred.upper()} diferido: {label} ({confidence:.2f})")
+        evidence = {**final_result, deferred: {**final_result[deferred], "label": label, "confidence": confidence}}
+        report_worker.submit(_report_job(bottle_id, tap_bytes, level_bytes, evidence))
+
+    if cascade.defer(bottle_id, score_and_report):
+        return True
+    return report_worker.submit(_report_job(bottle_id, tap_bytes, level_bytes, final_result))
+
 
 async def process_complete_bottle(bottle_id: str, pair: BottlePair):
     """
@@ -115,73 +316,27 @@ async def process_complete_bottle(bottle_id: str, pair: BottlePair):
     Se llama SOLO cuando están las dos imágenes.
     El orden de llegada es IRRELEVANTE.
     """
-    global bottle_counter
-    
     logger.info(f"[processor] 🔄 {bottle_id} - Botella completa, iniciando análisis")
     
+    trace = metrics.start_trace(bottle_id)
     try:
         # Chequeo de cancelación
         await asyncio.sleep(0)
         
         # 🚀 PROCESAMIENTO PARALELO: TAP + LEVEL simultáneamente
-        tap_label, tap_confidence, level_label, level_confidence = await process_bottle_parallel(
-            bottle_id,
-            pair.tap_bytes,
-            pair.level_bytes
-        )
-
-        bottle_counter += 1
-
-        status = "PASS"
-        if tap_label != "tap_present" or level_label != "ok":
-            status = "FAIL"
-
-        # Preparar resultado
-        final_result = {
-            "bottle_id": bottle_id,
-            "timestamp": datetime.utcnow().isoformat(),
-            "tap": {
-                "label": tap_label,
-                "confidence": tap_confidence,
-                "image": pair.tap_blob_name
-            },
-            "level": {
-                "label": level_label,
-                "confidence": level_confidence,
-                "image": pair.level_blob_name
-            },
-            "status": status,
-            "bottles_processed": bottle_counter
-        }
-
-        logger.info(f"[processor] 📊 {bottle_id} - {status}")
+        final_result = await analyze_bottle(bottle_id, pair)
 
         # --- Enviar al front via WebSocket ---
-        await manager.broadcast({
-            "type": "analysis_result",
-            "data": final_result
-        })
-
-        # --- Si FAIL → generar PDF ---
-        if status == "FAIL":
-            await asyncio.sleep(0)  # Chequeo de cancelación
-            
-            pdf_buffer = generate_error_pdf(
-                bottle_id=bottle_id,
-                tap_result={"label": tap_label, "confidence": tap_confidence},
-                level_result={"label": level_label, "confidence": level_confidence},
-                tap_image_bytes=pair.tap_bytes,
-                level_image_bytes=pair.level_bytes
-            )
-
-            pdf_name = f"{bottle_id}_error_report.pdf"
-            upload_pdf(filename=pdf_name, pdf_bytes=pdf_buffer.read())
+        await publish_result(final_result)
+        metrics.finish_trace(trace)
 
-            logger.warning(f"[processor] 📄 {bottle_id} - PDF guardado: {pdf_name}")
+        # --- Si FAIL → generar PDF (en segundo plano) ---
+        if final_result["status"] == "FAIL":
+            queue_error_report(bottle_id, pair, final_result)
+        pair.release()
 
         # Limpiar del barrier
-        if bottle_id in bottles:
-            del bottles[bottle_id]
+        bottles.discard(bottle_id)
 
         return final_result
 
@@ -192,24 +347,37 @@ async def process_complete_bottle(bottle_id: str, pair: BottlePair):
         logger.error(f"[processor] ❌ {bottle_id} - Error: {e}", exc_info=True)
         raise
 
-async def process_bottle_from_blobs(bottle_id: str, tap_blob_name: str, level_blob_name: str):
-    """Procesa una botella completa descargando TAP+LEVEL en paralelo desde Blob.
 
-    Útil para el blob_watcher cuando ya sabe que la botella está completa, para
-    evitar la espera/descarga secuencial de TAP y LEVEL.
-    """
+async def _fetch_image(container: str, blob_name: str) -> bytearray:
+    """Bytes de la descarga anticipada (prefetch_cache) o, si no la hay, de Blob."""
+    data = await prefetch_cache.take(container, blob_name)
+    if data is not None:
+        return data
     loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _in_context(read_image_bytes, container, blob_name))
 
-    tap_task = loop.run_in_executor(executor, read_image_bytes, CONTAINER_TAP, tap_blob_name)
-    level_task = loop.run_in_executor(executor, read_image_bytes, CONTAINER_LEVEL, level_blob_name)
 
-    tap_bytes, level_bytes = await asyncio.gather(tap_task, level_task)
+async def download_bottle(bottle_id: str, tap_blob_name: str, level_blob_name: str) -> BottlePair:
+    """Descarga TAP+LEVEL en paralelo desde Blob (o las toma ya descargadas)."""
+    with metrics.stage("download"):
+        tap_bytes, level_bytes = await asyncio.gather(
+            _fetch_image(CONTAINER_TAP, tap_blob_name),
+            _fetch_image(CONTAINER_LEVEL, level_blob_name),
+        )
 
-    pair = BottlePair(
+    return BottlePair(
         tap_bytes=tap_bytes,
         level_bytes=level_bytes,
         tap_blob_name=tap_blob_name,
         level_blob_name=level_blob_name,
     )
 
+
+async def process_bottle_from_blobs(bottle_id: str, tap_blob_name: str, level_blob_name: str):
+    """Procesa una botella completa descargando TAP+LEVEL en paralelo desde Blob.
+
+    Útil para el blob_watcher cuando ya sabe que la botella está completa, para
+    evitar la espera/descarga secuencial de TAP y LEVEL.
+    """
+    pair = await download_bottle(bottle_id, tap_blob_name, level_blob_name)
     return await process_complete_bottle(bottle_id, pair)
@@ -0,0 +1,148 @@
+import math
+import time
+
+from .config import (
+    QUALITY_STATS_BUCKET_S,
+    QUALITY_STATS_HISTOGRAM_BINS,
+)
+from .verdicts import has_verdict
+
+# Ventanas expuestas (nombre -> segundos)
+WINDOWS = {"1m": 60, "15m": 15 * 60, "1h": 60 * 60}
+MODELS = ("tap", "level")
+
+
+class _Bucket:
+    __slots__ = ("start", "passed", "failed", "other", "labels", "no_verdict", "histograms")
+
+    def __init__(self, bins: int):
+        self.start = -1
+        self.passed = 0
+        self.failed = 0
+        self.other = 0
+        self.labels: dict[str, dict[str, int]] = {model: {} for model in MODELS}
+        self.no_verdict: dict[str, dict[str, int]] = {model: {} for model in MODELS}
+        self.histograms: dict[str, list[int]] = {model: [0] * bins for model in MODELS}
+
+    def reset(self, start: int):
+        self.start = start
+        self.passed = self.failed = self.other = 0
+        for model in MODELS:
+            self.labels[model].clear()
+            self.no_verdict[model].clear()
+            histogram = self.histograms[model]
+            for i in range(len(histogram)):
+                histogram[i] = 0
+
+
+class QualityStats:
+    """
+    Estadísticas de calidad por ventanas de tiempo (1 min, 15 min, 1 h).
+
+    Anillo fijo de buckets de `bucket_s` segundos que cubre la ventana más
+    larga: registrar una botella es O(1) (se suma a su bucket, reciclándolo
+    si es de una vuelta anterior del anillo) y la memoria no crece por mucho
+    que funcione la línea. Las consultas suman los buckets de la ventana.
+    """
+
+    def __init__(
+        self,
+        bucket_s: float = QUALITY_STATS_BUCKET_S,
+        bins: int = QUALITY_STATS_HISTOGRAM_BINS,
+        horizon_s: int = max(WINDOWS.values()),
+    ):
+        self.bucket_s = bucket_s
+        self.bins = max(1, bins)
+        self.size = math.ceil(horizon_s / bucket_s) + 1
+        self._ring = [_Bucket(self.bins) for _ in range(self.size)]
+        self.total = 0
+
+    def _bucket_index(self, now: float) -> int:
+        return int(now // self.bucket_s)
+
+    def record(self, result: dict, now: float | None = None):
+        """Registra un resultado de analyze_bottle() (O(1))."""
+        index = self._bucket_index(time.time() if now is None else now)
+        bucket = self._ring[index % self.size]
+        if bucket.start != index:
+            bucket.reset(index)
+
+        status = result.get("status")
+        if status == "PASS":
+            bucket.passed += 1
+        elif status == "FAIL":
+            bucket.failed += 1
+        else:
+            bucket.other += 1
+
+        for model in MODELS:
+            prediction = result.get(model) or {}
+            label = prediction.get("label")
+            if label is None:
+                continue
+            if not has_verdict(label):
+                # Timeout, error o sin llamar (cascada): su confianza 0.0 no
+                # es una predicción y falsearía el histograma
+                counts = bucket.no_verdict[model]
+                counts[label] = counts.get(label, 0) + 1
+                continue
+            labels = bucket.labels[model]
+            labels[label] = labels.get(label, 0) + 1
+            confidence = prediction.get("confidence")
+            if confidence is not None:
+                bin_index = min(self.bins - 1, max(0, int(confidence * self.bins)))
+                bucket.histograms[model][bin_index] += 1
+
+        self.total += 1
+
+    def window(self, window_s: int, now: float | None = None) -> dict:
+        last = self._bucket_index(time.time() if now is None else now)
+        first = last - math.ceil(window_s / self.bucket_s) + 1
+
+        passed = failed = other = 0
+        labels: dict[str, dict[str, int]] = {model: {} for model in MODELS}
+        no_verdict: dict[str, dict[str, int]] = {model: {} for model in MODELS}
+        histograms = {model: [0] * self.bins for model in MODELS}
+        for bucket in self._ring:
+            if not first <= bucket.start <= last:
+                continue
+            passed += bucket.passed
+            failed += bucket.failed
+            other += bucket.other
+            for model in MODELS:
+                for label, count in bucket.labels[model].items():
+                    labels[model][label] = labels[model].get(label, 0) + count
+                for label, count in bucket.no_verdict[model].items():
+                    no_verdict[model][label] = no_verdict[model].get(label, 0) + count
+                for i, count in enumerate(bucket.histograms[model]):
+                    histograms[model][i] += count
+
+        total = passed + failed + other
+        return {
+            "window_s": window_s,
+            "total": total,
+            "pass": passed,
+            "fail": failed,
+            "other": other,
+            "reject_rate": round(failed / total, 4) if total else 0.0,
+            "bottles_per_min": round(total * 60 / window_s, 2),
+            "labels": labels,
+            "no_verdict": no_verdict,
+            "confidence_histogram": {
+                "bin_edges": [round(i / self.bins, 3) for i in range(self.bins + 1)],
+                **histograms,
+            },
+        }
+
+    def summary(self, windows: list[str] | None = None, now: float | None = None) -> dict:
+        now = time.time() if now is None else now
+        names = windows or list(WINDOWS)
+        return {
+            "timestamp": now,
+            "bucket_s": self.bucket_s,
+            "total_since_start": self.total,
+            "windows": {name: self.window(WINDOWS[name], now) for name in names},
+        }
+
+
+quality_stats = QualityStats()
@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from .blob_client import UploadResult, upload_service
+from .config import (
+    CONTAINER_ERRORS,
+    REPORT_BATCH_MAX_BOTTLES,
+    REPORT_BATCH_WINDOW_S,
+    REPORT_DRAIN_TIMEOUT_S,
+    REPORT_QUEUE_SIZE,
+    REPORT_WORKERS,
+)
+from .metrics import metrics
+from .pdf_generator import generate_batch_pdf, generate_error_pdf
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReportJob:
+    bottle_id: str
+    tap_result: dict
+    level_result: dict
+    tap_image_bytes: bytes | None
+    level_image_bytes: bytes | None
+    created_at: datetime = field(default_factory=datetime.now)
+
+    @property
+    def pdf_name(self) -> str:
+        return f"{self.bottle_id}_error_report.pdf"
+
+
+def _batch_pdf_name(jobs: list[ReportJob]) -> str:
+    return f"{jobs[0].created_at:%Y%m%d_%H%M%S}_{len(jobs)}_error_batch.pdf"
+
+
+def _render_pdf(job: ReportJob | list[ReportJob]) -> bytes:
+    """Se ejecuta en un proceso del pool (reportlab es CPU y retiene el GIL)."""
+    if isinstance(job, list):
+        return generate_batch_pdf(job).getvalue()
+    return generate_error_pdf(
+        bottle_id=job.bottle_id,
+        tap_result=job.tap_result,
+        level_result=job.level_result,
+        tap_image_bytes=job.tap_image_bytes,
+        level_image_bytes=job.level_image_bytes,
+        timestamp=job.created_at,
+    ).getvalue()
+
+
+class ReportWorker:
+    """
+    Etapa de generación de informes PDF desacoplada del pipeline.
+
+    - submit() nunca espera: si la cola (acotada) está llena, el informe se
+      descarta y se contabiliza en `dropped`.
+    - El render se hace en un ProcessPoolExecutor; la subida a Blob se
+      delega en blob_client.upload_service (reintentos incluidos) y su
+      resultado vuelve por callback a los contadores.
+    - Con `batch_window_s` > 0 las botellas se agrupan en un PDF por ventana
+      de tiempo (o cada `batch_max` botellas) con página de índice; lo
+      pendiente se genera igualmente al parar.
+    - stop() espera a que se vacíe la cola (hasta `drain_timeout_s`); lo
+      que quede sin generar se cuenta en `dropped`.
+    - metrics() expone profundidad de cola y tiempos de render/subida.
+    """
+
+    def __init__(
+        self,
+        workers: int = REPORT_WORKERS,
+        queue_size: int = REPORT_QUEUE_SIZE,
+        batch_window_s: float = REPORT_BATCH_WINDOW_S,
+        batch_max: int = REPORT_BATCH_MAX_BOTTLES,
+        drain_timeout_s: float = REPORT_DRAIN_TIMEOUT_S,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.drain_timeout_s = drain_timeout_s
+        self.batch_window_s = batch_window_s
+        self.batch_max = max(1, batch_max)
+        self._queue: asyncio.Queue | None = None
+        self._pool: ProcessPoolExecutor | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._batch: list[ReportJob] = []
+        self._batch_timer: asyncio.TimerHandle | None = None
+
+        self.submitted = 0
+        self.dropped = 0
+        self.rendered = 0
+        self.bottles_reported = 0
+        self.pdf_bytes_total = 0
+        self.render_errors = 0
+        self.uploaded = 0
+        self.upload_retries_total = 0
+        self.upload_failures = 0
+        self.render_seconds_total = 0.0
+        self.render_seconds_max = 0.0
+        self.last_render_seconds = 0.0
+
+        metrics.gauge(
+            "report_queue_depth",
+            "Informes PDF esperant a la cua del report_worker",
+            lambda: self._queue.qsize() if self._queue else 0,
+        )
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._run(i)) for i in range(self.workers)
+        ]
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: un fork copiaría los hilos, locks y sockets del servidor
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    @property
+    def batching(self) -> bool:
+        return self.batch_window_s > 0
+
+    def submit(self, job: ReportJob) -> bool:
+        """Encola un informe. Devuelve False si se ha descartado (cola llena)."""
+        self._ensure_started()
+        if self.batching:
+            self._batch.append(job)
+            self.submitted += 1
+            if len(self._batch) >= self.batch_max:
+                self._flush_batch()
+            elif self._batch_timer is None:
+                self._batch_timer = asyncio.get_running_loop().call_later(
+                    self.batch_window_s, self._flush_batch
+                )
+            return True
+
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.error(f"[report_worker] 🗑️ {job.bottle_id} - Cola de informes llena, PDF descartado")
+            return False
+        self.submitted += 1
+        return True
+
+    def _flush_batch(self):
+        """Cierra el lote actual y lo encola como un único informe."""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        try:
+            self._queue.put_nowait(batch)
+        except asyncio.QueueFull:
+            self.dropped += len(batch)
+            logger.error(f"[report_worker] 🗑️ Cola de informes llena, lote de {len(batch)} PDF descartado")
+
+    async def stop(self):
+        """Intenta vaciar la cola (hasta drain_timeout_s) y para los workers."""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if self._tasks and self._queue.qsize():
+            logger.info(f"[report_worker] ⏳ Esperando {self._queue.qsize()} informes pendientes")
+            try:
+                await asyncio.wait_for(self._queue.join(), self.drain_timeout_s)
+            except asyncio.TimeoutError:
+                lost = 0
+                while not self._queue.empty():
+                    lost += _bottles(self._queue.get_nowait())
+                    self._queue.task_done()
+                self.dropped += lost
+                logger.error(f"[report_worker] 🗑️ {lost} informes sin generar al parar")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._batch:
+            # El lote abierto puede cubrir minutos de rechazos: no se pierde
+            batch, self._batch = self._batch, []
+            try:
+                await self._process(batch)
+            except Exception as e:
+                logger.error(f"[report_worker] ❌ Lote pendiente perdido al parar: {e}")
+        self._queue = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "batch_window_s": self.batch_window_s,
+            "batch_pending": len(self._batch),
+            "rendered": self.rendered,
+            "bottles_reported": self.bottles_reported,
+            "pdf_kb_per_bottle": round(self.pdf_bytes_total / 1024 / self.bottles_reported, 1) if self.bottles_reported else 0.0,
+            "render_errors": self.render_errors,
+            "uploaded": self.uploaded,
+            "upload_retries": self.upload_retries_total,
+            "upload_failures": self.upload_failures,
+            "render_ms_avg": round(1000 * self.render_seconds_total / self.rendered, 2) if self.rendered else 0.0,
+            "render_ms_max": round(1000 * self.render_seconds_max, 2),
+            "render_ms_last": round(1000 * self.last_render_seconds, 2),
+        }
+
+    async def _run(self, worker_id: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                self.dropped += _bottles(job)
+                logger.error(f"[report_worker] 🗑️ {_describe(job)} - Informe cancelado al parar")
+                raise
+            except Exception as e:
+                logger.error(f"[report_worker] ❌ {_describe(job)} - Error: {e}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job: ReportJob | list[ReportJob]):
+        pdf_bytes = await self._render(job)
+        if pdf_bytes is not None:
+            name = _batch_pdf_name(job) if isinstance(job, list) else job.pdf_name
+            await self._upload(name, pdf_bytes)
+
+    async def _render(self, job: ReportJob | list[ReportJob]) -> bytes | None:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            with metrics.stage("generate_error_pdf"):
+                pdf_bytes = await loop.run_in_executor(self._get_pool(), _render_pdf, job)
+        except BrokenProcessPool:
+            # Un proceso ha muerto: se recrea el pool para los siguientes
+            logger.error(f"[report_worker] 💥 {_describe(job)} - Pool de procesos roto, recreando")
+            self._pool = None
+            self.render_errors += 1
+            return None
+        except Exception as e:
+            logger.error(f"[report_worker] ❌ {_describe(job)} - Error generando PDF: {e}")
+            self.render_errors += 1
+            return None
+
+        elapsed = time.perf_counter() - start
+        self.rendered += 1
+        self.bottles_reported += _bottles(job)
+        self.pdf_bytes_total += len(pdf_bytes)
+        self.render_seconds_total += elapsed
+        self.render_seconds_max = max(self.render_seconds_max, elapsed)
+        self.last_render_seconds = elapsed
+        return pdf_bytes
+
+    async def _upload(self, pdf_name: str, pdf_bytes: bytes):
+        # Si la cola de subidas está llena se espera: la contrapresión llega
+        # a la cola de informes (que descarta), nunca al pipeline
+        await upload_service.submit(
+            CONTAINER_ERRORS, pdf_name, pdf_bytes,
+            content_type="application/pdf", on_done=self._on_uploaded,
+        )
+
+    def _on_uploaded(self, result: UploadResult):
+        self.upload_retries_total += max(0, result.attempts - 1)
+        if result.ok:
+            self.uploaded += 1
+            logger.warning(f"[report_worker] 📄 PDF guardado: {result.blob_name}")
+        else:
+            self.upload_failures += 1
+
+
+def _bottles(job: ReportJob | list[ReportJob]) -> int:
+    return len(job) if isinstance(job, list) else 1
+
+
+def _describe(job: ReportJob | list[ReportJob]) -> str:
+    if isinstance(job, list):
+        return f"Lote de {len(job)} botellas"
+    return job.bottle_id
+
+
+report_worker = ReportWorker()
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """El circuit breaker del endpoint está abierto: se falla sin llamar."""
+
+
+class LatencyTracker:
+    """
+    Cuantil de las últimas `size` latencias con éxito de un endpoint.
+
+    Se recalcula cada `refresh_every` muestras (ordenar 200 floats), así
+    leerlo en cada llamada es O(1).
+    """
+
+    def __init__(self, size: int = 200, refresh_every: int = 20, quantile: float = 0.95):
+        self.samples: deque[float] = deque(maxlen=size)
+        self.refresh_every = max(1, refresh_every)
+        self.quantile = quantile
+        self.value: float | None = None
+        self._since_refresh = 0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self._since_refresh += 1
+        if self.value is None or self._since_refresh >= self.refresh_every:
+            ordered = sorted(self.samples)
+            self.value = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+            self._since_refresh = 0
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+
+class RetryBudget:
+    """
+    Presupuesto global de peticiones extra (reintentos y hedges).
+
+    Cada petición original deposita `ratio` fichas y cada extra gasta una;
+    además se reponen `min_per_s` fichas por segundo para que con poco
+    tráfico aún se pueda reintentar. Con un endpoint caído, los extra no
+    pueden pasar de ~`ratio` de la carga: los reintentos no la multiplican.
+    """
+
+    def __init__(self, ratio: float = 0.1, min_per_s: float = 1.0, max_tokens: float = 100.0):
+        self.ratio = max(0.0, ratio)
+        self.min_per_s = max(0.0, min_per_s)
+        self.max_tokens = max(1.0, max_tokens)
+        self.tokens = self.max_tokens
+        self._updated_at = time.monotonic()
+        self.spent = 0
+        self.exhausted = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._updated_at) * self.min_per_s)
+        self._updated_at = now
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self, now: float | None = None) -> bool:
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.spent += 1
+            return True
+        self.exhausted += 1
+        return False
+
+
+class CircuitBreaker:
+    """
+    closed -> open tras `failure_threshold` fallos seguidos; open falla al
+    instante durante `open_s`; después half_open deja pasar UNA petición de
+    prueba: si va bien se cierra, si falla vuelve a open.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, open_s: float = 10.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_s = open_s
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def allow(self, now: float | None = None) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic() if now is None else now
+        if self.state == "open" and now - self.opened_at >= self.open_s:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.warning(f"[resilience] ✅ {self.name} - Circuito cerrado")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self, now: float | None = None):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or (
+            self.state == "closed" and self.consecutive_failures >= self.failure_threshold
+        ):
+            self.state = "open"
+            self.opened_at = time.monotonic() if now is None else now
+            self.times_opened += 1
+            logger.error(
+                f"[resilience] 🔌 {self.name} - Circuito abierto durante {self.open_s:.0f}s "
+                f"({self.consecutive_failures} fallos seguidos)"
+            )
+
+    def release_probe(self):
+        """La petición de prueba terminó sin veredicto (p. ej. cancelada)."""
+        self._probe_in_flight = False
+
+
+class ResilientCaller:
+    """
+    Política de llamada a UN endpoint:
+
+    - Circuit breaker: con el circuito abierto lanza CircuitOpenError sin
+      llamar (el llamador lo trata como resultado degradado).
+    - Hedging: si la petición pasa del p95 reciente (mín. `hedge_min_delay_s`)
+      se lanza una segunda igual; gana la primera que responda y la otra se
+      cancela. Solo con `hedge_min_samples` latencias observadas.
+    - Reintentos: solo errores transitorios (`is_transient`), hasta
+      `retries` veces con backoff y jitter. Con `attempt_timeout_s`, un
+      intento colgado cuenta como error transitorio (y para el breaker).
+    Hedges y reintentos gastan fichas del RetryBudget compartido.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        budget: RetryBudget,
+        *,
+        is_transient: Callable[[BaseException], bool],
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_min_delay_s: float = 0.05,
+        hedge_min_samples: int = 20,
+        retries: int = 2,
+        retry_backoff_s: float = 0.05,
+        attempt_timeout_s: float | None = None,
+        breaker_failures: int = 5,
+        breaker_open_s: float = 10.0,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.name = name
+        self.budget = budget
+        self.is_transient = is_transient
+        self.hedge = hedge
+        self.hedge_min_delay_s = hedge_min_delay_s
+        self.hedge_min_samples = hedge_min_samples
+        self.retries = max(0, retries)
+        self.retry_backoff_s = retry_backoff_s
+        self.attempt_timeout_s = attempt_timeout_s
+        self.latency = LatencyTracker(quantile=hedge_quantile)
+        self.breaker = CircuitBreaker(name, breaker_failures, breaker_open_s)
+        self._rng = rng
+
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.hedges = 0
+        self.hedges_won = 0
+
+    def hedge_delay(self) -> float | None:
+        if not self.hedge or len(self.latency) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay_s, self.latency.value)
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """`fn` crea una corrutina nueva en cada intento (cada hedge o reintento)."""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.name}: circuit obert")
+        is_probe = self.breaker.state == "half_open"
+        self.calls += 1
+        self.budget.deposit()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    if self.attempt_timeout_s:
+                        result = await asyncio.wait_for(self._attempt(fn), self.attempt_timeout_s)
+                    else:
+                        result = await self._attempt(fn)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    transient = self.is_transient(e)
+                    if transient and attempt < self.retries and self.budget.try_spend():
+                        attempt += 1
+                        self.retried += 1
+                        delay = self.retry_backoff_s * (2 ** (attempt - 1)) * (0.5 + self._rng())
+                        logger.warning(
+                            f"[resilience] 🔁 {self.name} - Reintento {attempt} en {delay * 1000:.0f} ms: {e!r}"
+                        )
+                        await asyncio.sleep(delay)
+                        continue
+                    self.failures += 1
+                    if transient:
+                        self.breaker.record_failure()
+                    raise
+                self.breaker.record_success()
+                return result
+        finally:
+            if is_probe:
+                # Prueba de half_open cancelada o con error no transitorio: sin veredicto
+                self.breaker.release_probe()
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]]) -> T:
+        start = time.perf_counter()
+        delay = self.hedge_delay()
+        if delay is None:
+            result = await fn()
+            self.latency.observe(time.perf_counter() - start)
+            return result
+
+        primary = asyncio.ensure_future(fn())
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.budget.try_spend():
+                self.hedges += 1
+                tasks.append(asyncio.ensure_future(fn()))
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if not t.exception()), None)
+                if winner is not None:
+                    if winner is not primary:
+                        self.hedges_won += 1
+                    self.latency.observe(time.perf_counter() - start)
+                    return winner.result()
+                tasks = [t for t in tasks if t not in done]
+                if not tasks:
+                    # Todas han fallado: se propaga el error de la primera
+                    return primary.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.times_opened,
+            "breaker_rejected": self.breaker.rejected,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retried,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1) if self.hedge_delay() is not None else None,
+        }
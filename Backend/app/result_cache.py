@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .config import (
+    RESULT_CACHE_DISK_MAX_ENTRIES,
+    RESULT_CACHE_FLUSH_MS,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_SQLITE_PATH,
+    RESULT_CACHE_TTL_S,
+)
+
+logger = logging.getLogger(__name__)
+
+# Tamaño aproximado de una entrada en memoria (clave + tupla + nodo del dict)
+_APPROX_ENTRY_BYTES = 240
+# Escrituras a disco pendientes a partir de las cuales se descartan
+_MAX_PENDING_WRITES = 10_000
+
+_INSERT = "INSERT OR REPLACE INTO results (key, label, confidence, expires_at) VALUES (?, ?, ?, ?)"
+
+
+class ResultCache:
+    """
+    Caché de resultados de inferencia por contenido de la imagen.
+
+    Clave = hash BLAKE2b de los bytes + identidad del modelo (endpoint), así
+    una imagen re-subida o un frame retransmitido no vuelve a Azure ML.
+
+    - Nivel en memoria: LRU acotado a `max_entries`, con TTL por entrada.
+    - Nivel opcional en disco (SQLite) que sobrevive a reinicios; sus
+      aciertos se promocionan a memoria.
+    Solo se guardan predicciones correctas (nunca errores ni timeouts).
+
+    El nivel en memoria se consulta en línea; el disco nunca se toca desde
+    el event loop: get() lee en el executor solo si la memoria falla y
+    put() deja la fila en una deque que un hilo escribe por lotes (como
+    ResultStore) cada `flush_ms` como mucho. Lo aún no escrito sigue en
+    memoria, así que no se pierden aciertos por ese retraso.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl_s: float = RESULT_CACHE_TTL_S,
+        sqlite_path: str | None = RESULT_CACHE_SQLITE_PATH,
+        disk_max_entries: int = RESULT_CACHE_DISK_MAX_ENTRIES,
+        flush_ms: float = RESULT_CACHE_FLUSH_MS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_max_entries = disk_max_entries
+        self.flush_s = flush_ms / 1000
+        self.sqlite_path = sqlite_path
+        self._memory: OrderedDict[str, tuple[float, str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Conexión de lectura (executor); el hilo escritor abre la suya (WAL)
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        self._pending: deque[tuple[str, str, float, float]] = deque()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._writer: threading.Thread | None = None
+        self._puts_since_prune = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_written = 0
+        self.disk_dropped = 0
+
+        if sqlite_path and self.enabled:
+            self._db = self._connect()
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " label TEXT NOT NULL,"
+                " confidence REAL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)"
+            )
+            self._db.commit()
+            self._writer = threading.Thread(target=self._run_writer, name="result-cache", daemon=True)
+            self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(model_id: str, image_bytes: bytes) -> str:
+        digest = hashlib.blake2b(image_bytes, digest_size=20).hexdigest()
+        return f"{model_id}:{digest}"
+
+    def _get_memory(self, key: str, now: float) -> tuple[str, float] | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, label, confidence = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return label, confidence
+            del self._memory[key]
+            self.expirations += 1
+            return None
+
+    def _get_disk(self, key: str, now: float) -> tuple[str, float] | None:
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT label, confidence, expires_at FROM results WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None or row[2] <= now:
+            return None
+        label, confidence, expires_at = row
+        with self._lock:
+            self._store_memory(key, expires_at, label, confidence)
+            self.hits += 1
+            self.disk_hits += 1
+        return label, confidence
+
+    async def get(self, key: str) -> tuple[str, float] | None:
+        now = time.time()
+        cached = self._get_memory(key, now)
+        if cached is None and self._db is not None:
+            loop = asyncio.get_running_loop()
+            cached = await loop.run_in_executor(None, self._get_disk, key, now)
+        if cached is None:
+            self.misses += 1
+        return cached
+
+    def put(self, key: str, result: tuple[str, float]):
+        label, confidence = result
+        expires_at = time.time() + self.ttl_s
+        with self._lock:
+            self._store_memory(key, expires_at, label, confidence)
+        if self._writer is not None:
+            if len(self._pending) >= _MAX_PENDING_WRITES:
+                self.disk_dropped += 1
+                return
+            self._pending.append((key, label, confidence, expires_at))
+
+    def _store_memory(self, key: str, expires_at: float, label: str, confidence: float):
+        self._memory[key] = (expires_at, label, confidence)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    # ---------------------------------------------------------------
+    # Hilo escritor del nivel en disco
+    # ---------------------------------------------------------------
+    def _run_writer(self):
+        db = self._connect()
+        try:
+            while True:
+                self._wakeup.wait(self.flush_s)
+                self._wakeup.clear()
+                if self._pending:
+                    self._flush(db)
+                if self._stopping and not self._pending:
+                    return
+        finally:
+            db.close()
+
+    def _flush(self, db: sqlite3.Connection):
+        batch = []
+        while self._pending:
+            batch.append(self._pending.popleft())
+        try:
+            with db:
+                db.executemany(_INSERT, batch)
+        except sqlite3.Error as e:
+            self.disk_dropped += len(batch)
+            logger.error(f"[result_cache] ❌ {len(batch)} resultados sin guardar en disco: {e}")
+            return
+        self.disk_written += len(batch)
+        self._puts_since_prune += len(batch)
+        if self._puts_since_prune >= 1000:
+            self._prune_disk(db)
+
+    def _prune_disk(self, db: sqlite3.Connection):
+        """Borra expirados y, si hace falta, los que caducan antes."""
+        self._puts_since_prune = 0
+        with db:
+            db.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+            db.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_max_entries,),
+            )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = len(self._memory)
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "approx_memory_bytes": entries * _APPROX_ENTRY_BYTES,
+            "ttl_s": self.ttl_s,
+            "disk_tier": self._db is not None,
+            "disk_pending": len(self._pending),
+            "disk_written": self.disk_written,
+            "disk_dropped": self.disk_dropped,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def close(self):
+        """Escribe lo pendiente, para el hilo escritor y cierra el disco."""
+        if self._writer is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._writer.join(timeout=10)
+            self._writer = None
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+result_cache = ResultCache()
@@ -0,0 +1,424 @@
+import base64
+import csv
+import io
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterator
+
+from .config import (
+    RESULT_STORE_BATCH_SIZE,
+    RESULT_STORE_FLUSH_MS,
+    RESULT_STORE_MAX_PENDING,
+    RESULT_STORE_PATH,
+    RESULT_STORE_RETENTION_S,
+)
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    "ts",
+    "bottle_id",
+    "status",
+    "tap_label",
+    "tap_confidence",
+    "level_label",
+    "level_confidence",
+    "tap_image",
+    "level_image",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id               INTEGER PRIMARY KEY,
+    ts               REAL NOT NULL,
+    bottle_id        TEXT NOT NULL,
+    status           TEXT NOT NULL,
+    tap_label        TEXT,
+    tap_confidence   REAL,
+    level_label      TEXT,
+    level_confidence REAL,
+    tap_image        TEXT,
+    level_image      TEXT
+);
+CREATE INDEX IF NOT EXISTS results_ts ON results (ts);
+CREATE INDEX IF NOT EXISTS results_status_ts ON results (status, ts);
+CREATE INDEX IF NOT EXISTS results_tap_label_ts ON results (tap_label, ts);
+CREATE INDEX IF NOT EXISTS results_level_label_ts ON results (level_label, ts);
+CREATE INDEX IF NOT EXISTS results_bottle_id ON results (bottle_id);
+"""
+
+_INSERT = f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+EXPORT_FORMATS = ("csv", "ndjson")
+
+
+def parse_time(value: str | float | None) -> float | None:
+    """Segundos epoch o ISO 8601 (sin zona = UTC, como los timestamps del resultado)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Data no vàlida: {value}") from None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _encode_cursor(ts: float, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{ts!r}:{row_id}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, row_id = raw.split(":")
+        return float(ts), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Cursor no vàlid: {cursor}") from None
+
+
+def _as_dict(row: tuple) -> dict:
+    _, ts, bottle_id, status, tap_label, tap_confidence, level_label, level_confidence, tap_image, level_image = row
+    return {
+        "bottle_id": bottle_id,
+        "timestamp": datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None).isoformat(),
+        "ts": ts,
+        "status": status,
+        "tap": {"label": tap_label, "confidence": tap_confidence, "image": tap_image},
+        "level": {"label": level_label, "confidence": level_confidence, "image": level_image},
+    }
+
+
+class ResultStore:
+    """
+    Histórico de inspecciones en SQLite (WAL), solo de añadir.
+
+    record() es lo único que corre en el camino de la inspección: mete una
+    tupla en una deque y, si hay un lote lleno, despierta al hilo escritor.
+    El hilo escribe lotes de hasta `batch_size` filas en una transacción
+    cada `flush_ms` como mucho, así el event loop no toca nunca el disco.
+    Si el disco no da abasto y hay más de `max_pending` filas esperando,
+    se descartan (contadas en `dropped`): la inspección no espera nunca.
+
+    Las consultas usan otra conexión (WAL: los lectores no bloquean al
+    escritor) con paginación por cursor sobre (ts, id); lo aún no escrito
+    (como mucho `flush_ms`) no sale en las consultas.
+    """
+
+    def __init__(
+        self,
+        path: str | None = RESULT_STORE_PATH,
+        batch_size: int = RESULT_STORE_BATCH_SIZE,
+        flush_ms: float = RESULT_STORE_FLUSH_MS,
+        max_pending: int = RESULT_STORE_MAX_PENDING,
+        retention_s: float = RESULT_STORE_RETENTION_S,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_s = flush_ms / 1000
+        self.max_pending = max_pending
+        self.retention_s = retention_s
+        self._pending: deque[tuple] = deque()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        self._reader: sqlite3.Connection | None = None
+        self._reader_lock = threading.Lock()
+        self._last_prune = 0.0
+
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.write_errors = 0
+        self.write_seconds_total = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # Con varios workers todos escriben en el mismo fichero
+        db.execute("PRAGMA busy_timeout=5000")
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _ensure_started(self):
+        if self._thread is not None or not self.enabled:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="result-store", daemon=True)
+        self._thread.start()
+
+    # ---------------------------------------------------------------
+    # Escritura
+    # ---------------------------------------------------------------
+    def record(self, result: dict, now: float | None = None):
+        """Añade un resultado de analyze_bottle() (O(1), sin E/S)."""
+        if not self.enabled:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._ensure_started()
+        tap = result.get("tap") or {}
+        level = result.get("level") or {}
+        self._pending.append((
+            time.time() if now is None else now,
+            result["bottle_id"],
+            result.get("status"),
+            tap.get("label"),
+            tap.get("confidence"),
+            level.get("label"),
+            level.get("confidence"),
+            tap.get("image"),
+            level.get("image"),
+        ))
+        self.recorded += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _run(self):
+        db = self._connect()
+        db.executescript(_SCHEMA)
+        db.commit()
+        logger.info(f"[result_store] 🚀 Histórico de resultados en {self.path}")
+        try:
+            while True:
+                self._wakeup.wait(self.flush_s)
+                self._wakeup.clear()
+                while self._pending:
+                    self._flush(db)
+                if self._stopping:
+                    return
+                self._maybe_prune(db)
+        finally:
+            db.close()
+
+    def _flush(self, db: sqlite3.Connection):
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            batch.append(self._pending.popleft())
+        start = time.perf_counter()
+        try:
+            with db:
+                db.executemany(_INSERT, batch)
+        except sqlite3.Error as e:
+            self.write_errors += 1
+            self.dropped += len(batch)
+            logger.error(f"[result_store] ❌ {len(batch)} resultados sin guardar: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        self.written += len(batch)
+        self.flushes += 1
+        self.write_seconds_total += elapsed
+        metrics.observe("result_store_write", elapsed)
+
+    def _maybe_prune(self, db: sqlite3.Connection):
+        if self.retention_s <= 0:
+            return
+        now = time.time()
+        if now - self._last_prune < 3600:
+            return
+        self._last_prune = now
+        try:
+            with db:
+                deleted = db.execute("DELETE FROM results WHERE ts < ?", (now - self.retention_s,)).rowcount
+        except sqlite3.Error as e:
+            logger.error(f"[result_store] ❌ Error eliminando resultados antiguos: {e}")
+            return
+        if deleted:
+            logger.info(f"[result_store] 🧹 {deleted} resultados antiguos eliminados")
+
+    def flush(self, timeout_s: float = 5.0) -> bool:
+        """Espera a que se escriba lo pendiente (pruebas, benchmarks, parada)."""
+        deadline = time.monotonic() + timeout_s
+        while self._pending and self._thread is not None and time.monotonic() < deadline:
+            self._wakeup.set()
+            time.sleep(0.005)
+        return not self._pending
+
+    def close(self):
+        """Escribe lo pendiente y para el hilo escritor."""
+        if self._thread is not None:
+            self._stopping = True
+            self._wakeup.set()
+            self._thread.join(timeout=10)
+            if self._pending:
+                logger.error(f"[result_store] ❌ {len(self._pending)} resultados sin guardar al parar")
+            self._thread = None
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    # ---------------------------------------------------------------
+    # Consultas
+    # ---------------------------------------------------------------
+    def _read(self, sql: str, params: list) -> list[tuple]:
+        with self._reader_lock:
+            if self._reader is None:
+                self._reader = self._connect()
+                self._reader.executescript(_SCHEMA)
+            return self._reader.execute(sql, params).fetchall()
+
+    def query(
+        self,
+        *,
+        since: float | None = None,
+        until: float | None = None,
+        status: str | None = None,
+        label: str | None = None,
+        model: str | None = None,
+        bottle_id: str | None = None,
+        cursor: str | None = None,
+        limit: int = 100,
+        order: str = "desc",
+    ) -> tuple[list[dict], str | None]:
+        """
+        Una página de resultados y el cursor de la siguiente (None si no hay).
+
+        `label` filtra por la etiqueta de `model` ("tap" o "level") o de
+        cualquiera de los dos. `order` es "desc" (más recientes primero) o
+        "asc". Síncrono: desde el event loop, en un executor.
+        """
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Ordre desconegut: {order}")
+        if model not in (None, "tap", "level"):
+            raise ValueError(f"Model desconegut: {model}")
+        if not self.enabled:
+            return [], None
+
+        where, params = [], []
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if label and model:
+            where.append(f"{model}_label = ?")
+            params.append(label)
+        if bottle_id:
+            where.append("bottle_id = ?")
+            params.append(bottle_id)
+        if cursor:
+            ts, row_id = _decode_cursor(cursor)
+            where.append("(ts, id) < (?, ?)" if order == "desc" else "(ts, id) > (?, ?)")
+            params.extend((ts, row_id))
+
+        direction = "DESC" if order == "desc" else "ASC"
+        order_by = f" ORDER BY ts {direction}, id {direction} LIMIT ?"
+        select = "SELECT id, " + ", ".join(COLUMNS) + " FROM results WHERE "
+        limit = max(1, limit)
+        if label and not model:
+            # Una rama por índice de etiqueta (ya ordenadas) en vez de un OR
+            # que obliga a ordenar todas las coincidencias
+            arm = select + " AND ".join(where + ["{}_label = ?"]) + order_by
+            sql = (
+                f"SELECT * FROM ({arm.format('tap')}) UNION SELECT * FROM ({arm.format('level')})"
+                + order_by
+            )
+            arm_params = params + [label, limit + 1]
+            rows = self._read(sql, arm_params + arm_params + [limit + 1])
+        else:
+            sql = select + (" AND ".join(where) if where else "1") + order_by
+            rows = self._read(sql, params + [limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1][1], rows[-1][0])
+        return [_as_dict(row) for row in rows], next_cursor
+
+    def iter_results(self, page_size: int = 1000, **filters) -> Iterator[dict]:
+        """Todos los resultados de los filtros, página a página (memoria acotada)."""
+        cursor = None
+        while True:
+            results, cursor = self.query(cursor=cursor, limit=page_size, **filters)
+            yield from results
+            if cursor is None:
+                return
+
+    def export(self, fmt: str, page_size: int = 1000, **filters) -> Iterator[str]:
+        """Exportación en streaming: CSV con cabecera o NDJSON (una línea por botella)."""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Format desconegut: {fmt} (disponibles: {', '.join(EXPORT_FORMATS)})")
+        results = self.iter_results(page_size, **filters)
+        if fmt == "ndjson":
+            return (json.dumps(result) + "\n" for result in results)
+        return self._csv_lines(results)
+
+    @staticmethod
+    def _csv_lines(results: Iterator[dict]) -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["timestamp", *COLUMNS[1:]])
+        for i, result in enumerate(results, 1):
+            tap, level = result["tap"], result["level"]
+            writer.writerow([
+                result["timestamp"],
+                result["bottle_id"],
+                result["status"],
+                tap["label"],
+                tap["confidence"],
+                level["label"],
+                level["confidence"],
+                tap["image"],
+                level["image"],
+            ])
+            if i % 200 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def stats(self) -> dict:
+        stored = self._read("SELECT COUNT(*), MIN(ts), MAX(ts) FROM results", []) if self.enabled else [(0, None, None)]
+        count, oldest, newest = stored[0]
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "stored": count,
+            "oldest_ts": oldest,
+            "newest_ts": newest,
+            "pending": len(self._pending),
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+            "flushes": self.flushes,
+            "rows_per_flush_avg": round(self.written / self.flushes, 1) if self.flushes else 0.0,
+            "write_ms_avg": round(1000 * self.write_seconds_total / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+result_store = ResultStore()
+
+metrics.gauge(
+    "result_store_pending",
+    "Resultats esperant a escriure's a l'històric",
+    lambda: len(result_store._pending),
+)
+metrics.gauge(
+    "result_store_dropped_total",
+    "Resultats descartats per l'històric (cua plena o error d'escriptura)",
+    lambda: result_store.dropped,
+    kind="counter",
+)
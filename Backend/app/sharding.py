@@ -0,0 +1,262 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from .config import (
+    WORKER_COORD_PATH,
+    WORKER_COUNT,
+    WORKER_INDEX,
+    WORKER_LEASE_TTL_S,
+)
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    slot INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    counters TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shared_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach): al pasar de N a N+1 workers solo
+    cambia de worker ~1/(N+1) de las botellas.
+    """
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_of(bottle_id: str, worker_count: int) -> int:
+    """Worker (0..worker_count-1) al que pertenece una botella."""
+    if worker_count <= 1:
+        return 0
+    digest = hashlib.blake2b(bottle_id.encode("utf-8"), digest_size=8).digest()
+    return jump_hash(int.from_bytes(digest, "big"), worker_count)
+
+
+class WorkerCoordinator:
+    """
+    Reparto de botellas entre varios procesos del backend en la misma máquina
+    (p. ej. `uvicorn --workers N`).
+
+    - Cada proceso obtiene un slot 0..N-1 con un lease en una base SQLite
+      compartida (WORKER_COORD_PATH), renovado en cada heartbeat; si un
+      proceso muere, su slot queda libre al caducar el lease. Con
+      WORKER_INDEX el slot es fijo.
+    - Cada botella pertenece al slot shard_of(bottle_id): solo ese proceso
+      la procesa.
+    - En el heartbeat cada proceso publica sus contadores y lee los de los
+      demás, así los totales (bottles_processed) son globales.
+    - `shared_state` guarda el ON/OFF del sistema: /system/on llega a un solo
+      proceso y los demás lo aplican en su siguiente heartbeat.
+
+    Con WORKER_COUNT=1 (por defecto) está desactivado y no toca disco.
+    """
+
+    def __init__(
+        self,
+        path: str = WORKER_COORD_PATH,
+        worker_count: int = WORKER_COUNT,
+        worker_index: int | None = WORKER_INDEX,
+        lease_ttl_s: float = WORKER_LEASE_TTL_S,
+    ):
+        self.path = path
+        self.worker_count = max(1, worker_count)
+        self.fixed_index = worker_index
+        self.lease_ttl_s = lease_ttl_s
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.index: int | None = 0 if self.worker_count == 1 else None
+        self._last_slot: int | None = None
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        # Último valor conocido de los contadores de los OTROS workers
+        self._remote_totals: dict[str, float] = {}
+        self.lease_losses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.worker_count > 1
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None, check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def acquire(self, slot: int | None = None) -> int:
+        """
+        Reserva un slot (bloqueante, llamar desde un hilo). `slot` fuerza uno
+        concreto; si no, WORKER_INDEX o el primero libre.
+        """
+        if not self.enabled:
+            return 0
+        with self._lock:
+            db = self._connect()
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = {
+                    row_slot: (owner, expires_at)
+                    for row_slot, owner, expires_at in db.execute(
+                        "SELECT slot, owner, expires_at FROM workers"
+                    )
+                }
+                if slot is None:
+                    slot = self.fixed_index
+                if slot is not None:
+                    candidates = [slot]
+                else:
+                    candidates = range(self.worker_count)
+
+                for slot in candidates:
+                    owner, expires_at = rows.get(slot, (None, 0.0))
+                    if owner in (None, self.owner) or expires_at < now:
+                        break
+                else:
+                    raise RuntimeError(
+                        f"No hi ha cap slot lliure de {self.worker_count} workers "
+                        f"(WORKER_COUNT massa petit o WORKER_INDEX ocupat)"
+                    )
+
+                db.execute(
+                    "INSERT OR REPLACE INTO workers (slot, owner, pid, expires_at, counters, updated_at)"
+                    " VALUES (?, ?, ?, ?, '{}', ?)",
+                    (slot, self.owner, os.getpid(), now + self.lease_ttl_s, now),
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+            self.index = self._last_slot = slot
+        logger.info(f"[sharding] 🚀 Worker {slot + 1}/{self.worker_count} ({self.owner})")
+        return slot
+
+    def owns(self, bottle_id: str) -> bool:
+        if not self.enabled:
+            return True
+        return self.index is not None and shard_of(bottle_id, self.worker_count) == self.index
+
+    def heartbeat(self, counters: dict[str, float]) -> dict[str, str]:
+        """
+        Renueva el lease, publica los contadores locales y lee los del resto.
+        Devuelve el estado compartido (shared_state). Bloqueante.
+        """
+        if not self.enabled:
+            return {}
+        with self._lock:
+            db = self._connect()
+            now = time.time()
+            updated = db.execute(
+                "UPDATE workers SET expires_at = ?, counters = ?, updated_at = ?"
+                " WHERE slot = ? AND owner = ?",
+                (now + self.lease_ttl_s, json.dumps(counters), now, self.index, self.owner),
+            ).rowcount
+            lost = updated == 0
+
+            remote: dict[str, float] = {}
+            for slot, counters_json in db.execute(
+                "SELECT slot, counters FROM workers WHERE expires_at >= ?", (now,)
+            ):
+                if slot == self.index:
+                    continue
+                for name, value in json.loads(counters_json).items():
+                    remote[name] = remote.get(name, 0) + value
+            self._remote_totals = remote
+            state = dict(db.execute("SELECT key, value FROM shared_state"))
+
+        if lost:
+            # El lease caducó (proceso congelado). Solo se recupera el MISMO
+            # slot: el ledger y los cursores del watcher son por slot. Si otro
+            # proceso ya lo tiene, este deja de procesar botellas.
+            if self.index is not None:
+                self.lease_losses += 1
+                logger.error(f"[sharding] ❌ Lease del slot {self.index} perdut")
+                self.index = None
+            self.acquire(self._last_slot)
+        return state
+
+    def total(self, name: str, local_value: float) -> float:
+        """Valor global de un contador: el local + el último de los demás."""
+        return local_value + self._remote_totals.get(name, 0)
+
+    def set_shared(self, key: str, value: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO shared_state (key, value) VALUES (?, ?)", (key, value)
+            )
+
+    def workers(self) -> list[dict]:
+        """Estado de todos los slots (para /api/workers/stats)."""
+        if not self.enabled:
+            return []
+        with self._lock:
+            now = time.time()
+            return [
+                {
+                    "slot": slot,
+                    "owner": owner,
+                    "pid": pid,
+                    "alive": expires_at >= now,
+                    "heartbeat_age_s": round(now - updated_at, 2),
+                    "counters": json.loads(counters_json),
+                }
+                for slot, owner, pid, expires_at, counters_json, updated_at in self._connect().execute(
+                    "SELECT slot, owner, pid, expires_at, counters, updated_at FROM workers ORDER BY slot"
+                )
+            ]
+
+    def stats(self, local_counters: dict[str, float]) -> dict:
+        workers = self.workers()
+        totals = dict(local_counters)
+        for name, value in self._remote_totals.items():
+            totals[name] = totals.get(name, 0) + value
+        return {
+            "enabled": self.enabled,
+            "worker_count": self.worker_count,
+            "index": self.index,
+            "owner": self.owner,
+            "lease_losses": self.lease_losses,
+            "workers": workers,
+            "totals": totals,
+        }
+
+    def release(self):
+        if not self.enabled or self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM workers WHERE slot = ? AND owner = ?", (self.index, self.owner)
+            )
+            self._db.close()
+            self._db = None
+
+
+coordinator = WorkerCoordinator()
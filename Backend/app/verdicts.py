@@ -0,0 +1,45 @@
+"""
+Vocabulario de etiquetas de los modelos, compartido por el processor, la
+cascada, las estadísticas y el PDF (que corre en otro proceso: este módulo
+no importa nada de la app).
+"""
+
+# Etiqueta correcta de cada modelo: cualquier otra CON veredicto es un defecto
+PASS_LABELS = {"tap": "tap_present", "level": "ok"}
+# Sufijos de las etiquetas sin veredicto del modelo (resultado DEGRADED)
+DEGRADED_SUFFIXES = ("_timeout", "_unavailable", "_error")
+# Sufijos de la etiqueta del modelo que la cascada no ha llamado
+CASCADE_SUFFIXES = ("_skipped", "_deferred")
+
+
+def is_degraded(label: str) -> bool:
+    """El modelo no respondió (timeout, circuito abierto o error)."""
+    return label.endswith(DEGRADED_SUFFIXES)
+
+
+def is_cascaded(label: str) -> bool:
+    """La cascada no llamó al modelo (o lo llamará más tarde)."""
+    return label.endswith(CASCADE_SUFFIXES)
+
+
+def has_verdict(label: str) -> bool:
+    return not label.endswith(DEGRADED_SUFFIXES + CASCADE_SUFFIXES)
+
+
+def is_defect(model: str, label: str) -> bool:
+    """Veredicto real distinto de la etiqueta correcta del modelo."""
+    return has_verdict(label) and label != PASS_LABELS[model]
+
+
+def bottle_status(tap_label: str, level_label: str) -> str:
+    """
+    FAIL si algún modelo ha visto un defecto (aunque el otro no haya
+    respondido o la cascada no lo haya llamado), DEGRADED si falta algún
+    veredicto y el resto es correcto, PASS si los dos están bien. Una
+    DEGRADED no genera PDF.
+    """
+    if is_defect("tap", tap_label) or is_defect("level", level_label):
+        return "FAIL"
+    if is_degraded(tap_label) or is_degraded(level_label):
+        return "DEGRADED"
+    return "PASS"
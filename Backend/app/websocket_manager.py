@@ -1,33 +1,220 @@
-import logging
+import asyncio
 import json
+import logging
+from collections import deque
+
 from fastapi import WebSocket
 
+from .metrics import metrics
+from .config import (
+    WS_BATCH_MAX,
+    WS_BATCH_WINDOW_MS,
+    WS_CLIENT_QUEUE_SIZE,
+    WS_SEND_TIMEOUT_S,
+    WS_SLOW_CLIENT_POLICY,
+)
+
 logger = logging.getLogger(__name__)
 
+SLOW_CLIENT_POLICIES = ("drop_oldest", "disconnect")
+
+
+def _serialize(message: dict) -> str:
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+class _Client:
+    """Cola de envío acotada + tarea escritora de un cliente WebSocket."""
+
+    def __init__(self, ws: WebSocket, queue_size: int):
+        self.ws = ws
+        self.queue_size = queue_size
+        # (coalesce_key | None, frame)
+        self.queue: deque[tuple[str | None, str]] = deque()
+        self.ready = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def offer(self, frame: str, coalesce_key: str | None, policy: str) -> bool:
+        """Encola sin esperar nunca. Devuelve False si hay que desconectarlo."""
+        if coalesce_key is not None:
+            # Solo importa el último mensaje de este tipo: se sustituye en sitio
+            for i, (key, _) in enumerate(self.queue):
+                if key == coalesce_key:
+                    self.queue[i] = (coalesce_key, frame)
+                    self.coalesced += 1
+                    return True
+
+        if len(self.queue) >= self.queue_size:
+            if policy == "disconnect":
+                return False
+            self.queue.popleft()
+            self.dropped += 1
+
+        self.queue.append((coalesce_key, frame))
+        self.ready.set()
+        return True
+
+
 class WebSocketManager:
-    def __init__(self):
-        self.connections: list[WebSocket] = []
+    """
+    Difusión de mensajes a los dashboards conectados.
+
+    - Cada mensaje se serializa UNA vez, sea cual sea el número de clientes.
+    - broadcast() no espera a ningún cliente: deja el frame en la cola
+      acotada de cada uno y su tarea escritora lo envía. Un dashboard lento
+      no frena ni a los demás ni al pipeline.
+    - Cliente lento (cola llena): se descarta su frame más antiguo
+      ("drop_oldest") o se le desconecta ("disconnect"). Los mensajes con
+      `coalesce_key` sustituyen al pendiente del mismo tipo.
+    - Con WS_BATCH_MAX > 1 los analysis_result se agrupan durante
+      WS_BATCH_WINDOW_MS en un único frame {"type": "analysis_batch",
+      "data": [...]}.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = WS_CLIENT_QUEUE_SIZE,
+        send_timeout_s: float = WS_SEND_TIMEOUT_S,
+        slow_client_policy: str = WS_SLOW_CLIENT_POLICY,
+        batch_max: int = WS_BATCH_MAX,
+        batch_window_ms: float = WS_BATCH_WINDOW_MS,
+    ):
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Política desconeguda: {slow_client_policy}")
+        self.queue_size = max(1, queue_size)
+        self.send_timeout_s = send_timeout_s
+        self.slow_client_policy = slow_client_policy
+        self.batch_max = max(1, batch_max)
+        self.batch_window_s = max(0.0, batch_window_ms) / 1000
+        self._clients: dict[WebSocket, _Client] = {}
+        self._batch: list[str] = []
+        self._batch_timer: asyncio.TimerHandle | None = None
+        self._closing: set[asyncio.Task] = set()
+
+        self.broadcasts = 0
+        self.frames = 0
+        self.slow_disconnects = 0
+
+        metrics.gauge("ws_clients", "Dashboards connectats", lambda: len(self._clients))
+        metrics.gauge(
+            "ws_queued_frames",
+            "Frames pendents d'enviar (suma de totes les cues)",
+            lambda: sum(len(c.queue) for c in self._clients.values()),
+        )
+
+    @property
+    def connections(self) -> list[WebSocket]:
+        return list(self._clients)
 
     async def connect(self, ws: WebSocket):
         await ws.accept()
-        self.connections.append(ws)
+        client = _Client(ws, self.queue_size)
+        client.task = asyncio.create_task(self._writer(client))
+        self._clients[ws] = client
 
     def disconnect(self, ws: WebSocket):
-        try:
-            self.connections.remove(ws)
-        except ValueError:
+        client = self._clients.pop(ws, None)
+        if client is None:
             return
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    async def broadcast(self, message: dict, *, coalesce_key: str | None = None):
+        """Difunde un mensaje. No espera a los envíos (async por compatibilidad)."""
+        self.broadcasts += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📤 [WebSocket] {message.get('type')} a {len(self._clients)} clientes")
+
+        with metrics.stage("ws_broadcast"):
+            if self.batch_max > 1 and message.get("type") == "analysis_result":
+                self._batch.append(_serialize(message["data"]))
+                if len(self._batch) >= self.batch_max:
+                    self._flush_batch()
+                elif self._batch_timer is None:
+                    self._batch_timer = asyncio.get_running_loop().call_later(
+                        self.batch_window_s, self._flush_batch
+                    )
+                return
+
+            self._fan_out(_serialize(message), coalesce_key)
 
-    async def broadcast(self, message: dict):
-        logger.info(f"📤 [WebSocket] Broadcast a {len(self.connections)} clientes:")
-        logger.info(f"   {json.dumps(message, indent=2, ensure_ascii=False)}")
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "queue_size": self.queue_size,
+            "slow_client_policy": self.slow_client_policy,
+            "batch_max": self.batch_max,
+            "broadcasts": self.broadcasts,
+            "frames": self.frames,
+            "slow_disconnects": self.slow_disconnects,
+            "per_client": [
+                {
+                    "queued": len(c.queue),
+                    "sent": c.sent,
+                    "dropped": c.dropped,
+                    "coalesced": c.coalesced,
+                }
+                for c in self._clients.values()
+            ],
+        }
 
-        for ws in list(self.connections):
-            try:
-                await ws.send_json(message)
-            except Exception:
-                logger.info("[WebSocket] ❌ Error enviando; desconectando cliente")
+    def _flush_batch(self):
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        # Los resultados ya están serializados: el frame se compone sin re-serializar
+        self._fan_out('{"type":"analysis_batch","data":[' + ",".join(batch) + "]}", None)
+
+    def _fan_out(self, frame: str, coalesce_key: str | None):
+        self.frames += 1
+        for ws, client in list(self._clients.items()):
+            if not client.offer(frame, coalesce_key, self.slow_client_policy):
+                self.slow_disconnects += 1
+                logger.warning("[WebSocket] 🐢 Cliente demasiado lento; desconectando")
                 self.disconnect(ws)
+                task = asyncio.create_task(self._close(ws))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+
+    async def _close(self, ws: WebSocket):
+        try:
+            await ws.close()
+        except Exception:
+            pass
+
+    async def aclose(self):
+        """Shutdown de la app: para las escritoras (lo pendiente se descarta)."""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        self._batch = []
+        tasks = [c.task for c in self._clients.values() if c.task is not None]
+        self._clients.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, *self._closing, return_exceptions=True)
+
+    async def _writer(self, client: _Client):
+        try:
+            while True:
+                await client.ready.wait()
+                while client.queue:
+                    _, frame = client.queue.popleft()
+                    with metrics.stage("ws_send"):
+                        await asyncio.wait_for(client.ws.send_text(frame), self.send_timeout_s)
+                    client.sent += 1
+                client.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.info("[WebSocket] ❌ Error enviando; desconectando cliente")
+            self.disconnect(client.ws)
 
 
 manager = WebSocketManager()
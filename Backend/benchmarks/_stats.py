@@ -0,0 +1,75 @@
+"""Utilidades comunes de los benchmarks."""
+import io
+import json
+import os
+import socket
+import time
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(latencies_s: list[float]) -> dict:
+    return {
+        "n": len(latencies_s),
+        "p50_ms": round(percentile(latencies_s, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies_s, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies_s, 99) * 1000, 2),
+    }
+
+
+def print_table(rows: list[dict]):
+    if not rows:
+        return
+    columns = list(rows[0])
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def write_json(path: str | None, payload: dict):
+    """Escribe los resultados en JSON para poder comparar entre commits."""
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout_s: float = 10.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"El stub no respon al port {port}")
+
+
+def synthetic_frames(count: int, width: int, height: int, format: str = "JPEG", noise: float = 20.0) -> list[bytes]:
+    """Frames de cámara sintéticos (degradado + ruido) de la resolución pedida."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    frames = []
+    for _ in range(count):
+        pixels = np.clip(gradient + rng.normal(0, noise, (height, width, 3)), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format=format, quality=90)
+        frames.append(buffer.getvalue())
+    return frames
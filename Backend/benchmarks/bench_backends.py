@@ -0,0 +1,182 @@
+"""
+Benchmark de backends de inferencia: Azure ML (endpoint remoto) vs ONNX en CPU.
+
+Procesa `--bottles` botellas (tap + level en paralelo, `--concurrency` en
+vuelo) a través de la API real predict_tap_async/predict_level_async y
+reporta la latencia por botella y el coste de CPU del proceso del backend.
+Cada backend corre en un subproceso (la selección se lee del entorno al
+importar app.config); el endpoint de Azure se imita con el stub, en otro
+proceso, con `--latency-ms` de latencia de red + modelo.
+
+Sin --onnx-model-tap/--onnx-model-level se genera una CNN sintética pequeña
+(requiere el paquete `onnx`): sirve para medir el coste del preproceso y del
+runtime, pero para números reales hay que pasar los ResNet18 exportados.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_backends --bottles 200 --concurrency 4 --latency-ms 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from ._stats import (
+    free_port,
+    latency_summary,
+    print_table,
+    synthetic_frames,
+    wait_for_port,
+    write_json,
+)
+
+BACKENDS = ("azure", "onnx")
+
+
+def _synthetic_model(path: str, classes: int):
+    """CNN mínima (conv + pool + dense) con entrada NCHW 224x224 y batch dinámico."""
+    import numpy as np
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(classes)
+    weights = [
+        numpy_helper.from_array(rng.normal(0, 0.1, (16, 3, 7, 7)).astype(np.float32), "conv_w"),
+        numpy_helper.from_array(rng.normal(0, 0.1, (classes, 16)).astype(np.float32), "fc_w"),
+        numpy_helper.from_array(np.zeros(classes, dtype=np.float32), "fc_b"),
+    ]
+    nodes = [
+        helper.make_node("Conv", ["input", "conv_w"], ["conv"], strides=[4, 4], pads=[3, 3, 3, 3]),
+        helper.make_node("Relu", ["conv"], ["relu"]),
+        helper.make_node("GlobalAveragePool", ["relu"], ["pool"]),
+        helper.make_node("Flatten", ["pool"], ["flat"]),
+        helper.make_node("Gemm", ["flat", "fc_w", "fc_b"], ["logits"], transB=1),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "bench_classifier",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["N", 3, 224, 224])],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["N", classes])],
+        initializer=weights,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+    model.ir_version = 8
+    onnx.save(model, path)
+
+
+async def _run_backend(args) -> dict:
+    from app.azure_client import (
+        close_async_clients,
+        predict_level_async,
+        predict_tap_async,
+        warmup_inference,
+    )
+    from app.config import INFERENCE_BACKEND
+
+    frames = synthetic_frames(args.frames, args.width, args.height)
+    await warmup_inference()
+    await asyncio.gather(predict_tap_async(frames[0]), predict_level_async(frames[0]))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+
+    async def one_bottle(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await asyncio.gather(
+                predict_tap_async(frames[i % len(frames)]),
+                predict_level_async(frames[(i + 1) % len(frames)]),
+            )
+            latencies.append(time.perf_counter() - start)
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    await asyncio.gather(*(one_bottle(i) for i in range(args.bottles)))
+    elapsed = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    await close_async_clients()
+
+    cpu_s = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    return {
+        "backend": INFERENCE_BACKEND,
+        "bottles_per_s": round(args.bottles / elapsed, 1),
+        **latency_summary(latencies),
+        "cpu_ms_per_bottle": round(cpu_s * 1000 / args.bottles, 2),
+        "cpu_util_pct": round(cpu_s / elapsed * 100, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de backends de inferencia")
+    parser.add_argument("--bottles", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=8, help="Frames sintéticos distintos")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Latencia simulada de Azure ML")
+    parser.add_argument("--onnx-model-tap")
+    parser.add_argument("--onnx-model-level")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    if args.run:
+        # Subproceso: el backend y sus rutas ya vienen en el entorno
+        print(json.dumps(asyncio.run(_run_backend(args))))
+        return
+
+    port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_scoring_server",
+         "--port", str(port), "--latency-ms", str(args.latency_ms)],
+        stdout=subprocess.DEVNULL,
+    )
+    wait_for_port(port)
+
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            tap_model = args.onnx_model_tap
+            level_model = args.onnx_model_level
+            if "onnx" in args.backends and not (tap_model and level_model):
+                tap_model = os.path.join(root, "tap.onnx")
+                level_model = os.path.join(root, "level.onnx")
+                _synthetic_model(tap_model, 2)
+                _synthetic_model(level_model, 3)
+
+            url = f"http://127.0.0.1:{port}/score"
+            for backend in args.backends:
+                env = {
+                    **os.environ,
+                    "INFERENCE_BACKEND": backend,
+                    "AZURE_ML_ENDPOINT_TAP": url,
+                    "AZURE_ML_ENDPOINT_LEVEL": url,
+                    "AZURE_ML_KEY_TAP": "bench",
+                    "AZURE_ML_KEY_LEVEL": "bench",
+                    "ONNX_MODEL_TAP": tap_model or "",
+                    "ONNX_MODEL_LEVEL": level_model or "",
+                    "RESULT_CACHE_MAX_ENTRIES": "0",
+                }
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_backends", "--run",
+                     "--bottles", str(args.bottles), "--concurrency", str(args.concurrency),
+                     "--frames", str(args.frames), "--width", str(args.width),
+                     "--height", str(args.height)],
+                    env=env, check=True, capture_output=True, text=True,
+                ).stdout
+                rows.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print_table(rows)
+    write_json(args.json, {"benchmark": "backends", "latency_ms": args.latency_ms, "results": rows})
+
+
+if __name__ == "__main__":
+    main()
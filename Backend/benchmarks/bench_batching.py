@@ -0,0 +1,86 @@
+"""
+Benchmark del micro-batching (app.batching.MicroBatcher) contra el stub.
+
+Lanza `--callers` productores concurrentes que piden predicciones de una en
+una y mide, para cada tamaño máximo de batch, el throughput (imágenes/s),
+la latencia p50/p99 por imagen y cuántas peticiones HTTP hicieron falta.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_batching --callers 32 --latency-ms 30 --per-image-ms 2
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from app.azure_client import AsyncScoringClient
+from app.batching import MicroBatcher
+
+from ._stats import latency_summary, print_table, write_json
+from .stub_scoring_server import start_stub_server
+
+KEY_ENV = "BENCH_SCORING_KEY"
+
+
+async def _run(server, batch_size: int, args) -> dict:
+    client = AsyncScoringClient(server.url, KEY_ENV, payload_format="base64", max_concurrency=args.callers)
+    batcher = MicroBatcher(client.predict_batch, max_batch_size=batch_size, max_wait_ms=args.max_wait_ms)
+    predict = client.predict if batch_size <= 1 else batcher.predict
+
+    image_bytes = os.urandom(args.image_kb * 1024)
+    await predict(image_bytes)  # calentamiento
+    server.stats.reset()
+
+    latencies: list[float] = []
+
+    async def caller():
+        for _ in range(args.images_per_caller):
+            start = time.perf_counter()
+            await predict(image_bytes)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(args.callers)))
+    elapsed = time.perf_counter() - start
+
+    await batcher.aclose()
+    await client.aclose()
+    stats = server.stats.as_dict()
+    return {
+        "max_batch": batch_size,
+        "images": len(latencies),
+        "http_requests": stats["requests"],
+        "images_per_s": round(len(latencies) / elapsed, 1),
+        **latency_summary(latencies),
+    }
+
+
+async def _main(args):
+    server = start_stub_server(latency_ms=args.latency_ms, per_image_ms=args.per_image_ms)
+    rows = []
+    for batch_size in args.batch_sizes:
+        rows.append(await _run(server, batch_size, args))
+    server.shutdown()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del micro-batching")
+    parser.add_argument("--callers", type=int, default=32)
+    parser.add_argument("--images-per-caller", type=int, default=20)
+    parser.add_argument("--image-kb", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--per-image-ms", type=float, default=2.0)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    os.environ.setdefault(KEY_ENV, "bench")
+    rows = asyncio.run(_main(args))
+    print_table(rows)
+    write_json(args.json, {"benchmark": "batching", "params": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
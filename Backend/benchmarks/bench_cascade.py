@@ -0,0 +1,144 @@
+"""
+Inferencia en cascada (app.cascade) frente a los dos modelos en paralelo.
+
+Dos stubs de scoring (TAP y LEVEL, `--latency-ms` cada uno); el TAP
+devuelve `tap_missing` con confianza `--confidence` a una fracción
+`--defect-rate` de las botellas. Se puntúan `--bottles` botellas con
+`--concurrency` a la vez (process_bottle_parallel + queue_error_report,
+sin generar PDF) y se comparan:
+
+- off:   TAP y LEVEL en paralelo (lo de siempre)
+- skip:  TAP primero; LEVEL solo si TAP no decide la botella
+- defer: igual, pero LEVEL se llama después en la cola diferida (PDF)
+
+`calls_per_bottle` son las peticiones que llegan a los stubs durante la
+inspección (las diferidas aparte, en `deferred_calls`). Las latencias de
+scoring van por separado para las botellas decididas por TAP y el resto:
+estas pagan los dos modelos en serie (`added_s`), ese es el precio de la
+cascada.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_cascade --bottles 400 --defect-rate 0.3 --latency-ms 40
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from ._stats import latency_summary, print_table, write_json
+from .stub_scoring_server import start_stub_server
+
+MODES = ("off", "skip", "defer")
+
+
+async def _run(mode: str, args, tap_server, level_server) -> dict:
+    from app import processor
+    from app.cascade import CascadePolicy
+    from app.verdicts import bottle_status, is_cascaded
+
+    policy = CascadePolicy(mode=mode, order=("tap", "level"), thresholds={"tap_missing": args.threshold})
+    processor.cascade = policy
+    reports = []
+    processor.report_worker.submit = lambda job: reports.append(job) or True
+
+    tap_server.stats.reset()
+    level_server.stats.reset()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    decided: list[float] = []
+    full: list[float] = []
+    statuses: dict[str, int] = {}
+
+    async def one(i: int):
+        bottle_id = f"bottle_{i:06d}"
+        # Imágenes distintas por botella (sin aciertos de la caché de resultados)
+        tap_image = f"tap-{mode}-{i}".encode() * 64
+        level_image = f"level-{mode}-{i}".encode() * 64
+        async with semaphore:
+            start = time.perf_counter()
+            tap_label, tap_confidence, level_label, level_confidence = await processor.process_bottle_parallel(
+                bottle_id, tap_image, level_image
+            )
+            elapsed = time.perf_counter() - start
+        status = bottle_status(tap_label, level_label)
+        statuses[status] = statuses.get(status, 0) + 1
+        (decided if is_cascaded(level_label) else full).append(elapsed)
+        if status == "FAIL":
+            result = {
+                "tap": {"label": tap_label, "confidence": tap_confidence},
+                "level": {"label": level_label, "confidence": level_confidence},
+            }
+            pair = processor.BottlePair(tap_bytes=tap_image, level_bytes=level_image)
+            processor.queue_error_report(bottle_id, pair, result)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.bottles)))
+    elapsed = time.perf_counter() - start
+
+    # La cola diferida termina después de la inspección (y se solapa con ella)
+    if policy._queue is not None:
+        await policy._queue.join()
+    await policy.stop()
+    total_calls = tap_server.stats.as_dict()["requests"] + level_server.stats.as_dict()["requests"]
+    deferred_calls = policy.deferred_done + policy.deferred_failed
+    inspection_calls = total_calls - deferred_calls
+
+    stats = policy.stats()
+    fast = latency_summary(decided)
+    slow = latency_summary(full)
+    return {
+        "mode": mode,
+        "bottles": args.bottles,
+        "fail": statuses.get("FAIL", 0),
+        "calls_per_bottle": round(inspection_calls / args.bottles, 3),
+        "deferred_calls": deferred_calls,
+        "reports": len(reports),
+        "decided_p50_ms": fast["p50_ms"] if decided else "",
+        "others_p50_ms": slow["p50_ms"],
+        "others_p99_ms": slow["p99_ms"],
+        "bottles_per_s": round(args.bottles / elapsed, 1),
+        "saved_s": stats["latency_saved_s"],
+        "added_s": stats["latency_added_s"],
+    }
+
+
+async def _main(args) -> list[dict]:
+    tap_server, level_server = start_stub_server(latency_ms=args.latency_ms), start_stub_server(latency_ms=args.latency_ms)
+    os.environ.update(
+        AZURE_ML_ENDPOINT_TAP=(
+            f"{tap_server.url}?label=tap_present&fail_label=tap_missing"
+            f"&fail_rate={args.defect_rate}&confidence={args.confidence}"
+        ),
+        AZURE_ML_ENDPOINT_LEVEL=f"{level_server.url}?label=ok",
+        AZURE_ML_KEY_TAP="bench",
+        AZURE_ML_KEY_LEVEL="bench",
+        AZURE_ML_PAYLOAD_FORMAT="binary",
+        RESULT_CACHE_MAX_ENTRIES="0",
+    )
+    from app.azure_client import close_async_clients
+
+    rows = [await _run(mode, args, tap_server, level_server) for mode in args.modes]
+    await close_async_clients()
+    tap_server.shutdown()
+    level_server.shutdown()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inferencia en cascada frente a paralelo")
+    parser.add_argument("--bottles", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--defect-rate", type=float, default=0.3, help="Fracción de tap_missing")
+    parser.add_argument("--confidence", type=float, default=0.98, help="Confianza de los stubs")
+    parser.add_argument("--threshold", type=float, default=0.95, help="Umbral de tap_missing")
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Latencia de cada modelo")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    rows = asyncio.run(_main(args))
+    print_table(rows)
+    write_json(args.json, {"benchmark": "cascade", "config": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
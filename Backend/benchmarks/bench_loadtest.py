@@ -0,0 +1,285 @@
+"""
+Prueba de carga de extremo a extremo de la app real (uvicorn + app.main).
+
+- Blob Storage: el sustituto local de app.blob_client (BLOB_LOCAL_ROOT en
+  un directorio temporal), que sirve el listado, read_image_bytes y
+  upload_pdf dentro del propio proceso de la app.
+- Azure ML: el stub de scoring en otro proceso, con `--latency-ms`,
+  `--error-rate` (HTTP 500), `--slow-rate`/`--slow-ms` (cola de latencia)
+  y `--fail-rate` (botellas FAIL -> PDF).
+- Carga: un generador en lazo abierto deja botellas (TAP + LEVEL, frames
+  JPEG sintéticos) a `--rate` botellas/s durante `--duration-s`.
+
+La latencia de cada botella va desde que sus dos imágenes están en el Blob
+hasta que llega su analysis_result por el WebSocket /ws. Se reporta
+throughput, p50/p95/p99, RSS y CPU del proceso de la app (leídos de /proc)
+y el resumen por etapa de /api/metrics/summary. Con varios `--rate` se hace
+una ejecución (app nueva) por ritmo.
+
+Los resultados van a JSON (`--json`) con el commit actual; `--compare`
+muestra las diferencias con un JSON anterior.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_loadtest --rate 5 10 20 --duration-s 30 --json out/load.json
+    python -m benchmarks.bench_loadtest --rate 10 --compare out/load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import websockets
+
+from app.config import CONTAINER_LEVEL, CONTAINER_TAP
+
+from ._stats import free_port, latency_summary, print_table, synthetic_frames, wait_for_port, write_json
+
+# Métricas comparadas con --compare (True = más alto es mejor)
+COMPARED = {
+    "throughput_bps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "rss_peak_mb": False,
+    "cpu_ms_per_bottle": False,
+}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _put_blob(root: str, container: str, name: str, data: bytes):
+    """Escritura atómica, como app.blob_client._write_local."""
+    path = os.path.join(root, container, name)
+    with open(path + ".part", "wb") as f:
+        f.write(data)
+    os.replace(path + ".part", path)
+
+
+class ProcessSampler:
+    """RSS y CPU de un proceso leídos de /proc (Linux)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.rss_mb: list[float] = []
+        self._tick = os.sysconf("SC_CLK_TCK")
+
+    def cpu_s(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._tick
+
+    def rss_now(self) -> float:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    async def run(self, interval_s: float = 0.25):
+        while True:
+            self.rss_mb.append(self.rss_now())
+            await asyncio.sleep(interval_s)
+
+
+async def _drive(args, rate: float, root: str, port: int, pid: int, frames: list[bytes]) -> dict:
+    base = f"http://127.0.0.1:{port}"
+    bottles = max(1, int(rate * args.duration_s))
+    written_at: dict[str, float] = {}
+    latencies: list[float] = []
+    published_at: list[float] = []
+    statuses = {"PASS": 0, "FAIL": 0, "DEGRADED": 0}
+    all_done = asyncio.Event()
+
+    async def consume(ws):
+        async for frame in ws:
+            message = json.loads(frame)
+            if message.get("type") == "analysis_batch":
+                results = message["data"]
+            elif message.get("type") == "analysis_result":
+                results = [message["data"]]
+            else:
+                continue
+            now = time.perf_counter()
+            for result in results:
+                start = written_at.get(result["bottle_id"])
+                if start is None:
+                    continue
+                latencies.append(now - start)
+                published_at.append(now)
+                statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+            if len(latencies) >= bottles:
+                all_done.set()
+
+    async def produce(t0: float):
+        loop = asyncio.get_running_loop()
+        for i in range(bottles):
+            delay = t0 + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            bottle_id = f"bottle_{i:06d}"
+            tap, level = frames[i % len(frames)], frames[(i + 1) % len(frames)]
+            # El orden importa poco: el watcher empareja por bottle_id
+            await loop.run_in_executor(None, _put_blob, root, CONTAINER_TAP, f"{bottle_id}_tap.jpg", tap)
+            await loop.run_in_executor(None, _put_blob, root, CONTAINER_LEVEL, f"{bottle_id}_level.jpg", level)
+            written_at[bottle_id] = time.perf_counter()
+
+    sampler = ProcessSampler(pid)
+    async with httpx.AsyncClient(base_url=base, timeout=10) as http:
+        async with websockets.connect(f"ws://127.0.0.1:{port}/ws", max_size=None) as ws:
+            consumer = asyncio.create_task(consume(ws))
+            sampling = asyncio.create_task(sampler.run())
+            (await http.post("/system/on")).raise_for_status()
+
+            cpu_before = sampler.cpu_s()
+            t0 = time.perf_counter()
+            await produce(t0)
+            try:
+                await asyncio.wait_for(all_done.wait(), args.drain_s)
+            except asyncio.TimeoutError:
+                pass
+            end = published_at[-1] if published_at else time.perf_counter()
+            cpu_s = sampler.cpu_s() - cpu_before
+
+            consumer.cancel()
+            sampling.cancel()
+            await asyncio.gather(consumer, sampling, return_exceptions=True)
+
+        stages = (await http.get("/api/metrics/summary")).json().get("stages", {})
+        reports = (await http.get("/api/reports/stats")).json()
+        await http.post("/system/off")
+
+    elapsed = max(end - t0, 1e-9)
+    published = len(latencies)
+    return {
+        "rate_bps": rate,
+        "bottles": bottles,
+        "published": published,
+        "missing": bottles - published,
+        "fail": statuses.get("FAIL", 0),
+        "degraded": statuses.get("DEGRADED", 0),
+        "throughput_bps": round(published / elapsed, 2),
+        **latency_summary(latencies),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        "rss_peak_mb": round(max(sampler.rss_mb, default=0.0), 1),
+        "rss_avg_mb": round(sum(sampler.rss_mb) / len(sampler.rss_mb), 1) if sampler.rss_mb else 0.0,
+        "cpu_s": round(cpu_s, 2),
+        "cpu_util_pct": round(cpu_s / elapsed * 100, 1),
+        "cpu_ms_per_bottle": round(cpu_s * 1000 / published, 2) if published else 0.0,
+        "reports_rendered": reports.get("rendered", 0),
+        "stages": stages,
+    }
+
+
+def _run_rate(args, rate: float, stub_url: str, frames: list[bytes]) -> dict:
+    with tempfile.TemporaryDirectory() as root:
+        for container in (CONTAINER_TAP, CONTAINER_LEVEL):
+            os.makedirs(os.path.join(root, container))
+        port = free_port()
+        fail = f"&fail_rate={args.fail_rate}" if args.fail_rate else ""
+        env = {
+            **os.environ,
+            "BLOB_LOCAL_ROOT": root,
+            "BLOB_LEDGER_PATH": os.path.join(root, "ledger.sqlite3"),
+            "WORKER_COORD_PATH": os.path.join(root, "workers.sqlite3"),
+            "AZURE_ML_ENDPOINT_TAP": f"{stub_url}?label=tap_present&fail_label=tap_missing{fail}",
+            "AZURE_ML_ENDPOINT_LEVEL": f"{stub_url}?label=ok&fail_label=low{fail}",
+            "AZURE_ML_KEY_TAP": "bench",
+            "AZURE_ML_KEY_LEVEL": "bench",
+            # Frames repetidos: sin caché, cada botella va al scoring
+            "RESULT_CACHE_MAX_ENTRIES": "0",
+            "BLOB_POLL_INTERVAL_S": str(args.poll_interval_s),
+            **dict(item.split("=", 1) for item in args.env),
+        }
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app",
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=None if args.verbose else subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port, timeout_s=30)
+            return asyncio.run(_drive(args, rate, root, port, app.pid, frames))
+        finally:
+            app.terminate()
+            app.wait()
+
+
+def _compare(rows: list[dict], path: str):
+    with open(path, encoding="utf-8") as f:
+        baseline = {row["rate_bps"]: row for row in json.load(f)["results"]}
+    print(f"\nComparación con {path}:")
+    table = []
+    for row in rows:
+        before = baseline.get(row["rate_bps"])
+        if before is None:
+            continue
+        diff = {"rate_bps": row["rate_bps"]}
+        for metric, higher_is_better in COMPARED.items():
+            old, new = before.get(metric, 0), row.get(metric, 0)
+            change = (new - old) / old * 100 if old else 0.0
+            worse = change < 0 if higher_is_better else change > 0
+            diff[metric] = f"{old}->{new} ({change:+.1f}%{' !' if worse and abs(change) >= 5 else ''})"
+        table.append(diff)
+    print_table(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de extremo a extremo")
+    parser.add_argument("--rate", type=float, nargs="+", default=[10.0], help="Botellas/s")
+    parser.add_argument("--duration-s", type=float, default=20.0)
+    parser.add_argument("--drain-s", type=float, default=15.0, help="Espera máx. a las últimas botellas")
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Latencia simulada de Azure ML")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones con HTTP 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fracción de peticiones lentas")
+    parser.add_argument("--slow-ms", type=float, default=0.0, help="Latencia extra de las peticiones lentas")
+    parser.add_argument("--fail-rate", type=float, default=0.05, help="Fracción de imágenes con defecto")
+    parser.add_argument("--frames", type=int, default=8, help="Frames sintéticos distintos")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--poll-interval-s", type=float, default=0.1)
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="Config extra de la app")
+    parser.add_argument("--verbose", action="store_true", help="Muestra los logs de la app")
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior")
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.frames, args.width, args.height)
+    stub_port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_scoring_server", "--port", str(stub_port),
+         "--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate),
+         "--slow-rate", str(args.slow_rate), "--slow-ms", str(args.slow_ms)],
+        stdout=subprocess.DEVNULL,
+    )
+    wait_for_port(stub_port)
+
+    rows = []
+    try:
+        for rate in args.rate:
+            rows.append(_run_rate(args, rate, f"http://127.0.0.1:{stub_port}/score", frames))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print_table([{k: v for k, v in row.items() if k != "stages"} for row in rows])
+    config = {k: v for k, v in vars(args).items() if k not in ("json", "compare", "verbose")}
+    write_json(args.json, {"benchmark": "loadtest", "commit": _git_commit(), "config": config, "results": rows})
+    if args.compare:
+        _compare(rows, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Benchmark de memoria por botella en vuelo: descarga + envío a scoring.
+
+Compara el camino original (readall() -> bytes, json {"image": hex}
+materializado) con el actual (descarga en bytearray + cuerpo en streaming).
+Cada modo se ejecuta en un subproceso para que el pico de RSS sea limpio
+(el servidor stub corre en otro proceso y no cuenta); se reporta también el
+pico de tracemalloc por botella en vuelo.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_memory --bottles 8 --image-mb 4
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from ._stats import free_port, print_table, wait_for_port, write_json
+
+KEY_ENV = "BENCH_SCORING_KEY"
+MODES = ("legacy", "streaming")
+
+
+def _legacy_read(path: str) -> bytes:
+    """Imita StorageStreamDownloader.readall(): BytesIO + getvalue()."""
+    stream = io.BytesIO()
+    with open(path, "rb") as f:
+        while chunk := f.read(4 * 1024 * 1024):
+            stream.write(chunk)
+    return stream.getvalue()
+
+
+async def _run_mode(mode: str, args) -> dict:
+    from app import blob_client
+    from app.azure_client import AsyncScoringClient
+
+    client = AsyncScoringClient(args.url, KEY_ENV, payload_format="hex", max_concurrency=2 * args.bottles)
+    container = "images-bench"
+
+    async def one_bottle(i: int):
+        names = [f"bottle_{i:06d}_tap.jpg", f"bottle_{i:06d}_level.jpg"]
+        loop = asyncio.get_running_loop()
+        if mode == "legacy":
+            images = await asyncio.gather(*(
+                loop.run_in_executor(None, _legacy_read, os.path.join(blob_client.BLOB_LOCAL_ROOT, container, n))
+                for n in names
+            ))
+            bodies = [json.dumps({"image": image.hex()}).encode("utf-8") for image in images]
+            await asyncio.gather(*(client._post(body, "application/json", None) for body in bodies))
+        else:
+            images = await asyncio.gather(*(
+                loop.run_in_executor(None, blob_client.read_image_bytes, container, n) for n in names
+            ))
+            await asyncio.gather(*(client.predict(image) for image in images))
+
+    tracemalloc.start()
+    await asyncio.gather(*(one_bottle(i) for i in range(args.bottles)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    await client.aclose()
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "mode": mode,
+        "bottles_in_flight": args.bottles,
+        "image_mb": args.image_mb,
+        "traced_peak_mb": round(peak / 2**20, 1),
+        "traced_mb_per_bottle": round(peak / 2**20 / args.bottles, 2),
+        "max_rss_mb": round(rss_kb / 1024, 1),
+    }
+
+
+def _prepare_images(root: str, args):
+    directory = os.path.join(root, "images-bench")
+    os.makedirs(directory, exist_ok=True)
+    frame = os.urandom(int(args.image_mb * 2**20))
+    for i in range(args.bottles):
+        for kind in ("tap", "level"):
+            with open(os.path.join(directory, f"bottle_{i:06d}_{kind}.jpg"), "wb") as f:
+                f.write(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de memoria por botella")
+    parser.add_argument("--bottles", type=int, default=8)
+    parser.add_argument("--image-mb", type=float, default=4.0)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    if args.mode:
+        # Subproceso: BLOB_LOCAL_ROOT ya viene en el entorno
+        print(json.dumps(asyncio.run(_run_mode(args.mode, args))))
+        return
+
+    port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_scoring_server", "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+    )
+    wait_for_port(port)
+
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            _prepare_images(root, args)
+            env = {**os.environ, "BLOB_LOCAL_ROOT": root, KEY_ENV: "bench"}
+            for mode in MODES:
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_memory", "--mode", mode,
+                     "--bottles", str(args.bottles), "--image-mb", str(args.image_mb),
+                     "--url", f"http://127.0.0.1:{port}/score"],
+                    env=env, check=True, capture_output=True, text=True,
+                ).stdout
+                rows.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print_table(rows)
+    write_json(args.json, {"benchmark": "memory", "results": rows})
+
+
+if __name__ == "__main__":
+    main()
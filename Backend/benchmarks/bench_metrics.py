@@ -0,0 +1,65 @@
+"""
+Coste de la instrumentación (app.metrics) en el camino caliente.
+
+Mide el tiempo por etapa medida con metrics.stage() en tres modos
+(desactivada, histogramas, histogramas + trazas por botella) y lo escala a
+una botella completa (`--stages-per-bottle` etapas) y al ritmo pico de la
+línea (`--bottles-per-s`): `overhead_pct` es el % de un núcleo que se
+llevaría la instrumentación.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_metrics --iterations 200000 --bottles-per-s 20
+"""
+import argparse
+import time
+
+from ._stats import print_table, write_json
+
+MODES = {
+    "disabled": {"enabled": False, "trace_bottles": False},
+    "histograms": {"enabled": True, "trace_bottles": False},
+    "traced": {"enabled": True, "trace_bottles": True},
+}
+
+STAGES = ("download", "read_image_bytes", "preprocess", "scoring_tap", "scoring_level", "ws_broadcast")
+
+
+def _measure(mode: str, iterations: int) -> float:
+    from app.metrics import Metrics
+
+    metrics = Metrics(trace_keep=100, **MODES[mode])
+    start = time.perf_counter()
+    for i in range(iterations):
+        if i % len(STAGES) == 0:
+            # Una traza por "botella", como hace el pipeline
+            metrics.finish_trace(metrics.start_trace(f"bottle_{i}") if i else None)
+        with metrics.stage(STAGES[i % len(STAGES)]):
+            pass
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste de la instrumentación del pipeline")
+    parser.add_argument("--iterations", type=int, default=200_000)
+    parser.add_argument("--stages-per-bottle", type=int, default=14)
+    parser.add_argument("--bottles-per-s", type=float, default=20.0, help="Ritmo pico de la línea")
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    rows = []
+    for mode in MODES:
+        per_stage_s = _measure(mode, args.iterations)
+        per_bottle_s = per_stage_s * args.stages_per_bottle
+        rows.append({
+            "mode": mode,
+            "ns_per_stage": round(per_stage_s * 1e9),
+            "us_per_bottle": round(per_bottle_s * 1e6, 2),
+            "overhead_pct": round(per_bottle_s * args.bottles_per_s * 100, 4),
+        })
+
+    print_table(rows)
+    write_json(args.json, {"benchmark": "metrics", "bottles_per_s": args.bottles_per_s, "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Coste del emparejado TAP + LEVEL del blob_watcher (app.pairing).
+
+Simula `--polls` polls con `--blobs-per-poll` blobs nuevos cada uno, de los
+que una fracción `--orphan-rate` nunca recibe su pareja, y compara:
+
+- dicts:   el emparejado anterior (dos dicts bottle_id -> blob, el bottle_id
+           con replace("_tap", "")); las huérfanas no caducan nunca
+- index:   PairingIndex + parse_blob_name, con caducidad de huérfanas
+
+Mide µs por blob (parseo + emparejado + caducidad) y las imágenes que
+quedan pendientes al final (memoria que crece sin límite en `dicts`).
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_pairing --polls 2000 --blobs-per-poll 20 --orphan-rate 0.01
+"""
+import argparse
+import random
+import time
+
+from app.pairing import PairingIndex, parse_blob_name
+
+from ._stats import print_table, write_json
+
+
+def _legacy_bottle_id(blob_name: str) -> str:
+    name_without_ext = blob_name.rsplit(".", 1)[0]
+    if "_tap" in name_without_ext:
+        return name_without_ext.replace("_tap", "")
+    elif "_level" in name_without_ext:
+        return name_without_ext.replace("_level", "")
+    return name_without_ext
+
+
+def _polls(args) -> list[list[tuple[str, str]]]:
+    """Listas de (kind, blob) por poll; la pareja llega en el mismo poll o el siguiente."""
+    rng = random.Random(1)
+    polls: list[list[tuple[str, str]]] = [[] for _ in range(args.polls + 1)]
+    bottle = 0
+    for p in range(args.polls):
+        for _ in range(args.blobs_per_poll // 2):
+            polls[p].append(("tap", f"bottle_{bottle:08d}_tap.jpg"))
+            if rng.random() >= args.orphan_rate:
+                polls[p + rng.randint(0, 1)].append(("level", f"bottle_{bottle:08d}_level.jpg"))
+            bottle += 1
+    return polls
+
+
+def _run_dicts(polls) -> tuple[int, int]:
+    pending = {"tap": {}, "level": {}}
+    paired = 0
+    for blobs in polls:
+        candidates = set()
+        for kind, blob in blobs:
+            bottle_id = _legacy_bottle_id(blob)
+            pending[kind][bottle_id] = blob
+            candidates.add(bottle_id)
+        for bottle_id in sorted(b for b in candidates if b in pending["tap"] and b in pending["level"]):
+            pending["tap"].pop(bottle_id)
+            pending["level"].pop(bottle_id)
+            paired += 1
+    return paired, len(pending["tap"]) + len(pending["level"])
+
+
+def _run_index(polls, ttl_polls: int) -> tuple[int, int]:
+    index = PairingIndex("bench", orphan_ttl_s=ttl_polls)
+    paired = 0
+    for now, blobs in enumerate(polls):
+        ready = []
+        for kind, blob in blobs:
+            bottle_id, _ = parse_blob_name(blob)
+            pair = index.add(bottle_id, kind, blob, seen_at=now)
+            if pair is not None:
+                ready.append(bottle_id)
+        index.expire(now)
+        ready.sort()
+        paired += len(ready)
+    return paired, len(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste del emparejado TAP + LEVEL")
+    parser.add_argument("--polls", type=int, default=2000)
+    parser.add_argument("--blobs-per-poll", type=int, default=20)
+    parser.add_argument("--orphan-rate", type=float, default=0.01, help="Fracción de botellas sin LEVEL")
+    parser.add_argument("--ttl-polls", type=int, default=50, help="Caducidad de huérfanas (en polls)")
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    polls = _polls(args)
+    blobs = sum(len(p) for p in polls)
+    rows = []
+    for mode, run in (("dicts", lambda: _run_dicts(polls)), ("index", lambda: _run_index(polls, args.ttl_polls))):
+        start = time.perf_counter()
+        paired, left = run()
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "mode": mode,
+            "blobs": blobs,
+            "paired": paired,
+            "left_pending": left,
+            "us_per_blob": round(elapsed * 1e6 / blobs, 3),
+        })
+
+    print_table(rows)
+    write_json(args.json, {"benchmark": "pairing", "config": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Descarga anticipada de imágenes del blob_watcher (app.prefetch).
+
+Lanza el blob_watcher real sobre un Blob local con `--read-ms` de latencia
+simulada por descarga y el stub de scoring. Una cámara escribe `--bottles`
+botellas a `--rate` por segundo: primero la TAP y `--gap-ms` después la
+LEVEL. Compara:
+
+- off: la botella se descarga entera cuando el watcher ve la pareja
+- on:  cada imagen se empieza a descargar en cuanto se descubre
+
+`pair_to_result` va desde que se escribe la segunda imagen hasta que el
+resultado se publica (lo que ve el operario); `download_ms_avg` es la
+espera de la etapa "download" del pipeline.
+
+La imagen que completa la pareja se descubre a la vez que la botella, así
+que con el pipeline libre solo se ahorra la descarga de la primera (las
+dos iban en paralelo). La ganancia grande es con el pipeline ocupado
+(`--concurrency` bajo o `--rate` alto): las descargas se hacen mientras
+la botella espera en la cola y no ocupan a los workers.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_prefetch --bottles 200 --rate 20 --read-ms 80 --gap-ms 150
+    python -m benchmarks.bench_prefetch --rate 30 --concurrency 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ._stats import free_port, latency_summary, print_table, synthetic_frames, wait_for_port, write_json
+
+MODES = ("off", "on")
+
+
+def _camera(args, frames: list[bytes], written: dict[str, float]):
+    """Escribe TAP y, `gap_ms` después, LEVEL de cada botella (hilo aparte)."""
+    from app.blob_client import _write_local
+
+    events = []
+    for i in range(args.bottles):
+        events.append((i / args.rate, "tap", i))
+        events.append((i / args.rate + args.gap_ms / 1000, "level", i))
+    events.sort()
+    t0 = time.perf_counter()
+    for at, kind, i in events:
+        delay = t0 + at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        bottle_id = f"bottle_{i:06d}"
+        _write_local(f"images-{kind}", f"{bottle_id}_{kind}.jpg", frames[i % len(frames)])
+        written[bottle_id] = time.perf_counter()  # la última en llegar completa la pareja
+
+
+async def _run_child(args) -> dict:
+    from app import blob_client, pipeline, prefetch, processor
+    from app.blob_watcher import watch_containers
+    from app.metrics import metrics
+
+    read = blob_client.read_image_bytes
+
+    def slow_read(container, blob_name):
+        time.sleep(args.read_ms / 1000)
+        return read(container, blob_name)
+
+    processor.read_image_bytes = slow_read
+    prefetch.read_image_bytes = slow_read
+
+    published: dict[str, float] = {}
+    publish = pipeline.publish_result
+
+    async def timed_publish(final_result):
+        published[final_result["bottle_id"]] = time.perf_counter()
+        return await publish(final_result)
+
+    pipeline.publish_result = timed_publish
+
+    event = asyncio.Event()
+    event.set()
+    task = asyncio.create_task(watch_containers(lambda: True, event))
+    while pipeline.get_active_pipeline() is None:
+        await asyncio.sleep(0.01)
+
+    frames = synthetic_frames(8, args.width, args.height, noise=4.0)
+    written: dict[str, float] = {}
+    camera = threading.Thread(target=_camera, args=(args, frames, written), daemon=True)
+    camera.start()
+    deadline = time.monotonic() + args.bottles / args.rate + 60
+    while len(published) < args.bottles and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    latencies = [published[b] - written[b] for b in published if b in written]
+    _, download_s, downloads = metrics.stage_seconds.labels("download").snapshot()
+    summary = latency_summary(latencies)
+    stats = prefetch.prefetch_cache.stats()
+    return {
+        "bottles": len(published),
+        "pair_to_result_p50_ms": summary["p50_ms"],
+        "pair_to_result_p95_ms": summary["p95_ms"],
+        "pair_to_result_p99_ms": summary["p99_ms"],
+        "download_ms_avg": round(1000 * download_s / downloads, 1) if downloads else 0.0,
+        "hit_rate": stats["hit_rate"],
+        "waited": stats["waited"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Descarga anticipada de imágenes")
+    parser.add_argument("--bottles", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20.0, help="Botellas/s")
+    parser.add_argument("--gap-ms", type=float, default=150.0, help="Retraso de la LEVEL respecto a la TAP")
+    parser.add_argument("--read-ms", type=float, default=80.0, help="Latencia simulada de una descarga")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latencia simulada de Azure ML")
+    parser.add_argument("--concurrency", type=int, default=4, help="PIPELINE_CONCURRENCY")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    if args.run:
+        # Subproceso: la configuración (PREFETCH_ENABLED, Blob local...) viene en el entorno
+        print(json.dumps(asyncio.run(_run_child(args))), flush=True)
+        return
+
+    port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_scoring_server",
+         "--port", str(port), "--latency-ms", str(args.latency_ms)],
+        stdout=subprocess.DEVNULL,
+    )
+    wait_for_port(port)
+    url = f"http://127.0.0.1:{port}/score"
+
+    rows = []
+    try:
+        for mode in args.modes:
+            with tempfile.TemporaryDirectory() as root:
+                env = {
+                    **os.environ,
+                    "PREFETCH_ENABLED": "true" if mode == "on" else "false",
+                    "BLOB_LOCAL_ROOT": root,
+                    "BLOB_LEDGER_PATH": os.path.join(root, "ledger.sqlite3"),
+                    "RESULT_STORE_PATH": "",
+                    "BLOB_POLL_INTERVAL_S": "0.05",
+                    "PIPELINE_CONCURRENCY": str(args.concurrency),
+                    "AZURE_ML_ENDPOINT_TAP": f"{url}?label=tap_present",
+                    "AZURE_ML_ENDPOINT_LEVEL": f"{url}?label=ok",
+                    "AZURE_ML_KEY_TAP": "bench",
+                    "AZURE_ML_KEY_LEVEL": "bench",
+                    "RESULT_CACHE_MAX_ENTRIES": "0",
+                }
+                child = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_prefetch", "--run", *sys.argv[1:]],
+                    env=env, capture_output=True, text=True, check=True,
+                )
+                rows.append({"mode": mode, **json.loads(child.stdout.strip().splitlines()[-1])})
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print_table(rows)
+    write_json(args.json, {"benchmark": "prefetch", "config": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark del preproceso de imágenes (app.preprocessing) por botella.
+
+Con frames sintéticos de alta resolución compara el camino original (se
+envían los bytes de cámara tal cual y reportlab vuelve a decodificarlos para
+el PDF) con el preprocesado (decodificar una vez, reducir y re-codificar;
+el mismo JPEG va al endpoint y al PDF). Por botella (TAP + LEVEL) mide:
+
+- payload_kb: cuerpo enviado al scoring (formato hex, el de producción)
+- decodes / decoded_mpx: descodificaciones en nuestro proceso y megapíxeles
+  descodificados (reportlab decodifica cada imagen para calcular su huella)
+- prep_ms / pdf_ms / model_input_ms: CPU de cada etapa
+- cpu_ms_per_bottle: suma de las etapas (model_input solo con --onnx)
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_preprocessing --bottles 10 --width 4032 --height 3024
+"""
+import argparse
+import time
+
+from PIL import ImageFile
+
+from ._stats import print_table, synthetic_frames, write_json
+
+MODES = ("raw", "preprocessed")
+
+_decodes = 0
+_decoded_pixels = 0
+_original_load = ImageFile.ImageFile.load
+
+
+def _counting_load(self):
+    """Cuenta las descodificaciones reales (load() con tiles pendientes)."""
+    global _decodes, _decoded_pixels
+    if self.tile:
+        _decodes += 1
+        # Con draft() el tamaño ya es el reducido que entrega el decoder
+        _decoded_pixels += self.size[0] * self.size[1]
+    return _original_load(self)
+
+
+def _run(mode: str, frames: list[bytes], args) -> dict:
+    global _decodes, _decoded_pixels
+    from app.azure_client import iter_payload
+    from app.pdf_generator import generate_error_pdf
+    from app.preprocessing import payload_bytes, preprocess_image, to_model_input
+
+    result = {"label": "tap_missing", "confidence": 0.91}
+    payload = prep = pdf = model_input = pdf_size = 0.0
+    _decodes = _decoded_pixels = 0
+
+    for i in range(args.bottles):
+        images = [frames[(2 * i) % len(frames)], frames[(2 * i + 1) % len(frames)]]
+
+        start = time.process_time()
+        if mode == "preprocessed":
+            images = [preprocess_image(image, args.short_side) for image in images]
+        prep += time.process_time() - start
+
+        payload += sum(iter_payload(payload_bytes(image), "hex")[0] for image in images)
+
+        if args.onnx:
+            start = time.process_time()
+            to_model_input(images, 224)
+            model_input += time.process_time() - start
+
+        start = time.process_time()
+        # Sin miniaturas del PDF: aquí se mide solo el efecto del preproceso
+        buffer = generate_error_pdf(
+            f"bottle_{i:06d}", result, result, payload_bytes(images[0]), payload_bytes(images[1]),
+            thumbnail_px=0,
+        )
+        pdf += time.process_time() - start
+        pdf_size += len(buffer.getvalue())
+
+    n = args.bottles
+    return {
+        "mode": mode,
+        "payload_kb": round(payload / n / 1024, 1),
+        "decodes": round(_decodes / n, 1),
+        "decoded_mpx": round(_decoded_pixels / n / 1e6, 2),
+        "prep_ms": round(prep * 1000 / n, 2),
+        "model_input_ms": round(model_input * 1000 / n, 2),
+        "pdf_ms": round(pdf * 1000 / n, 2),
+        "pdf_kb": round(pdf_size / n / 1024, 1),
+        "cpu_ms_per_bottle": round((prep + model_input + pdf) * 1000 / n, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del preproceso de imágenes")
+    parser.add_argument("--bottles", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=4, help="Frames sintéticos distintos")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--format", choices=("JPEG", "PNG"), default="JPEG")
+    parser.add_argument("--short-side", type=int, default=256)
+    parser.add_argument("--onnx", action="store_true", help="Incluye el tensor NCHW del backend local")
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.frames, args.width, args.height, format=args.format, noise=4.0)
+    ImageFile.ImageFile.load = _counting_load
+    rows = [_run(mode, frames, args) for mode in MODES]
+
+    print_table(rows)
+    write_json(args.json, {
+        "benchmark": "preprocessing",
+        "frame": f"{args.width}x{args.height} {args.format}",
+        "results": rows,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark de los informes PDF de botellas FAIL (app.pdf_generator).
+
+Por botella mide el tiempo de render (CPU) y los bytes de salida en tres
+modos, con frames de cámara sintéticos a resolución completa:
+
+- original:   un PDF por botella con las imágenes tal cual (sin miniaturas)
+- thumbnails: un PDF por botella con miniaturas JPEG (REPORT_THUMBNAIL_PX)
+- batch:      un único PDF por lote de `--batch` botellas, con índice; la
+              plantilla de la página se escribe una sola vez por fichero
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_reports --bottles 40 --batch 40 --width 2592 --height 1944
+"""
+import argparse
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from ._stats import print_table, synthetic_frames, write_json
+
+MODES = ("original", "thumbnails", "batch")
+
+
+@dataclass
+class _Report:
+    bottle_id: str
+    tap_result: dict
+    level_result: dict
+    tap_image_bytes: bytes
+    level_image_bytes: bytes
+    created_at: datetime = field(default_factory=datetime.now)
+
+
+def _reports(frames: list[bytes], bottles: int) -> list[_Report]:
+    return [
+        _Report(
+            f"bottle_{i:06d}",
+            {"label": "tap_missing" if i % 2 else "tap_present", "confidence": 0.91},
+            {"label": "low" if i % 3 else "ok", "confidence": 0.87},
+            frames[(2 * i) % len(frames)],
+            frames[(2 * i + 1) % len(frames)],
+        )
+        for i in range(bottles)
+    ]
+
+
+def _run(mode: str, reports: list[_Report], args) -> dict:
+    from app.config import REPORT_THUMBNAIL_PX
+    from app.pdf_generator import generate_batch_pdf, generate_error_pdf
+
+    thumbnail_px = 0 if mode == "original" else REPORT_THUMBNAIL_PX
+    files = 0
+    output = 0
+    start = time.process_time()
+    if mode == "batch":
+        for i in range(0, len(reports), args.batch):
+            output += len(generate_batch_pdf(reports[i:i + args.batch], thumbnail_px=thumbnail_px).getvalue())
+            files += 1
+    else:
+        for r in reports:
+            output += len(generate_error_pdf(
+                r.bottle_id, r.tap_result, r.level_result, r.tap_image_bytes, r.level_image_bytes,
+                thumbnail_px=thumbnail_px,
+            ).getvalue())
+            files += 1
+    cpu_s = time.process_time() - start
+
+    n = len(reports)
+    return {
+        "mode": mode,
+        "bottles": n,
+        "files": files,
+        "render_ms_per_bottle": round(cpu_s * 1000 / n, 2),
+        "kb_per_bottle": round(output / 1024 / n, 1),
+        "total_mb": round(output / 2**20, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los informes PDF")
+    parser.add_argument("--bottles", type=int, default=40)
+    parser.add_argument("--batch", type=int, default=40, help="Botellas por PDF en el modo batch")
+    parser.add_argument("--frames", type=int, default=6, help="Frames sintéticos distintos")
+    parser.add_argument("--width", type=int, default=2592)
+    parser.add_argument("--height", type=int, default=1944)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    reports = _reports(synthetic_frames(args.frames, args.width, args.height), args.bottles)
+    rows = [_run(mode, reports, args) for mode in args.modes]
+
+    print_table(rows)
+    write_json(args.json, {
+        "benchmark": "reports",
+        "frame": f"{args.width}x{args.height}",
+        "results": rows,
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Latencia de cola y disponibilidad del scoring con app.resilience.
+
+Lanza `--calls` predicciones a `--rate` por segundo contra el stub local
+con fallos inyectados y compara tres políticas del cliente:
+
+- plain:     sin hedging, sin reintentos, sin circuit breaker (lo de antes)
+- retries:   solo reintentos de errores transitorios
+- resilient: hedging al p95 + reintentos con presupuesto + circuit breaker
+
+Escenarios:
+- tail:   `--slow-rate` de las peticiones tarda `--slow-ms` más (réplica lenta)
+- errors: `--error-rate` de las peticiones responde HTTP 500
+- outage: el endpoint responde 503 a todo durante la primera mitad
+
+Cada llamada tiene el timeout por modelo del processor (`--timeout-s`); lo
+que no tiene veredicto (timeout, error, circuito abierto) sería una botella
+DEGRADED. `stub_req_per_call` es la carga extra que mete la política.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_resilience --calls 400 --rate 40 --slow-ms 1500
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from app.azure_client import AsyncScoringClient, is_transient_error
+from app.resilience import CircuitOpenError, ResilientCaller, RetryBudget
+
+from ._stats import latency_summary, print_table, write_json
+from .stub_scoring_server import start_stub_server
+
+KEY_ENV = "BENCH_SCORING_KEY"
+SCENARIOS = ("tail", "errors", "outage")
+POLICIES = ("plain", "retries", "resilient")
+
+
+def _caller(policy: str, args) -> ResilientCaller:
+    return ResilientCaller(
+        policy,
+        RetryBudget(args.budget_ratio, min_per_s=1.0),
+        is_transient=is_transient_error,
+        hedge=policy == "resilient",
+        hedge_min_delay_s=0.02,
+        retries=0 if policy == "plain" else 2,
+        retry_backoff_s=0.02,
+        breaker_failures=5 if policy == "resilient" else 10**9,
+        breaker_open_s=1.0,
+    )
+
+
+async def _run(scenario: str, policy: str, args, server, image: bytes) -> dict:
+    client = AsyncScoringClient(server.url, KEY_ENV, payload_format="binary")
+    caller = _caller(policy, args)
+    # Calentamiento sin fallos: el p95 del hedging necesita historia
+    server.error_rate, server.slow_rate, server.down = 0.0, 0.0, False
+    for _ in range(30):
+        await caller.call(lambda: client.predict(image))
+
+    server.error_rate = args.error_rate if scenario == "errors" else 0.0
+    server.slow_rate = args.slow_rate if scenario == "tail" else 0.0
+    server.slow_s = args.slow_ms / 1000
+    server.down = scenario == "outage"
+    server.stats.reset()
+
+    latencies: list[float] = []
+    outcomes = {"ok": 0, "timeout": 0, "error": 0, "unavailable": 0}
+
+    async def one():
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(caller.call(lambda: client.predict(image)), args.timeout_s)
+            outcomes["ok"] += 1
+        except asyncio.TimeoutError:
+            outcomes["timeout"] += 1
+        except CircuitOpenError:
+            outcomes["unavailable"] += 1
+        except Exception:
+            outcomes["error"] += 1
+        latencies.append(time.perf_counter() - start)
+
+    async def recover():
+        await asyncio.sleep(args.calls / args.rate / 2)
+        server.down = False
+
+    recovery = asyncio.create_task(recover()) if scenario == "outage" else None
+    t0 = time.perf_counter()
+    tasks = []
+    for i in range(args.calls):
+        delay = t0 + i / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one()))
+    await asyncio.gather(*tasks)
+    if recovery is not None:
+        recovery.cancel()
+    await client.aclose()
+
+    summary = latency_summary(latencies)
+    stats = caller.stats()
+    return {
+        "scenario": scenario,
+        "policy": policy,
+        "verdict_pct": round(100 * outcomes["ok"] / args.calls, 1),
+        "timeouts": outcomes["timeout"],
+        "errors": outcomes["error"],
+        "fast_fails": outcomes["unavailable"],
+        "p50_ms": summary["p50_ms"],
+        "p99_ms": summary["p99_ms"],
+        "stub_req_per_call": round(server.stats.as_dict()["requests"] / args.calls, 2),
+        "hedges": stats["hedges"],
+        "retries": stats["retries"],
+    }
+
+
+async def _main(args) -> list[dict]:
+    server = start_stub_server(latency_ms=args.latency_ms)
+    image = os.urandom(args.image_kb * 1024)
+    rows = []
+    for scenario in args.scenarios:
+        for policy in args.policies:
+            rows.append(await _run(scenario, policy, args, server, image))
+    server.shutdown()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de cola y disponibilidad del scoring")
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--rate", type=float, default=40.0, help="Llamadas/s")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="Latencia base del stub")
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=1500.0)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--timeout-s", type=float, default=1.0, help="Timeout por modelo del processor")
+    parser.add_argument("--budget-ratio", type=float, default=0.1, help="Fracción de peticiones extra")
+    parser.add_argument("--image-kb", type=int, default=30)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--policies", nargs="+", choices=POLICIES, default=list(POLICIES))
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    os.environ.setdefault(KEY_ENV, "bench")
+    rows = asyncio.run(_main(args))
+    print_table(rows)
+    write_json(args.json, {"benchmark": "resilience", "config": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Coste del histórico de resultados (app.result_store).
+
+Escritura: publica `--results` resultados a `--rate` por segundo y mide lo
+que tarda el registro en el camino de la inspección (publish_result):
+
+- none:   sin histórico (la referencia)
+- inline: un INSERT + commit en SQLite (WAL) por botella, en el llamador
+- store:  result_store.record() (deque + hilo escritor por lotes)
+
+Consulta: llena un histórico de `--rows` botellas y mide las consultas de
+/api/results (una página de `--page` filas, con y sin filtros, y la página
+`--deep-pages` siguiendo el cursor) y la exportación CSV/NDJSON en filas/s.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_results --results 5000 --rate 1000 --rows 200000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from ._stats import latency_summary, percentile, print_table, write_json
+
+MODES = ("none", "inline", "store")
+STATUSES = ("PASS", "PASS", "PASS", "PASS", "FAIL", "DEGRADED")
+
+
+def _result(i: int, rng: random.Random) -> dict:
+    return {
+        "bottle_id": f"bottle_{i:08d}",
+        "timestamp": "",
+        "status": rng.choice(STATUSES),
+        "tap": {"label": rng.choice(("tap_present", "tap_missing")), "confidence": rng.random(), "image": f"bottle_{i:08d}_tap.jpg"},
+        "level": {"label": rng.choice(("ok", "low", "full")), "confidence": rng.random(), "image": f"bottle_{i:08d}_level.jpg"},
+    }
+
+
+def _inline_writer(path: str):
+    from app.result_store import _INSERT, _SCHEMA
+
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(_SCHEMA)
+
+    def record(result: dict):
+        tap, level = result["tap"], result["level"]
+        with db:
+            db.execute(_INSERT, (
+                time.time(), result["bottle_id"], result["status"],
+                tap["label"], tap["confidence"], level["label"], level["confidence"],
+                tap["image"], level["image"],
+            ))
+
+    return record, db.close
+
+
+def _run_writes(mode: str, args, workdir: str) -> dict:
+    from app.result_store import ResultStore
+
+    path = os.path.join(workdir, f"writes_{mode}.sqlite3")
+    store = None
+    if mode == "inline":
+        record, close = _inline_writer(path)
+    elif mode == "store":
+        store = ResultStore(path)
+        record, close = store.record, store.close
+    else:
+        record, close = (lambda result: None), (lambda: None)
+
+    rng = random.Random(1)
+    results = [_result(i, rng) for i in range(args.results)]
+    latencies = []
+    t0 = time.perf_counter()
+    for i, result in enumerate(results):
+        delay = t0 + i / args.rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        start = time.perf_counter()
+        record(result)
+        latencies.append(time.perf_counter() - start)
+    flush_s = 0.0
+    if store is not None:
+        start = time.perf_counter()
+        store.flush()
+        flush_s = time.perf_counter() - start
+    stats = store.stats() if store is not None else {}
+    close()
+
+    summary = latency_summary(latencies)
+    return {
+        "mode": mode,
+        "results": args.results,
+        "record_p50_us": round(percentile(latencies, 50) * 1e6, 1),
+        "record_p99_us": round(percentile(latencies, 99) * 1e6, 1),
+        "record_max_ms": round(max(latencies) * 1000, 2),
+        "p99_ms": summary["p99_ms"],
+        "final_flush_ms": round(flush_s * 1000, 1),
+        "flushes": stats.get("flushes", ""),
+        "dropped": stats.get("dropped", ""),
+    }
+
+
+def _fill(store, rows: int) -> float:
+    """Histórico de `rows` botellas repartidas en la última semana; devuelve el primer ts."""
+    rng = random.Random(2)
+    first = time.time() - 7 * 24 * 3600
+    step = 7 * 24 * 3600 / rows
+    for i in range(rows):
+        store.record(_result(i, rng), now=first + i * step)
+        if len(store._pending) >= store.batch_size * 4:
+            store.flush(timeout_s=60)
+    store.flush(timeout_s=60)
+    return first
+
+
+def _timed(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return round(percentile(times, 50) * 1000, 3)
+
+
+def _run_queries(args, workdir: str) -> list[dict]:
+    from app.result_store import ResultStore
+
+    store = ResultStore(os.path.join(workdir, "queries.sqlite3"), batch_size=5000)
+    start = time.perf_counter()
+    first = _fill(store, args.rows)
+    fill_s = time.perf_counter() - start
+
+    def deep(**filters):
+        cursor = None
+        for _ in range(args.deep_pages):
+            _, cursor = store.query(cursor=cursor, limit=args.page, **filters)
+
+    day = first + 3 * 24 * 3600
+    queries = {
+        "latest": lambda: store.query(limit=args.page),
+        "status=FAIL": lambda: store.query(status="FAIL", limit=args.page),
+        "tap label": lambda: store.query(label="tap_missing", model="tap", limit=args.page),
+        "label (any model)": lambda: store.query(label="low", limit=args.page),
+        "bottle_id": lambda: store.query(bottle_id=f"bottle_{args.rows // 2:08d}"),
+        "1h range, FAIL": lambda: store.query(since=day, until=day + 3600, status="FAIL", limit=args.page),
+        f"{args.deep_pages} pages by cursor": lambda: deep(status="FAIL"),
+    }
+    rows = [
+        {"query": name, "rows_in_store": args.rows, "ms_p50": _timed(fn, args.repeats), "rows_per_s": ""}
+        for name, fn in queries.items()
+    ]
+    for fmt in ("csv", "ndjson"):
+        start = time.perf_counter()
+        exported = sum(chunk.count("\n") for chunk in store.export(fmt, since=day, until=day + 24 * 3600))
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "query": f"export {fmt} (1 day)",
+            "rows_in_store": args.rows,
+            "ms_p50": round(elapsed * 1000, 1),
+            "rows_per_s": int(exported / elapsed),
+        })
+    store.close()
+    print(f"Histórico de {args.rows} filas escrito en {fill_s:.1f}s ({int(args.rows / fill_s)} filas/s)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste del histórico de resultados")
+    parser.add_argument("--results", type=int, default=5000, help="Resultados publicados (escritura)")
+    parser.add_argument("--rate", type=float, default=1000.0, help="Resultados/s")
+    parser.add_argument("--rows", type=int, default=200_000, help="Filas del histórico (consultas)")
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--deep-pages", type=int, default=20)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        writes = [_run_writes(mode, args, workdir) for mode in args.modes]
+        queries = _run_queries(args, workdir) if args.rows else []
+
+    print_table(writes)
+    print()
+    print_table(queries)
+    write_json(args.json, {"benchmark": "results", "config": vars(args), "writes": writes, "queries": queries})
+
+
+if __name__ == "__main__":
+    main()
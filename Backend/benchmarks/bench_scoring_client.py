@@ -0,0 +1,80 @@
+"""
+Benchmark del cliente de scoring contra el servidor stub local.
+
+Compara el cliente original (requests.post sin sesión + payload hex) con
+ScoringClient (pool keep-alive) en cada formato de payload. Mide bytes
+enviados por petición, conexiones abiertas y latencia p50/p99.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_scoring_client --requests 200 --image-kb 400
+"""
+import argparse
+import os
+import time
+
+import requests
+
+from app.azure_client import PAYLOAD_FORMATS, ScoringClient
+
+from ._stats import latency_summary, print_table, write_json
+from .stub_scoring_server import start_stub_server
+
+KEY_ENV = "BENCH_SCORING_KEY"
+
+
+def _legacy_predict(url: str, image_bytes: bytes):
+    """Réplica del cliente original: conexión nueva y hex por llamada."""
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {os.environ[KEY_ENV]}",
+    }
+    response = requests.post(url, headers=headers, json={"image": image_bytes.hex()})
+    response.raise_for_status()
+    return response.json()
+
+
+def _run(name: str, server, predict, image_bytes: bytes, n: int) -> dict:
+    predict(image_bytes)  # calentamiento
+    server.stats.reset()
+
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        predict(image_bytes)
+        latencies.append(time.perf_counter() - start)
+
+    stats = server.stats.as_dict()
+    return {
+        "client": name,
+        "bytes_per_request": stats["bytes_received"] // max(1, stats["requests"]),
+        "new_connections": stats["connections"],
+        **latency_summary(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del cliente de scoring")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--image-kb", type=int, default=400)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    os.environ.setdefault(KEY_ENV, "bench")
+    server = start_stub_server(latency_ms=args.latency_ms)
+    # Bytes aleatorios: tan poco comprimibles como un JPEG real
+    image_bytes = os.urandom(args.image_kb * 1024)
+
+    rows = [_run("legacy-hex", server, lambda b: _legacy_predict(server.url, b), image_bytes, args.requests)]
+    for payload_format in PAYLOAD_FORMATS:
+        client = ScoringClient(server.url, KEY_ENV, payload_format=payload_format)
+        rows.append(_run(f"pooled-{payload_format}", server, client.predict, image_bytes, args.requests))
+        client.close()
+
+    server.shutdown()
+    print_table(rows)
+    write_json(args.json, {"benchmark": "scoring_client", "image_kb": args.image_kb, "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Coste de las subidas a Blob Storage para quien las pide (app.blob_client).
+
+Simula un Blob lento (`--latency-ms` por petición + `--mb-per-s` de ancho de
+banda, con sleep en el hilo que sube) y compara tres formas de subir
+`--uploads` PDFs de `--size-kb` KB que llegan a `--rate` por segundo:
+
+- inline:   upload_pdf() directamente en el event loop (el antiguo
+            /upload-error-pdf): bloquea el loop entero
+- executor: run_in_executor(None, upload_pdf) esperando el resultado (el
+            antiguo report_worker): no bloquea, pero el llamador espera
+            la subida y ocupa hilos del executor por defecto
+- service:  upload_service.submit_nowait() (cola acotada en segundo plano)
+
+`caller_p99_ms` es lo que tarda el llamador (la petición HTTP o el worker)
+y `loop_lag_max_ms` el peor retraso de un tick de 10 ms del event loop,
+es decir, lo que notan el pipeline y los WebSocket.
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_uploads --uploads 200 --rate 50 --latency-ms 80
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from ._stats import latency_summary, print_table, write_json
+
+MODES = ("inline", "executor", "service")
+
+
+def _slow_blob(args):
+    """Sustituye la escritura del blob por una con latencia y ancho de banda simulados."""
+    from app import blob_client
+
+    write_local = blob_client._write_local
+
+    def slow_write(container, blob_name, data):
+        time.sleep(args.latency_ms / 1000 + len(data) / (args.mb_per_s * 2**20))
+        write_local(container, blob_name, data)
+
+    blob_client._write_local = slow_write
+
+
+async def _loop_lag(samples: list[float], tick_s: float = 0.01):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(tick_s)
+        samples.append(time.perf_counter() - start - tick_s)
+
+
+async def _run(mode: str, args, payload: bytes) -> dict:
+    from app.blob_client import UploadService, upload_pdf
+    from app.config import CONTAINER_ERRORS
+
+    loop = asyncio.get_running_loop()
+    service = UploadService(workers=args.workers, queue_size=args.uploads)
+    lag: list[float] = []
+    caller: list[float] = []
+    pending: list = []
+    ticker = asyncio.create_task(_loop_lag(lag))
+
+    async def one(i: int):
+        name = f"{mode}_{i:06d}.pdf"
+        start = time.perf_counter()
+        if mode == "inline":
+            upload_pdf(name, payload)
+        elif mode == "executor":
+            await loop.run_in_executor(None, upload_pdf, name, payload)
+        else:
+            pending.append(service.submit_nowait(CONTAINER_ERRORS, name, payload).done)
+        caller.append(time.perf_counter() - start)
+
+    t0 = time.perf_counter()
+    tasks = []
+    for i in range(args.uploads):
+        delay = t0 + i / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+    await asyncio.gather(*pending)
+    elapsed = time.perf_counter() - t0
+    ticker.cancel()
+    await service.stop()
+
+    summary = latency_summary(caller)
+    return {
+        "mode": mode,
+        "uploads": args.uploads,
+        "caller_p50_ms": summary["p50_ms"],
+        "caller_p99_ms": summary["p99_ms"],
+        "loop_lag_max_ms": round(max(lag, default=0.0) * 1000, 1),
+        "uploads_per_s": round(args.uploads / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste de las subidas a Blob Storage")
+    parser.add_argument("--uploads", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50.0, help="Subidas/s pedidas")
+    parser.add_argument("--size-kb", type=int, default=64)
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="Latencia simulada por petición")
+    parser.add_argument("--mb-per-s", type=float, default=20.0, help="Ancho de banda simulado")
+    parser.add_argument("--workers", type=int, default=4, help="Workers del UploadService")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        os.environ["BLOB_LOCAL_ROOT"] = root
+        _slow_blob(args)
+        payload = os.urandom(args.size_kb * 1024)
+        rows = [asyncio.run(_run(mode, args, payload)) for mode in args.modes]
+
+    print_table(rows)
+    write_json(args.json, {"benchmark": "uploads", "config": vars(args), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
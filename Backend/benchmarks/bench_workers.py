@@ -0,0 +1,141 @@
+"""
+Benchmark del reparto de botellas entre workers (app.sharding).
+
+Lanza N procesos con el blob_watcher real (WORKER_COUNT=N, un slot cada
+uno) sobre el mismo Blob local y el stub de scoring, deja `--bottles`
+botellas (frames JPEG sintéticos, así el preproceso pone la CPU) y mide el
+tiempo hasta que todas están publicadas. Cada worker solo procesa su shard,
+así que en una máquina con varios núcleos el throughput debería crecer de
+forma casi lineal con N (con un solo núcleo no puede).
+
+Uso (desde Backend/):
+    python -m benchmarks.bench_workers --bottles 200 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from ._stats import free_port, print_table, synthetic_frames, wait_for_port, write_json
+
+
+async def _run_worker(args):
+    from app import processor
+    from app.blob_watcher import watch_containers
+    from app.pipeline import get_active_pipeline
+    from app.sharding import coordinator, shard_of
+
+    coordinator.acquire()
+    expected = sum(
+        1 for i in range(args.bottles)
+        if shard_of(f"bottle_{i:06d}", coordinator.worker_count) == coordinator.index
+    )
+    event = asyncio.Event()
+    event.set()
+    task = asyncio.create_task(watch_containers(lambda: True, event))
+    while get_active_pipeline() is None:
+        await asyncio.sleep(0.01)
+    print("READY", flush=True)
+
+    cpu_start = time.process_time()
+    while processor.bottle_counter < expected:
+        await asyncio.sleep(0.01)
+    end = time.time()
+    cpu_s = time.process_time() - cpu_start
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    coordinator.release()
+    return {"index": coordinator.index, "bottles": expected, "end": end, "cpu_s": cpu_s}
+
+
+def _run(workers: int, frames: list[bytes], url: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as root:
+        env = {
+            **os.environ,
+            "BLOB_LOCAL_ROOT": root,
+            "BLOB_LEDGER_PATH": os.path.join(root, "ledger.sqlite3"),
+            "BLOB_POLL_INTERVAL_S": "0.05",
+            "WORKER_COUNT": str(workers),
+            "WORKER_COORD_PATH": os.path.join(root, "workers.sqlite3"),
+            "AZURE_ML_ENDPOINT_TAP": f"{url}?label=tap_present",
+            "AZURE_ML_ENDPOINT_LEVEL": f"{url}?label=ok",
+            "AZURE_ML_KEY_TAP": "bench",
+            "AZURE_ML_KEY_LEVEL": "bench",
+            "RESULT_CACHE_MAX_ENTRIES": "0",
+        }
+        procs = [
+            subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.bench_workers", "--run", "--bottles", str(args.bottles)],
+                env={**env, "WORKER_INDEX": str(i)},
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+            )
+            for i in range(workers)
+        ]
+        for proc in procs:
+            if proc.stdout.readline().strip() != "READY":
+                raise RuntimeError("Un worker no ha arrencat")
+
+        # Las botellas llegan después de que los watchers hayan saltado el histórico
+        start = time.time()
+        for i in range(args.bottles):
+            for kind in ("tap", "level"):
+                directory = os.path.join(root, f"images-{kind}")
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, f"bottle_{i:06d}_{kind}.jpg"), "wb") as f:
+                    f.write(frames[(2 * i + (kind == "level")) % len(frames)])
+
+        results = [json.loads(proc.communicate()[0].strip().splitlines()[-1]) for proc in procs]
+
+    elapsed = max(r["end"] for r in results) - start
+    return {
+        "workers": workers,
+        "bottles": sum(r["bottles"] for r in results),
+        "per_worker": "/".join(str(r["bottles"]) for r in sorted(results, key=lambda r: r["index"])),
+        "elapsed_s": round(elapsed, 2),
+        "bottles_per_s": round(args.bottles / elapsed, 1),
+        "cpu_s": round(sum(r["cpu_s"] for r in results), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del reparto entre workers")
+    parser.add_argument("--bottles", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="Latencia simulada de Azure ML")
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="Fichero donde guardar los resultados")
+    args = parser.parse_args()
+
+    if args.run:
+        # Subproceso: WORKER_INDEX y el resto de la configuración vienen en el entorno
+        print(json.dumps(asyncio.run(_run_worker(args))), flush=True)
+        return
+
+    port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.stub_scoring_server",
+         "--port", str(port), "--latency-ms", str(args.latency_ms)],
+        stdout=subprocess.DEVNULL,
+    )
+    wait_for_port(port)
+
+    frames = synthetic_frames(8, args.width, args.height, noise=4.0)
+    try:
+        rows = [_run(n, frames, f"http://127.0.0.1:{port}/score", args) for n in args.workers]
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print_table(rows)
+    write_json(args.json, {"benchmark": "workers", "cpus": os.cpu_count(), "results": rows})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Servidor de scoring local que imita un endpoint de Azure ML.
+
+Acepta los tres formatos de payload de app.azure_client (hex, base64,
+binary) y responde {"class": ..., "confidence": ...}; la clase es --label o
+el parámetro ?label= de la URL. También acepta peticiones batch
+({"images": [...]}) y responde {"results": [...]}. Cuenta los bytes
+recibidos y las conexiones abiertas para poder comparar clientes.
+
+La latencia simulada es latency_ms + per_image_ms * imágenes, para poder
+estudiar el compromiso throughput/latencia del micro-batching.
+
+Para pruebas de carga: --error-rate responde HTTP 500 a esa fracción de
+peticiones, y ?fail_label=...&fail_rate=0.1 devuelve la etiqueta de defecto
+a esa fracción de imágenes (botellas FAIL -> informes PDF). ?confidence=
+fija la confianza de todas las respuestas (umbrales de la cascada).
+
+Inyección de fallos (app.resilience): --slow-rate añade --slow-ms a esa
+fracción de peticiones (cola de latencia, una réplica lenta) y `down` hace
+que todas respondan HTTP 503 al instante. Se cambian en caliente con
+POST /faults {"error_rate": .., "slow_rate": .., "slow_ms": .., "down": ..}.
+
+Uso:
+    python -m benchmarks.stub_scoring_server --port 8801 --latency-ms 20
+"""
+import argparse
+import base64
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.connections = 0
+            self.bytes_received = 0
+            self.images = 0
+            self.errors = 0
+            self.slow = 0
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "bytes_received": self.bytes_received,
+                "images": self.images,
+                "errors": self.errors,
+                "slow": self.slow,
+            }
+
+
+def _decode(value: str, encoding: str | None) -> bytes:
+    if encoding == "base64":
+        return base64.b64decode(value)
+    return bytes.fromhex(value)
+
+
+def decode_images(body: bytes, content_type: str) -> tuple[list[bytes], bool]:
+    """Devuelve (imágenes, es_batch)."""
+    if content_type.startswith("application/octet-stream"):
+        return [body], False
+    payload = json.loads(body)
+    encoding = payload.get("encoding")
+    if "images" in payload:
+        return [_decode(image, encoding) for image in payload["images"]], True
+    return [_decode(payload["image"], encoding)], False
+
+
+class StubScoringHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Sin Nagle: si no, cabeceras y cuerpo en writes separados + ACK
+    # retardado del cliente añaden ~40 ms a las conexiones reutilizadas
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats.lock:
+            self.server.stats.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.stats.as_dict())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _set_faults(self, body: bytes):
+        faults = json.loads(body or b"{}")
+        server = self.server
+        server.error_rate = float(faults.get("error_rate", server.error_rate))
+        server.slow_rate = float(faults.get("slow_rate", server.slow_rate))
+        server.slow_s = float(faults.get("slow_ms", server.slow_s * 1000)) / 1000
+        server.down = bool(faults.get("down", server.down))
+        self._send_json(200, server.faults())
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path == "/faults":
+            self._set_faults(body)
+            return
+        header_bytes = len(str(self.headers).encode("latin-1"))
+
+        images, is_batch = decode_images(body, self.headers.get("Content-Type", ""))
+
+        with self.server.stats.lock:
+            self.server.stats.requests += 1
+            self.server.stats.images += len(images)
+            self.server.stats.bytes_received += length + header_bytes
+
+        if self.server.down:
+            with self.server.stats.lock:
+                self.server.stats.errors += 1
+            self._send_json(503, {"error": "down"})
+            return
+
+        delay = self.server.latency_s + self.server.per_image_s * len(images)
+        if self.server.slow_rate and random.random() < self.server.slow_rate:
+            delay += self.server.slow_s
+            with self.server.stats.lock:
+                self.server.stats.slow += 1
+        if delay:
+            time.sleep(delay)
+
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            with self.server.stats.lock:
+                self.server.stats.errors += 1
+            self._send_json(500, {"error": "injected"})
+            return
+
+        # ?label=... en la URL permite un solo stub para los dos modelos
+        query = parse_qs(urlsplit(self.path).query)
+        label = query.get("label", [self.server.label])[0]
+        fail_label = query.get("fail_label", [None])[0]
+        fail_rate = float(query.get("fail_rate", ["0"])[0])
+        confidence = query.get("confidence", [None])[0]
+        results = [
+            {
+                "class": fail_label if fail_label and random.random() < fail_rate else label,
+                "confidence": float(confidence) if confidence else 0.5 + (len(image) % 50) / 100,
+            }
+            for image in images
+        ]
+        self._send_json(200, {"results": results} if is_batch else results[0])
+
+
+class StubScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        *,
+        latency_ms: float = 0.0,
+        per_image_ms: float = 0.0,
+        label: str = "ok",
+        error_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_ms: float = 0.0,
+        down: bool = False,
+    ):
+        super().__init__(address, StubScoringHandler)
+        self.latency_s = latency_ms / 1000
+        self.per_image_s = per_image_ms / 1000
+        self.label = label
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_s = slow_ms / 1000
+        self.down = down
+        self.stats = StubStats()
+
+    def handle_error(self, request, client_address):
+        # El cliente cancela peticiones a medias (hedging, timeouts): no es un error del stub
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def faults(self) -> dict:
+        return {
+            "error_rate": self.error_rate,
+            "slow_rate": self.slow_rate,
+            "slow_ms": self.slow_s * 1000,
+            "down": self.down,
+        }
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/score"
+
+
+def start_stub_server(port: int = 0, **kwargs) -> StubScoringServer:
+    """Arranca el servidor en un hilo daemon y lo devuelve (para benchmarks)."""
+    server = StubScoringServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8801)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--per-image-ms", type=float, default=0.0)
+    parser.add_argument("--label", default="ok")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones con HTTP 500")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fracción de peticiones lentas")
+    parser.add_argument("--slow-ms", type=float, default=0.0, help="Latencia extra de las peticiones lentas")
+    args = parser.parse_args()
+
+    server = StubScoringServer(
+        ("127.0.0.1", args.port),
+        latency_ms=args.latency_ms,
+        per_image_ms=args.per_image_ms,
+        label=args.label,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+    )
+    print(f"Stub scoring server a {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
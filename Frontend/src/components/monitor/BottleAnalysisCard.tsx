@@ -37,7 +37,9 @@ export function BottleAnalysisCard({ analysis }: BottleAnalysisCardProps) {
           "px-3 py-1 rounded-full text-xs font-bold",
           analysis.status === 'PASS'
             ? "bg-success text-success-foreground"
-            : "bg-destructive text-destructive-foreground"
+            : analysis.status === 'DEGRADED'
+              ? "bg-warning text-warning-foreground"
+              : "bg-destructive text-destructive-foreground"
         )}>
           {analysis.status}
         </span>
@@ -1,5 +1,5 @@
 import { useState, useEffect, useCallback, useRef } from 'react';
-import type { BottleAnalysis, WebSocketMessage } from '@/types/analysis';
+import type { BottleAnalysis, QualityStats, WebSocketMessage } from '@/types/analysis';
 
 // Allow overriding the WebSocket endpoint from .env (VITE_WS_URL).
 // Fallback: same hostname, port 8000, /ws path.
@@ -12,6 +12,7 @@ interface UseWebSocketReturn {
   isConnected: boolean;
   bottleAnalyses: BottleAnalysis[];
   bottlesProcessed: number;
+  qualityStats: QualityStats | null;
   connect: () => void;
   disconnect: () => void;
   clearResults: () => void;
@@ -27,6 +28,7 @@ export function useWebSocket(): UseWebSocketReturn {
   const [isConnected, setIsConnected] = useState(false);
   const [bottleAnalyses, setBottleAnalyses] = useState<BottleAnalysis[]>([]);
   const [bottlesProcessed, setBottlesProcessed] = useState(0);
+  const [qualityStats, setQualityStats] = useState<QualityStats | null>(null);
   const bottlesOffset = useRef(0); // Track offset when clearing
   const wsRef = useRef<WebSocket | null>(null);
 
@@ -47,8 +49,25 @@ export function useWebSocket(): UseWebSocketReturn {
           const message: WebSocketMessage = JSON.parse(event.data);
           console.log('📦 WebSocket message:', message);
 
-          if (message.type === 'analysis_result') {
-            const analysis = message.data;
+          if (message.type === 'quality_stats') {
+            setQualityStats(message.data);
+            return;
+          }
+
+          if (message.type === 'orphan_image') {
+            const orphan = message.data;
+            console.warn(`🧩 Ampolla ${orphan.bottle_id}: ${orphan.kind} sense ${orphan.missing} després de ${orphan.age_s}s`);
+            return;
+          }
+
+          // A batch frame carries several results in processing order
+          const analyses =
+            message.type === 'analysis_batch' ? message.data
+            : message.type === 'analysis_result' ? [message.data]
+            : [];
+          if (analyses.length === 0) return;
+
+          for (const analysis of analyses) {
             // Detect if has alert based on tap or level flags
             const tapHasAlert = hasAlertFlag(analysis.tap.label);
             const levelHasAlert = hasAlertFlag(analysis.level.label);
@@ -57,9 +76,11 @@ export function useWebSocket(): UseWebSocketReturn {
             analysis.hasAlert = hasAlert;
             console.log(`🍾 Botella #${analysis.bottle_id}: tap=${analysis.tap.label}, level=${analysis.level.label}, estado=${analysis.status}`);
             console.log(`   Alerta: ${hasAlert}, Total procesadas: ${analysis.bottles_processed}`);
-            setBottleAnalyses((prev) => [analysis, ...prev]);
-            setBottlesProcessed(Math.max(0, analysis.bottles_processed - bottlesOffset.current));
           }
+          const latest = analyses[analyses.length - 1];
+          const newestFirst = [...analyses].reverse();
+          setBottleAnalyses((prev) => [...newestFirst, ...prev]);
+          setBottlesProcessed(Math.max(0, latest.bottles_processed - bottlesOffset.current));
         } catch (error) {
           console.error('Error parsing WebSocket message:', error);
         }
@@ -110,6 +131,7 @@ export function useWebSocket(): UseWebSocketReturn {
     isConnected,
     bottleAnalyses,
     bottlesProcessed,
+    qualityStats,
     connect,
     disconnect,
     clearResults,
@@ -26,6 +26,7 @@ export default function Monitor() {
 
   const okCount = bottleAnalyses.filter(b => b.status === 'PASS').length;
   const failCount = bottleAnalyses.filter(b => b.status === 'FAIL').length;
+  const degradedCount = bottleAnalyses.filter(b => b.status === 'DEGRADED').length;
 
   return (
     <div className="min-h-screen bg-background">
@@ -84,6 +85,12 @@ export default function Monitor() {
                 <p className="text-sm text-muted-foreground">FAIL</p>
               </div>
             </div>
+            {degradedCount > 0 && (
+              <div className="bg-warning/10 border border-warning/30 rounded-xl p-4 text-center">
+                <p className="text-3xl font-bold text-warning">{degradedCount}</p>
+                <p className="text-sm text-muted-foreground">DEGRADAT (sense veredicte del model)</p>
+              </div>
+            )}
 
             {/* Clear Button */}
             <Button
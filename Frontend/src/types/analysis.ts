@@ -33,12 +33,46 @@ export interface BottleAnalysis {
   timestamp: string;
   tap: AnalysisData;
   level: AnalysisData;
-  status: 'PASS' | 'FAIL';
+  status: 'PASS' | 'FAIL' | 'DEGRADED'; // DEGRADED: some model gave no verdict
   bottles_processed: number;
   hasAlert: boolean;
 }
 
-export interface WebSocketMessage {
-  type: 'analysis_result';
-  data: BottleAnalysis;
+// Rolling quality statistics (GET /api/quality/stats, periodic over the WebSocket)
+export interface QualityWindowStats {
+  window_s: number;
+  total: number;
+  pass: number;
+  fail: number;
+  other: number;
+  reject_rate: number;
+  bottles_per_min: number;
+  labels: { tap: Record<string, number>; level: Record<string, number> }; // real verdicts only
+  // Labels without a verdict (timeout/unavailable/error, skipped/deferred by the cascade)
+  no_verdict: { tap: Record<string, number>; level: Record<string, number> };
+  confidence_histogram: { bin_edges: number[]; tap: number[]; level: number[] };
 }
+
+export interface QualityStats {
+  timestamp: number;
+  bucket_s: number;
+  total_since_start: number;
+  windows: Partial<Record<'1m' | '15m' | '1h', QualityWindowStats>>;
+}
+
+// An image whose pair never arrived within PAIRING_ORPHAN_TTL_S
+export interface OrphanImage {
+  bottle_id: string;
+  kind: 'tap' | 'level';
+  missing: 'tap' | 'level';
+  blob_name: string | null;
+  age_s: number;
+  source: 'blob' | 'push';
+}
+
+// With WS_BATCH_MAX > 1 the backend groups several results in one frame
+export type WebSocketMessage =
+  | { type: 'analysis_result'; data: BottleAnalysis }
+  | { type: 'analysis_batch'; data: BottleAnalysis[] }
+  | { type: 'quality_stats'; data: QualityStats }
+  | { type: 'orphan_image'; data: OrphanImage };